@@ -1,8 +1,20 @@
 import os
+import sys
+import time
+import asyncio
+import re
+import html
+import json
+import hashlib
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import inspect, text, select, delete, case, bindparam, Column, Integer, String, Text, DateTime, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+
+from prompts import render_stored_prompt, extract_prompt_params
+from metrics import register_collector
 
 load_dotenv()
 
@@ -16,44 +28,689 @@ print(f"Diretório de upload: {UPLOAD_DIR}")
 if not UPLOAD_DIR:
     raise ValueError("UPLOAD_DIR não configurada. Verifique as variáveis de ambiente.")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Distribui os arquivos em UPLOAD_DIR/ab/cd/ (hash do nome) para manter os
+# diretórios pequenos com muitos arquivos
+UPLOAD_SHARDING = os.getenv("UPLOAD_SHARDING", "true").lower() == "true"
+
+def upload_path(filename, create=True):
+    """
+    Caminho de gravação de um arquivo em UPLOAD_DIR (no subdiretório do
+    shard, criado se `create`).
+    """
+    if not UPLOAD_SHARDING:
+        return os.path.join(UPLOAD_DIR, filename)
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    directory = os.path.join(UPLOAD_DIR, digest[:2], digest[2:4])
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+# Pool de conexões
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Cria/migra o esquema na inicialização da API (desligue se rodar
+# `python database.py migrate` no deploy)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+# Registros por comando INSERT nas gravações em lote
+DB_BULK_CHUNK = int(os.getenv("DB_BULK_CHUNK", "500"))
+
+def _async_url(url):
+    """
+    Troca o driver síncrono da URL pelo assíncrono (asyncpg / aiosqlite),
+    mantendo URLs que já informam um driver.
+    """
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme:
+        return url
+    drivers = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+    return drivers.get(scheme, scheme) + sep + rest
+
+_pool_args = {"pool_pre_ping": DB_POOL_PRE_PING}
+if ":memory:" not in DATABASE_URL:
+    _pool_args.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+engine = create_async_engine(_async_url(DATABASE_URL), **_pool_args)
+# Uma sessão por requisição (ver get_session) ou por unidade de trabalho
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 Base = declarative_base()
 
+async def get_session():
+    """
+    Dependência do FastAPI: abre uma sessão para a requisição e a fecha ao final.
+    """
+    async with SessionLocal() as session:
+        yield session
+
+def _pool_metrics():
+    pool = engine.sync_engine.pool
+    samples = [
+        (name, getattr(pool, attr)())
+        for name, attr in (("size", "size"), ("checked_in", "checkedin"), ("checked_out", "checkedout"), ("overflow", "overflow"))
+        if hasattr(pool, attr)
+    ]
+    return [("smartnlp_db_pool_connections", "gauge", "Conexões do pool do banco por estado.",
+             [({"state": name}, value) for name, value in samples])]
+
+register_collector(_pool_metrics)
+
 class AudioRecord(Base):
     __tablename__ = "audio_records"
     id = Column(Integer, primary_key=True, index=True)
+    # Vazio quando o ciclo de vida do armazenamento já apagou o áudio
     audio_path = Column(String, nullable=False)
+    # Registros novos guardam só o template e os parâmetros; `prompt` fica
+    # com o texto completo apenas nos registros antigos
     prompt = Column(Text)
+    prompt_template = Column(String)
+    prompt_params = Column(Text)  # JSON
     transcription = Column(Text)
     llm_groq = Column(Text)
     llm_mistral = Column(Text)  
+    # Contexto da aula em colunas próprias (filtros e agregações sem
+    # interpretar o prompt)
+    turma = Column(String, index=True)
+    area_especialista = Column(String, index=True)
+    # Duração (ms) da chamada a cada LLM; None se o provedor não foi chamado,
+    # se a resposta veio do cache (ou registro anterior a esta coluna).
+    # Resposta None com duração preenchida indica erro do provedor.
+    llm_groq_ms = Column(Integer)
+    llm_mistral_ms = Column(Integer)
+
+# Provedores com colunas llm_<nome> e llm_<nome>_ms em AudioRecord
+ROLLUP_PROVIDERS = ("groq", "mistral")
+
+class AudioRecordRollup(Base):
+    """
+    Agregados de audio_records por turma e área, atualizados a cada gravação
+    (ver _update_rollups) para os relatórios não varrerem a tabela.
+    Registros sem turma/área entram com "".
+    """
+    __tablename__ = "audio_record_rollups"
+    turma = Column(String, primary_key=True)
+    area_especialista = Column(String, primary_key=True)
+    records = Column(Integer, nullable=False, default=0)
+    transcription_chars = Column(Integer, nullable=False, default=0)
+    groq_calls = Column(Integer, nullable=False, default=0)
+    groq_errors = Column(Integer, nullable=False, default=0)
+    groq_ms_total = Column(Integer, nullable=False, default=0)
+    mistral_calls = Column(Integer, nullable=False, default=0)
+    mistral_errors = Column(Integer, nullable=False, default=0)
+    mistral_ms_total = Column(Integer, nullable=False, default=0)
 
-Base.metadata.create_all(bind=engine)
+class TranscriptionCache(Base):
+    __tablename__ = "transcription_cache"
+    # Chave: hash do áudio + modelo + idioma (mudar modelo/idioma invalida a entrada)
+    audio_sha256 = Column(String(64), primary_key=True)
+    model = Column(String, primary_key=True)
+    language = Column(String, primary_key=True)
+    transcription = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+def _migrate_audio_records(conn):
+    """
+    Adiciona em tabelas já existentes as colunas criadas depois da versão
+    inicial (create_all não altera tabelas).
+    """
+    existing = {c["name"] for c in inspect(conn).get_columns("audio_records")}
+    for column in ("prompt_template", "prompt_params", "turma", "area_especialista", "llm_groq_ms", "llm_mistral_ms"):
+        if column not in existing:
+            column_type = AudioRecord.__table__.c[column].type.compile(conn.dialect)
+            conn.execute(text(f"ALTER TABLE audio_records ADD COLUMN {column} {column_type}"))
+    for column in ("turma", "area_especialista"):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_audio_records_{column} ON audio_records ({column})"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE audio_records ALTER COLUMN prompt DROP NOT NULL"))
+    if "turma" not in existing:
+        _backfill_context(conn)
+
+def _backfill_context(conn):
+    """
+    Preenche turma e área dos registros existentes a partir dos parâmetros
+    gravados ou, nos registros antigos, do texto do prompt.
+    """
+    table = AudioRecord.__table__
+    rows = conn.execute(
+        select(table.c.id, table.c.prompt, table.c.prompt_params)
+        .where((table.c.prompt_params.is_not(None)) | (table.c.prompt.is_not(None)))
+    ).all()
+    updates = []
+    for id, prompt, params_json in rows:
+        params = json.loads(params_json) if params_json else extract_prompt_params(prompt)[1]
+        if params and (params.get("turma") or params.get("area_especialista")):
+            updates.append({"_id": id, "turma": params.get("turma"), "area_especialista": params.get("area_especialista")})
+    for start in range(0, len(updates), DB_BULK_CHUNK):
+        conn.execute(
+            table.update().where(table.c.id == bindparam("_id")).values(
+                turma=bindparam("turma"), area_especialista=bindparam("area_especialista")),
+            updates[start:start + DB_BULK_CHUNK],
+        )
+
+def _rollup_columns(source):
+    """
+    Expressões de agregação de audio_records nas colunas de
+    audio_record_rollups (ver _rollup_delta, que faz a mesma conta em Python).
+    """
+    columns = {
+        "turma": func.coalesce(source.c.turma, ""),
+        "area_especialista": func.coalesce(source.c.area_especialista, ""),
+        "records": func.count(),
+        "transcription_chars": func.coalesce(func.sum(func.length(source.c.transcription)), 0),
+    }
+    for provider in ROLLUP_PROVIDERS:
+        ms = source.c[f"llm_{provider}_ms"]
+        called = ms.is_not(None)
+        columns[f"{provider}_calls"] = func.sum(case((called, 1), else_=0))
+        columns[f"{provider}_errors"] = func.sum(case((called & source.c[f"llm_{provider}"].is_(None), 1), else_=0))
+        columns[f"{provider}_ms_total"] = func.coalesce(func.sum(ms), 0)
+    return columns
+
+def _rebuild_rollups(conn):
+    """
+    Recalcula audio_record_rollups do zero (uma varredura de audio_records).
+    Usado na migração que cria a tabela.
+    """
+    columns = _rollup_columns(AudioRecord.__table__)
+    query = select(*(expr.label(name) for name, expr in columns.items())).group_by(columns["turma"], columns["area_especialista"])
+    conn.execute(delete(AudioRecordRollup.__table__))
+    conn.execute(AudioRecordRollup.__table__.insert().from_select(list(columns), query))
+
+# Colunas de texto indexadas na busca (ver search_audio_records)
+SEARCH_COLUMNS = ("transcription", "llm_groq", "llm_mistral")
+# Configuração de texto do PostgreSQL (stemming em português); a consulta
+# precisa usar a mesma da coluna gerada para casar os mesmos radicais
+SEARCH_TS_CONFIG = "portuguese"
+
+def _create_search_index(conn):
+    """
+    Índice de texto completo de audio_records:
+    - PostgreSQL: coluna tsvector gerada (transcrição com peso A, respostas
+      das LLMs com peso B) e índice GIN;
+    - SQLite: tabela virtual FTS5 com conteúdo externo, mantida por
+      triggers (sem stemming; acentos são ignorados).
+    """
+    if conn.dialect.name == "postgresql":
+        existing = {c["name"] for c in inspect(conn).get_columns("audio_records")}
+        if "search_vector" not in existing:
+            weights = {"transcription": "A", "llm_groq": "B", "llm_mistral": "B"}
+            vector = " || ".join(
+                f"setweight(to_tsvector('{SEARCH_TS_CONFIG}', coalesce({column}, '')), '{weight}')"
+                for column, weight in weights.items()
+            )
+            conn.execute(text(
+                f"ALTER TABLE audio_records ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED"
+            ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_audio_records_search ON audio_records USING GIN (search_vector)"
+        ))
+    elif conn.dialect.name == "sqlite":
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audio_records_fts'"
+        )).first()
+        if exists:
+            return
+        columns = ", ".join(SEARCH_COLUMNS)
+        new = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+        old = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE audio_records_fts USING fts5({columns}, content='audio_records', "
+            "content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER audio_records_fts_ai AFTER INSERT ON audio_records BEGIN "
+            f"INSERT INTO audio_records_fts(rowid, {columns}) VALUES (new.id, {new}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER audio_records_fts_ad AFTER DELETE ON audio_records BEGIN "
+            f"INSERT INTO audio_records_fts(audio_records_fts, rowid, {columns}) VALUES ('delete', old.id, {old}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER audio_records_fts_au AFTER UPDATE ON audio_records BEGIN "
+            f"INSERT INTO audio_records_fts(audio_records_fts, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO audio_records_fts(rowid, {columns}) VALUES (new.id, {new}); END"
+        ))
+        # Indexa os registros que já existiam
+        conn.execute(text("INSERT INTO audio_records_fts(audio_records_fts) VALUES ('rebuild')"))
+
+async def init_db():
+    """
+    Cria as tabelas que faltam e aplica as migrações. Chamado na
+    inicialização da API (DB_AUTO_MIGRATE) ou por `python database.py migrate`.
+    """
+    async with engine.begin() as conn:
+        new_rollups = not await conn.run_sync(lambda c: inspect(c).has_table(AudioRecordRollup.__tablename__))
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate_audio_records)
+        await conn.run_sync(_create_search_index)
+        if new_rollups:
+            await conn.run_sync(_rebuild_rollups)
+
+async def close_db():
+    """
+    Fecha as conexões do pool.
+    """
+    await engine.dispose()
+
+def _upsert(session, model, rows, increment=False):
+    """
+    Monta um INSERT ... ON CONFLICT DO UPDATE (PostgreSQL/SQLite) para as
+    linhas `rows` (dicts), atualizando todas as colunas informadas que não
+    são chave primária (com `increment`, somando os valores aos atuais).
+    """
+    dialect = session.bind.dialect.name
+    insert = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f"Upsert não suportado para o banco {dialect}.")
+    keys = [c.name for c in model.__table__.primary_key.columns]
+    stmt = insert(model.__table__).values(rows)
+    if increment:
+        updates = {name: model.__table__.c[name] + stmt.excluded[name] for name in rows[0] if name not in keys}
+    else:
+        updates = {name: stmt.excluded[name] for name in rows[0] if name not in keys}
+    return stmt.on_conflict_do_update(index_elements=keys, set_=updates)
 
 ALLOWED_EXTENSIONS = [".wav", ".mp3", ".flac", ".ogg", ".m4a", ".aac", ".webm"]
 
-def create_or_update_audio_record(id, prompt, audio_path, transcription, llm_groq, llm_mistral):
-    db = SessionLocal()
-    try:
-        audio_record = AudioRecord(
-            id=id,
-            audio_path=audio_path,
-            prompt=prompt,
-            transcription=transcription,
-            llm_groq=llm_groq,
-            llm_mistral=llm_mistral
+# Tamanho das prévias de texto na projeção resumida de /audio_records/
+SUMMARY_PREVIEW_CHARS = int(os.getenv("SUMMARY_PREVIEW_CHARS", "200"))
+# Validade (segundos) do total de registros em cache
+AUDIO_RECORDS_COUNT_TTL = float(os.getenv("AUDIO_RECORDS_COUNT_TTL", "30"))
+_count_cache = {"value": None, "expires_at": 0.0}
+
+async def create_or_update_audio_record(session, id, audio_path, transcription, llm_groq, llm_mistral, prompt=None, prompt_template=None, prompt_params=None,
+                                        turma=None, area_especialista=None, llm_groq_ms=None, llm_mistral_ms=None):
+    """
+    Grava o registro com um único INSERT ... ON CONFLICT (upsert) e atualiza
+    os agregados por turma/área.
+    """
+    await bulk_upsert_audio_records(session, [{
+        "id": id,
+        "audio_path": audio_path,
+        "prompt": prompt,
+        "prompt_template": prompt_template,
+        "prompt_params": prompt_params,
+        "transcription": transcription,
+        "llm_groq": llm_groq,
+        "llm_mistral": llm_mistral,
+        "turma": turma,
+        "area_especialista": area_especialista,
+        "llm_groq_ms": llm_groq_ms,
+        "llm_mistral_ms": llm_mistral_ms,
+    }])
+
+def _rollup_delta(deltas, row, sign):
+    """
+    Soma (sign=1) ou subtrai (sign=-1) a contribuição de um registro nos
+    agregados da sua turma/área. `row` tem as colunas de AudioRecord, com
+    `transcription_chars` no lugar do texto.
+    """
+    key = (row["turma"] or "", row["area_especialista"] or "")
+    delta = deltas.setdefault(key, {c.name: 0 for c in AudioRecordRollup.__table__.columns if not c.primary_key})
+    delta["records"] += sign
+    delta["transcription_chars"] += sign * (row["transcription_chars"] or 0)
+    for provider in ROLLUP_PROVIDERS:
+        ms = row[f"llm_{provider}_ms"]
+        if ms is not None:
+            delta[f"{provider}_calls"] += sign
+            delta[f"{provider}_errors"] += sign * (row[f"llm_{provider}"] is None)
+            delta[f"{provider}_ms_total"] += sign * ms
+
+# Namespace dos advisory locks por id de registro (PostgreSQL)
+RECORD_LOCK_NAMESPACE = 19
+
+async def _lock_records(session, ids):
+    """
+    Serializa, até o fim da transação, as gravações concorrentes dos mesmos
+    ids, para que a leitura da versão anterior e o upsert em _update_rollups
+    não se intercalem (o que contaria um delta duas vezes ou o perderia).
+    PostgreSQL: advisory lock por id (em ordem, sem deadlock; cobre também
+    ids ainda inexistentes, que FOR UPDATE não travaria). SQLite: abre a
+    transação de escrita antes da leitura (trava de escrita do banco).
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        await session.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, id) FROM unnest(CAST(:ids AS integer[])) AS t(id)"),
+            {"namespace": RECORD_LOCK_NAMESPACE, "ids": sorted(ids)},
         )
-        db.merge(audio_record)
-        db.commit()
-    finally:
-        db.close()
+    elif dialect == "sqlite":
+        await session.execute(text("UPDATE audio_record_rollups SET records = records WHERE 0"))
+
+async def _update_rollups(session, rows):
+    """
+    Aplica nos agregados a diferença causada pela gravação de `rows`: soma
+    os registros novos e desconta a versão anterior dos que já existiam
+    (lida pela chave primária, sem varrer a tabela). Os ids ficam travados
+    até o commit (ver _lock_records).
+    """
+    await _lock_records(session, [row["id"] for row in rows])
+    table = AudioRecord.__table__
+    previous = [table.c.id, table.c.turma, table.c.area_especialista,
+                func.length(table.c.transcription).label("transcription_chars")]
+    for provider in ROLLUP_PROVIDERS:
+        # Só interessa saber se a resposta é nula; evita trazer o texto
+        previous.append(case((table.c[f"llm_{provider}"].is_(None), None), else_="").label(f"llm_{provider}"))
+        previous.append(table.c[f"llm_{provider}_ms"])
+    result = await session.execute(select(*previous).where(table.c.id.in_([row["id"] for row in rows])))
+    deltas = {}
+    for old in result.mappings():
+        _rollup_delta(deltas, old, -1)
+    for row in rows:
+        _rollup_delta(deltas, {**row, "transcription_chars": len(row["transcription"] or "")}, 1)
+    changes = [
+        {"turma": turma, "area_especialista": area, **delta}
+        for (turma, area), delta in deltas.items()
+        if any(delta.values())
+    ]
+    if changes:
+        await session.execute(_upsert(session, AudioRecordRollup, changes, increment=True))
+
+async def bulk_upsert_audio_records(session, records):
+    """
+    Grava vários registros (dicts com os campos de AudioRecord) numa única
+    transação, com um upsert por bloco de DB_BULK_CHUNK registros.
+    """
+    if not records:
+        return
+    # Todas as linhas de um mesmo INSERT precisam das mesmas colunas
+    # (um id repetido no mesmo comando fica com a última versão)
+    columns = [c.name for c in AudioRecord.__table__.columns]
+    rows = list({record["id"]: {name: record.get(name) for name in columns} for record in records}.values())
+    for start in range(0, len(rows), DB_BULK_CHUNK):
+        chunk = rows[start:start + DB_BULK_CHUNK]
+        await _update_rollups(session, chunk)
+        await session.execute(_upsert(session, AudioRecord, chunk))
+    await session.commit()
+    _count_cache["expires_at"] = 0.0
+
+def record_to_dict(record):
+    prompt = record.prompt
+    if prompt is None and record.prompt_template:
+        # Renderiza o prompt sob demanda a partir do template gravado
+        prompt = render_stored_prompt(record.prompt_template, record.prompt_params)
+    return {
+        "id": record.id,
+        "audio_path": record.audio_path,
+        "prompt": prompt,
+        "prompt_template": record.prompt_template,
+        "turma": record.turma,
+        "area_especialista": record.area_especialista,
+        "transcription": record.transcription,
+        "llm_groq": record.llm_groq,
+        "llm_mistral": record.llm_mistral,
+    }
+
+async def list_audio_records_page(session, limit, cursor=None, skip=0, summary=True):
+    """
+    Lista registros do mais recente para o mais antigo.
+    Com `cursor` usa paginação por chave (id < cursor), sem OFFSET; sem ele,
+    usa `skip` (modo legado). Com `summary`, traz só prévias dos textos
+    longos em vez das colunas inteiras.
+    Retorna (itens, próximo cursor ou None).
+    """
+    if summary:
+        columns = [
+            AudioRecord.id,
+            AudioRecord.audio_path,
+            AudioRecord.turma,
+            AudioRecord.area_especialista,
+            func.substr(AudioRecord.transcription, 1, SUMMARY_PREVIEW_CHARS).label("transcription_preview"),
+            func.substr(AudioRecord.llm_groq, 1, SUMMARY_PREVIEW_CHARS).label("llm_groq_preview"),
+            func.substr(AudioRecord.llm_mistral, 1, SUMMARY_PREVIEW_CHARS).label("llm_mistral_preview"),
+        ]
+    else:
+        columns = [AudioRecord]
+    query = select(*columns).order_by(AudioRecord.id.desc())
+    if cursor is not None:
+        query = query.where(AudioRecord.id < cursor)
+    elif skip:
+        query = query.offset(skip)
+    # Busca um a mais para saber se existe próxima página
+    result = await session.execute(query.limit(limit + 1))
+    rows = result.scalars().all() if not summary else result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if summary:
+        items = [dict(row._mapping) for row in rows]
+    else:
+        items = [record_to_dict(row) for row in rows]
+    next_cursor = items[-1]["id"] if has_more and items else None
+    return items, next_cursor
+
+# Colunas exportadas (ver stream_audio_records), na ordem do CSV
+EXPORT_FIELDS = (
+    "id", "audio_path", "turma", "area_especialista", "prompt_template", "prompt",
+    "transcription", "llm_groq", "llm_mistral", "llm_groq_ms", "llm_mistral_ms",
+)
+# Linhas buscadas por vez do cursor no servidor
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "1000"))
+
+async def stream_audio_records(session, id_min=None, id_max=None, turma=None, area_especialista=None):
+    """
+    Percorre os registros em ordem de id com um cursor no servidor
+    (stream_results/yield_per), lendo EXPORT_BATCH linhas por vez: a memória
+    não cresce com o tamanho da tabela. Gera dicts com EXPORT_FIELDS.
+    Seleciona colunas (não entidades) para não acumular objetos na sessão.
+    """
+    query = select(
+        AudioRecord.id, AudioRecord.audio_path, AudioRecord.turma, AudioRecord.area_especialista,
+        AudioRecord.prompt, AudioRecord.prompt_template, AudioRecord.prompt_params,
+        AudioRecord.transcription, AudioRecord.llm_groq, AudioRecord.llm_mistral,
+        AudioRecord.llm_groq_ms, AudioRecord.llm_mistral_ms,
+    ).order_by(AudioRecord.id).execution_options(yield_per=EXPORT_BATCH)
+    if id_min is not None:
+        query = query.where(AudioRecord.id >= id_min)
+    if id_max is not None:
+        query = query.where(AudioRecord.id <= id_max)
+    if turma is not None:
+        query = query.where(AudioRecord.turma == turma)
+    if area_especialista is not None:
+        query = query.where(AudioRecord.area_especialista == area_especialista)
+    result = await session.stream(query)
+    async for row in result:
+        record = record_to_dict(row)
+        record["llm_groq_ms"] = row.llm_groq_ms
+        record["llm_mistral_ms"] = row.llm_mistral_ms
+        yield {field: record[field] for field in EXPORT_FIELDS}
+
+async def get_audio_record(session, id):
+    record = await session.get(AudioRecord, id)
+    return record_to_dict(record) if record else None
+
+async def count_audio_records(session):
+    """
+    Total de registros, mantido em cache por AUDIO_RECORDS_COUNT_TTL segundos
+    (invalidado a cada gravação) para não rodar count() a cada página.
+    """
+    now = time.monotonic()
+    if _count_cache["value"] is None or now >= _count_cache["expires_at"]:
+        _count_cache["value"] = await session.scalar(select(func.count(AudioRecord.id)))
+        _count_cache["expires_at"] = now + AUDIO_RECORDS_COUNT_TTL
+    return _count_cache["value"]
+
+# Marcadores dos trechos destacados; o texto é escapado (HTML) e só eles
+# viram <mark>...</mark>
+_MARK_START, _MARK_END = "\x02", "\x03"
+# Fragmentos e palavras por trecho destacado
+SEARCH_SNIPPET_FRAGMENTS = 2
+SEARCH_SNIPPET_WORDS = 16
+
+def _highlight(snippet):
+    if not snippet or _MARK_START not in snippet:
+        return None
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+def _fts5_query(query):
+    """
+    Converte a consulta livre em uma expressão FTS5 segura: cada palavra
+    entre aspas, com prefixo (aproxima o stemming), todas obrigatórias.
+    """
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+async def search_audio_records(session, query, limit=10, offset=0, id_min=None, id_max=None):
+    """
+    Busca de texto completo na transcrição e nas respostas das LLMs.
+    Retorna os registros ordenados por relevância, com trechos destacados
+    (<mark>) de cada coluna que contém os termos. Os trechos só são
+    gerados para a página retornada.
+    """
+    dialect = session.bind.dialect.name
+    params = {"limit": limit, "offset": offset}
+    filters = ""
+    if id_min is not None:
+        filters += " AND r.id >= :id_min"
+        params["id_min"] = id_min
+    if id_max is not None:
+        filters += " AND r.id <= :id_max"
+        params["id_max"] = id_max
+
+    if dialect == "postgresql":
+        params.update(q=query, options=(
+            f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", MaxFragments={SEARCH_SNIPPET_FRAGMENTS}, '
+            f'MaxWords={SEARCH_SNIPPET_WORDS}, MinWords={SEARCH_SNIPPET_WORDS // 2}, FragmentDelimiter=" … "'
+        ))
+        snippets = ", ".join(
+            f"ts_headline('{SEARCH_TS_CONFIG}', coalesce(r.{c}, ''), q.query, :options) AS {c}"
+            for c in SEARCH_COLUMNS
+        )
+        sql = f"""
+            WITH q AS (SELECT websearch_to_tsquery('{SEARCH_TS_CONFIG}', :q) AS query),
+            top AS (
+                SELECT r.id, ts_rank_cd(r.search_vector, q.query) AS rank
+                FROM audio_records r, q
+                WHERE r.search_vector @@ q.query{filters}
+                ORDER BY rank DESC, r.id DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT top.id, top.rank, {snippets}
+            FROM top JOIN audio_records r ON r.id = top.id, q
+            ORDER BY top.rank DESC, top.id DESC
+        """
+    elif dialect == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return []
+        params["q"] = match
+        snippets = ", ".join(
+            f"snippet(audio_records_fts, {i}, '{_MARK_START}', '{_MARK_END}', ' … ', {SEARCH_SNIPPET_WORDS}) AS {c}"
+            for i, c in enumerate(SEARCH_COLUMNS)
+        )
+        # bm25: quanto menor, mais relevante; transcrição com peso maior
+        sql = f"""
+            SELECT r.id, -bm25(audio_records_fts, 2.0, 1.0, 1.0) AS rank, {snippets}
+            FROM audio_records_fts JOIN audio_records r ON r.id = audio_records_fts.rowid
+            WHERE audio_records_fts MATCH :q{filters}
+            ORDER BY rank DESC, r.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        raise NotImplementedError(f"Busca de texto não suportada para o banco {dialect}.")
+
+    result = await session.execute(text(sql), params)
+    items = []
+    for row in result.mappings():
+        highlights = {c: _highlight(row[c]) for c in SEARCH_COLUMNS}
+        items.append({
+            "id": row["id"],
+            "rank": float(row["rank"]),
+            "highlights": {c: h for c, h in highlights.items() if h},
+        })
+    return items
+
+ROLLUP_GROUPS = {
+    "turma": ("turma",),
+    "area_especialista": ("area_especialista",),
+    "turma_area": ("turma", "area_especialista"),
+}
+
+async def get_context_rollups(session, group_by="turma", turma=None, area_especialista=None):
+    """
+    Volume de avaliações, tamanho médio da transcrição e latência/erros por
+    provedor, agrupados segundo ROLLUP_GROUPS[group_by]. Lê só a tabela de
+    agregados (uma linha por turma/área), nunca audio_records.
+    """
+    table = AudioRecordRollup.__table__
+    groups = [table.c[name] for name in ROLLUP_GROUPS[group_by]]
+    totals = [func.sum(c).label(c.name) for c in table.columns if not c.primary_key]
+    query = select(*groups, *totals).group_by(*groups).having(func.sum(table.c.records) > 0)
+    if turma is not None:
+        query = query.where(table.c.turma == turma)
+    if area_especialista is not None:
+        query = query.where(table.c.area_especialista == area_especialista)
+    result = await session.execute(query.order_by(func.sum(table.c.records).desc()))
+    items = []
+    for row in result.mappings():
+        records = row["records"]
+        providers = {}
+        for provider in ROLLUP_PROVIDERS:
+            calls = row[f"{provider}_calls"]
+            providers[provider] = {
+                "calls": calls,
+                "errors": row[f"{provider}_errors"],
+                "error_rate": round(row[f"{provider}_errors"] / calls, 4) if calls else None,
+                "latency_ms_avg": round(row[f"{provider}_ms_total"] / calls) if calls else None,
+            }
+        items.append({
+            **{name: row[name] for name in ROLLUP_GROUPS[group_by]},
+            "evaluations": records,
+            "transcription_chars_avg": round(row["transcription_chars"] / records),
+            "providers": providers,
+        })
+    return items
+
+async def get_cached_transcription(session, audio_sha256, model, language):
+    entry = await session.get(TranscriptionCache, (audio_sha256, model, language))
+    return entry.transcription if entry else None
+
+async def save_cached_transcription(session, audio_sha256, model, language, transcription):
+    await session.execute(_upsert(session, TranscriptionCache, [{
+        "audio_sha256": audio_sha256,
+        "model": model,
+        "language": language,
+        "transcription": transcription,
+    }]))
+    await session.commit()
 
 # Exporta modelo e sessão para uso externo
 __all__ = [
     "ALLOWED_EXTENSIONS",
     "UPLOAD_DIR",
+    "upload_path",
     "create_or_update_audio_record",
+    "bulk_upsert_audio_records",
+    "list_audio_records_page",
+    "get_audio_record",
+    "count_audio_records",
+    "search_audio_records",
+    "get_context_rollups",
+    "get_cached_transcription",
+    "save_cached_transcription",
     "AudioRecord",
+    "TranscriptionCache",
+    "AudioRecordRollup",
     "SessionLocal",
+    "get_session",
+    "init_db",
+    "close_db",
 ]
+
+async def _migrate():
+    try:
+        await init_db()
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    # Passo de migração para o deploy: python database.py migrate
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("Uso: python database.py migrate")
+    # Um único loop: as conexões do pool pertencem ao loop que as abriu
+    asyncio.run(_migrate())
+    print("Esquema do banco atualizado.")
@@ -0,0 +1,55 @@
+import io
+import csv
+import json
+import zlib
+
+from database import SessionLocal, EXPORT_FIELDS, EXPORT_BATCH, stream_audio_records
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+EXPORT_GZIP_LEVEL = 6
+
+async def _lines(fmt, filters):
+    """
+    Serializa os registros em blocos de até EXPORT_BATCH linhas (o CSV
+    começa pelo cabeçalho). A sessão é aberta aqui, e não por dependência
+    da rota, para durar o stream inteiro.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+    pending = 0
+    async with SessionLocal() as session:
+        async for record in stream_audio_records(session, **filters):
+            if writer:
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+            pending += 1
+            if pending >= EXPORT_BATCH:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def export_audio_records(fmt="ndjson", compress=False, **filters):
+    """
+    Gera o corpo da exportação (NDJSON ou CSV) em blocos, opcionalmente
+    comprimido em gzip à medida que é gerado (um único membro gzip,
+    descarregado a cada bloco). `filters` segue stream_audio_records.
+    """
+    if not compress:
+        async for chunk in _lines(fmt, filters):
+            yield chunk
+        return
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in _lines(fmt, filters):
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from fastapi import HTTPException
+
+# Por quanto tempo um resultado concluído é devolvido a repetições
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+
+def make_key(scope, *parts):
+    """
+    Chave da requisição: o escopo (endpoint) e as partes que a identificam
+    (a chave do cliente, ou id + hash do áudio + contexto).
+    """
+    content = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{scope}\x00{content}".encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    """
+    Requisições em andamento e concluídas por chave de idempotência, em
+    memória (por worker) e por IDEMPOTENCY_TTL_SECONDS: uma repetição da
+    mesma requisição aguarda a execução em andamento ou recebe o resultado
+    guardado, sem refazer o trabalho. Só resultados bem-sucedidos são
+    guardados; após um erro a repetição executa de novo.
+    A `fingerprint` detecta a mesma chave do cliente reutilizada em outra
+    requisição (ex.: outro id), respondida com 422.
+    """
+    def __init__(self, ttl=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._done = OrderedDict()  # chave -> (expira_em, fingerprint, resultado)
+        self._inflight = {}  # chave -> (fingerprint, asyncio.Task)
+        self.stats = {"executed": 0, "attached": 0, "replayed": 0}
+
+    def _check(self, key, fingerprint, stored):
+        if stored != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key já usada em outra requisição.")
+
+    def _get_done(self, key):
+        entry = self._done.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._done[key]
+            entry = None
+        return entry
+
+    def result(self, key, fingerprint=None):
+        """
+        Resultado guardado de uma execução concluída, ou None. Só com ele em
+        mãos uma repetição pode dispensar o próprio áudio.
+        """
+        entry = self._get_done(key)
+        if entry is None:
+            return None
+        self._check(key, fingerprint, entry[1])
+        self._done.move_to_end(key)
+        self.stats["replayed"] += 1
+        return entry[2]
+
+    async def run(self, key, call, fingerprint=None):
+        """
+        Executa `call()` (corrotina) uma única vez por chave. Retorna a tupla
+        (resultado, repetida), em que `repetida` indica que o resultado veio
+        de uma execução anterior ou em andamento (e `call` não foi usada).
+        Se a execução em andamento falhar, esta executa `call()` com os
+        próprios dados em vez de repassar o erro.
+        """
+        while True:
+            stored = self.result(key, fingerprint)
+            if stored is not None:
+                return stored, True
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self._check(key, fingerprint, inflight[0])
+            self.stats["attached"] += 1
+            try:
+                return await asyncio.shield(inflight[1]), True
+            except asyncio.CancelledError:
+                if not inflight[1].cancelled():
+                    raise
+            except Exception:
+                pass
+
+        self.stats["executed"] += 1
+        task = asyncio.ensure_future(call())
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda t: self._finish(key, fingerprint, t))
+        # shield: se o cliente desconectar, a execução segue e a repetição a encontra
+        return await asyncio.shield(task), False
+
+    def _finish(self, key, fingerprint, task):
+        if self._inflight.get(key, (None, None))[1] is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._done[key] = (time.monotonic() + self.ttl, fingerprint, task.result())
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from uuid import uuid4
+from fastapi import HTTPException
+
+from llm_scheduler import PRIORITY_BATCH, llm_priority
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+SSE_KEEPALIVE_SECONDS = 15
+
+class Job:
+    """
+    Estado de um job de avaliação em segundo plano.
+    """
+    def __init__(self, kind):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.status = "queued"  # queued, running, done, error
+        self.stage = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.events = [{"stage": "queued"}]
+        self._changed = asyncio.Condition()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    async def push(self, stage, data=None, status=None):
+        async with self._changed:
+            if status is not None:
+                self.status = status
+            self.stage = stage
+            self.updated_at = time.time()
+            self.events.append({"stage": stage, **(data or {})})
+            self._changed.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+class JobManager:
+    """
+    Fila de jobs com um pool limitado de workers asyncio.
+    O throughput é definido por JOB_WORKERS, não pelo número de conexões
+    HTTP abertas pelos clientes. As chamadas às LLMs dos jobs usam a
+    prioridade de lote, atrás das requisições interativas.
+    """
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind, run):
+        """
+        Enfileira um job. `run` é uma função run(progress) que retorna a
+        corrotina do pipeline. Levanta 503 se a fila estiver cheia.
+        """
+        self._purge()
+        job = Job(kind)
+        try:
+            self._queue.put_nowait((job, run))
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Fila de avaliações cheia. Tente novamente em instantes.")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job não encontrado.")
+        return job
+
+    async def events(self, job_id):
+        """
+        Gera os eventos do job no formato Server-Sent Events, até o fim do job.
+        """
+        job = self.get(job_id)
+        sent = 0
+        while True:
+            async with job._changed:
+                if sent >= len(job.events) and not job.finished:
+                    try:
+                        await asyncio.wait_for(job._changed.wait(), timeout=SSE_KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                pending = job.events[sent:]
+                finished = job.finished
+            if not pending and not finished:
+                # Comentário SSE para manter a conexão viva através do nginx
+                yield ": keepalive\n\n"
+                continue
+            for event in pending:
+                yield f"event: stage\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            sent += len(pending)
+            if finished and sent >= len(job.events):
+                yield f"event: end\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                return
+
+    async def _worker(self):
+        while True:
+            job, run = await self._queue.get()
+            try:
+                job.status = "running"
+                with llm_priority(PRIORITY_BATCH):
+                    job.result = await run(job.push)
+                await job.push("done", status="done")
+            except HTTPException as e:
+                job.error = e.detail
+                await job.push("error", {"detail": e.detail}, status="error")
+            except Exception as e:
+                logging.exception("Erro no job %s", job.id)
+                job.error = str(e)
+                await job.push("error", {"detail": str(e)}, status="error")
+            finally:
+                self._queue.task_done()
+
+    def _purge(self):
+        limit = time.time() - JOB_TTL_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.updated_at < limit]:
+            del self.jobs[job_id]
+
+job_manager = JobManager()
@@ -0,0 +1,363 @@
+import os
+import json
+import wave
+import array
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+from uuid import uuid4
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from database import ALLOWED_EXTENSIONS, upload_path
+from metrics import observe_audio
+from pipeline import run_avaliacao
+from transcribe import (
+    AUDIO_NORMALIZE,
+    AUDIO_NORMALIZE_CODEC,
+    AUDIO_NORMALIZE_BITRATE,
+    AUDIO_NORMALIZE_EXT,
+    PIPE_CHUNK_SIZE,
+    WHISPER_PARALLELISM,
+    WHISPER_SILENCE_NOISE,
+    WHISPER_SILENCE_MIN_SECONDS,
+    transcribe_segment,
+)
+from uploads import UPLOAD_MAX_BYTES
+
+# Duração mínima de um segmento antes de procurar um silêncio para cortar
+LIVE_SEGMENT_SECONDS = float(os.getenv("LIVE_SEGMENT_SECONDS", "10"))
+# Sem silêncio, corta mesmo assim ao atingir esta duração
+LIVE_MAX_SEGMENT_SECONDS = float(os.getenv("LIVE_MAX_SEGMENT_SECONDS", "30"))
+# Tempo máximo esperando a mensagem inicial e entre dois blocos de áudio
+LIVE_START_TIMEOUT_SECONDS = float(os.getenv("LIVE_START_TIMEOUT_SECONDS", "30"))
+LIVE_IDLE_TIMEOUT_SECONDS = float(os.getenv("LIVE_IDLE_TIMEOUT_SECONDS", "60"))
+
+CONTEXT_FIELDS = ("area_especialista", "turma", "sa_descricao", "etapa_descricao", "pratica_descricao", "parametros_descricao")
+
+# PCM decodificado pelo ffmpeg: 16 kHz, mono, 16 bits
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2
+# Janela da detecção de silêncio
+FRAME_SAMPLES = SAMPLE_RATE // 20
+FRAME_BYTES = FRAME_SAMPLES * BYTES_PER_SAMPLE
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+
+def _silence_threshold():
+    """
+    Energia média (amostra²) abaixo da qual uma janela é silêncio, a partir
+    de WHISPER_SILENCE_NOISE (mesmo limiar do corte de áudios longos).
+    """
+    db = float(WHISPER_SILENCE_NOISE.lower().removesuffix("db"))
+    return (32768 * 10 ** (db / 20)) ** 2
+
+SILENCE_THRESHOLD = _silence_threshold()
+SILENCE_MIN_FRAMES = max(1, round(WHISPER_SILENCE_MIN_SECONDS / FRAME_SECONDS))
+
+def _is_quiet(frame):
+    samples = array.array("h", frame)
+    return sum(s * s for s in samples) / len(samples) < SILENCE_THRESHOLD
+
+def _write_wav(path, pcm):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(BYTES_PER_SAMPLE)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm)
+
+class LiveSession:
+    """
+    Avaliação com transcrição durante a gravação, via WebSocket:
+
+    1. o cliente envia {"type": "start", "id": ..., campos do contexto,
+       "filename": "audio.webm"};
+    2. envia os blocos do MediaRecorder como mensagens binárias;
+    3. envia {"type": "stop"} ao parar a gravação.
+
+    Os blocos vão para o stdin de um ffmpeg que devolve PCM (e grava o
+    áudio normalizado). O PCM é cortado em silêncios a cada
+    LIVE_SEGMENT_SECONDS e cada segmento é transcrito em segundo plano,
+    com o texto enviado ao cliente ({"type": "partial"}). No stop só resta
+    transcrever o último segmento; as LLMs e a gravação seguem o pipeline
+    de /avaliacao/ (eventos {"type": "stage"}), os tokens das LLMs chegam
+    em {"type": "delta", "provider", "text"} e o resultado vem em
+    {"type": "result"}. Erros são enviados como {"type": "error"}.
+    Sem ffmpeg, o áudio é só gravado e transcrito inteiro no stop.
+    """
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.session_id = uuid4().hex
+        self.audio_path = None
+        self.sha256 = hashlib.sha256()
+        self.received = 0
+        self.process = None
+        self.raw_file = None
+        self.completed = False
+        # PCM ainda não atribuído a um segmento e se cada janela dele é silêncio
+        self.pending = bytearray()
+        self.quiet = []
+        self.decoded_bytes = 0
+        self.segments = []
+        self.texts = {}
+        self.tmpdir = None
+        self._reader = None
+        self._stderr = None
+        self._semaphore = asyncio.Semaphore(max(1, WHISPER_PARALLELISM))
+        self._send_lock = asyncio.Lock()
+        self.connected = True
+
+    async def send(self, message):
+        """
+        Envia uma mensagem ao cliente; se ele desconectou, a avaliação segue
+        sem notificações.
+        """
+        if not self.connected:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_json(message)
+            except Exception:
+                self.connected = False
+
+    async def _receive(self, timeout):
+        message = await asyncio.wait_for(self.websocket.receive(), timeout)
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        try:
+            return json.loads(message.get("text") or "")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Mensagem de controle inválida (JSON esperado).")
+
+    async def run(self):
+        try:
+            start = await self._receive(LIVE_START_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=408, detail="Mensagem inicial não recebida.")
+        if not isinstance(start, dict) or start.get("type") != "start":
+            raise HTTPException(status_code=400, detail='A primeira mensagem deve ser {"type": "start", ...}.')
+        missing = [f for f in ("id",) + CONTEXT_FIELDS if not start.get(f) and start.get(f) != 0]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Campos ausentes: {', '.join(missing)}")
+        try:
+            id = int(start["id"])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="id deve ser um número inteiro.")
+        contexto = {field: str(start[field]) for field in CONTEXT_FIELDS}
+        ext = os.path.splitext(start.get("filename") or "audio.webm")[1].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
+
+        await self._open(ext)
+        await self.send({"type": "ready", "session_id": self.session_id, "live_transcription": self.process is not None})
+        while True:
+            try:
+                message = await self._receive(LIVE_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=408, detail="Nenhum áudio recebido no tempo limite.")
+            if isinstance(message, bytes):
+                await self._feed(message)
+            elif isinstance(message, dict) and message.get("type") == "stop":
+                break
+            else:
+                raise HTTPException(status_code=400, detail="Mensagem não reconhecida.")
+
+        transcription = await self._finish()
+        result = await run_avaliacao(
+            id, self.audio_path, self.sha256.hexdigest(), contexto,
+            progress=self._progress, transcription=transcription, on_delta=self._delta,
+        )
+        self.completed = True
+        await self.send({"type": "result", "result": result})
+
+    async def _progress(self, stage, data):
+        await self.send({"type": "stage", "stage": stage, **{k: v for k, v in data.items() if k != "transcription"}})
+
+    async def _delta(self, provider, text):
+        await self.send({"type": "delta", "provider": provider, "text": text})
+
+    async def _open(self, ext):
+        self.tmpdir = tempfile.mkdtemp(prefix="live_")
+        outputs = ['-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1']
+        if AUDIO_NORMALIZE:
+            # Segunda saída: o áudio normalizado já vai para o arquivo final
+            self.audio_path = upload_path(f"live_{self.session_id}.norm{AUDIO_NORMALIZE_EXT}")
+            outputs += [
+                '-ac', '1', '-ar', str(SAMPLE_RATE),
+                '-c:a', AUDIO_NORMALIZE_CODEC, '-b:a', AUDIO_NORMALIZE_BITRATE,
+                '-f', 'ogg', '-y', self.audio_path,
+            ]
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-vn', *outputs,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            logging.warning("FFmpeg não encontrado. Sessão ao vivo sem transcrição parcial.")
+            self.process = None
+        if self.process:
+            self._reader = asyncio.create_task(self._read_pcm())
+            self._stderr = asyncio.create_task(self.process.stderr.read())
+        if not (self.process and AUDIO_NORMALIZE):
+            # Guarda os blocos originais (sem normalização ou sem ffmpeg)
+            self.audio_path = upload_path(f"live_{self.session_id}{ext}")
+            self.raw_file = open(self.audio_path, "wb")
+
+    async def _feed(self, chunk):
+        self.received += len(chunk)
+        if self.received > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Gravação acima do limite de {UPLOAD_MAX_BYTES} bytes.")
+        self.sha256.update(chunk)
+        if self.raw_file:
+            await asyncio.to_thread(self.raw_file.write, chunk)
+        if self.process:
+            self.process.stdin.write(chunk)
+            await self.process.stdin.drain()
+
+    async def _read_pcm(self):
+        while chunk := await self.process.stdout.read(PIPE_CHUNK_SIZE):
+            self.decoded_bytes += len(chunk)
+            start = len(self.quiet) * FRAME_BYTES
+            self.pending += chunk
+            while len(self.pending) - start >= FRAME_BYTES:
+                self.quiet.append(_is_quiet(self.pending[start:start + FRAME_BYTES]))
+                start += FRAME_BYTES
+            cut = self._next_cut()
+            if cut:
+                self._cut(cut * FRAME_BYTES)
+
+    def _next_cut(self):
+        """
+        Janela em que o segmento pendente deve ser cortado: com pelo menos
+        LIVE_SEGMENT_SECONDS pendentes, o meio do último silêncio (depois da
+        metade desse tempo, para não gerar segmentos curtos) ou, sem silêncio,
+        o fim ao passar de LIVE_MAX_SEGMENT_SECONDS. None enquanto não há corte.
+        """
+        frames = len(self.quiet)
+        if frames * FRAME_SECONDS < LIVE_SEGMENT_SECONDS:
+            return None
+        run_start = None
+        best = None
+        for index, quiet in enumerate(self.quiet + [False]):
+            if quiet and run_start is None:
+                run_start = index
+            elif not quiet and run_start is not None:
+                if index - run_start >= SILENCE_MIN_FRAMES:
+                    best = (run_start + index) // 2
+                run_start = None
+        if best and best * FRAME_SECONDS >= LIVE_SEGMENT_SECONDS / 2:
+            return best
+        if frames * FRAME_SECONDS >= LIVE_MAX_SEGMENT_SECONDS:
+            return frames
+        return None
+
+    def _cut(self, size):
+        pcm = bytes(self.pending[:size])
+        silent = all(self.quiet[:size // FRAME_BYTES])
+        del self.pending[:size]
+        del self.quiet[:size // FRAME_BYTES]
+        index = len(self.segments)
+        self.segments.append(asyncio.create_task(self._transcribe(index, pcm, silent)))
+
+    async def _transcribe(self, index, pcm, silent):
+        if silent or not pcm:
+            # Segmento só com silêncio: não envia ao Whisper (evita texto inventado)
+            self.texts[index] = ""
+            return
+        async with self._semaphore:
+            path = os.path.join(self.tmpdir, f"seg_{index:04d}.wav")
+            await asyncio.to_thread(_write_wav, path, pcm)
+            text = await transcribe_segment(path, index)
+            os.remove(path)
+        self.texts[index] = text
+        if text.startswith("Erro"):
+            await self.send({"type": "partial", "index": index, "error": text})
+        else:
+            await self.send({"type": "partial", "index": index, "text": text, "transcription": self._joined()})
+
+    def _joined(self):
+        texts = []
+        for index in range(len(self.segments)):
+            if index not in self.texts:
+                break
+            texts.append(self.texts[index])
+        return " ".join(t for t in texts if t).strip()
+
+    async def _finish(self):
+        """
+        Fecha a entrada, transcreve o último segmento e aguarda os demais.
+        Retorna a transcrição completa (None sem ffmpeg: o pipeline transcreve
+        o arquivo inteiro).
+        """
+        if self.raw_file:
+            self.raw_file.close()
+            self.raw_file = None
+        if self.received == 0:
+            raise HTTPException(status_code=400, detail="Nenhum áudio recebido.")
+        if not self.process:
+            return None
+        self.process.stdin.close()
+        await self._reader
+        if await self.process.wait() != 0 and self.decoded_bytes == 0:
+            logging.error(f"Erro ao decodificar a gravação: {(await self._stderr).decode('utf-8', 'replace').strip()}")
+            raise HTTPException(status_code=400, detail="Não foi possível decodificar o áudio enviado.")
+        remainder = len(self.pending) - len(self.pending) % BYTES_PER_SAMPLE
+        if remainder:
+            self._cut(remainder)
+        await asyncio.gather(*self.segments)
+
+        if AUDIO_NORMALIZE:
+            normalized_bytes = os.path.getsize(self.audio_path)
+            observe_audio({
+                "duration_seconds": round(self.decoded_bytes / (SAMPLE_RATE * BYTES_PER_SAMPLE), 3),
+                "original_bytes": self.received,
+                "normalized_bytes": normalized_bytes,
+                "reduction": round(1 - normalized_bytes / self.received, 4),
+            })
+        for index in range(len(self.segments)):
+            if self.texts[index].startswith("Erro"):
+                raise HTTPException(status_code=500, detail=f"Erro na transcrição do segmento {index + 1}/{len(self.segments)}: {self.texts[index]}")
+        transcription = self._joined()
+        if not transcription:
+            raise HTTPException(status_code=400, detail="Nenhuma fala detectada na gravação.")
+        return transcription
+
+    async def close(self):
+        for task in [self._reader, self._stderr, *self.segments]:
+            if task and not task.done():
+                task.cancel()
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        if self.raw_file:
+            self.raw_file.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+        # Gravação abandonada ou com erro: o áudio não fica associado a registro
+        if not self.completed and self.audio_path and os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+
+async def run_live_session(websocket: WebSocket):
+    """
+    Atende uma conexão WebSocket de avaliação ao vivo (ver LiveSession).
+    """
+    await websocket.accept()
+    session = LiveSession(websocket)
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        logging.info(f"Sessão ao vivo {session.session_id} encerrada pelo cliente")
+        return
+    except HTTPException as e:
+        await session.send({"type": "error", "status_code": e.status_code, "detail": e.detail})
+    except Exception:
+        logging.exception(f"Erro na sessão ao vivo {session.session_id}")
+        await session.send({"type": "error", "status_code": 500, "detail": "Erro interno na avaliação ao vivo."})
+    finally:
+        await session.close()
+    if session.connected:
+        await websocket.close()
@@ -1,76 +1,225 @@
 import os
-import requests
+import json
+import time
+import httpx
+from collections import defaultdict
 
-def call_llm_groq(transcription, prompt):
+from llm_cache import llm_cache
+from llm_scheduler import (
+    LLM_EXPECTED_RESPONSE_TOKENS,
+    LLM_MAX_RETRIES,
+    estimate_tokens,
+    get_limiter,
+    parse_retry_after,
+)
+from resilience import LatencyTracker
+from token_budget import LLM_TOKEN_BUDGET, get_budget
+from metrics import provider_errors, llm_tokens, llm_first_token
+
+# URLs base (formato OpenAI) dos provedores; podem apontar para proxies ou
+# para os servidores simulados do benchmark (ver backend/bench/)
+GROQ_API_BASE_URL = os.getenv("GROQ_API_BASE_URL", "https://api.groq.com/openai/v1").rstrip("/")
+MISTRAL_API_BASE_URL = os.getenv("MISTRAL_API_BASE_URL", "https://api.mistral.ai/v1").rstrip("/")
+GROQ_API_URL = f"{GROQ_API_BASE_URL}/chat/completions"
+MISTRAL_API_URL = f"{MISTRAL_API_BASE_URL}/chat/completions"
+
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+
+# Latência das chamadas bem-sucedidas por provedor ("groq", "mistral"), usada
+# pelas políticas de hedge (ver llm_providers.py)
+provider_latency = defaultdict(lambda: LatencyTracker(LLM_LATENCY_WINDOW))
+
+# Pool de conexões compartilhado (keep-alive) entre as chamadas Groq e Mistral.
+# É criado e fechado pelo lifespan da aplicação (ver main.py).
+_http_client = None
+
+async def init_http_client():
     """
-    Usa a API Groq para gerar resposta baseada na transcrição.
+    Cria o cliente HTTP assíncrono compartilhado, se ainda não existir.
     """
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
-    GROQ_API_MODEL = os.getenv("GROQ_API_MODEL", "llama3-70b-8192")  # Defina o modelo padrão aqui
-    if not GROQ_API_KEY:
-        return "GROQ_API_KEY não configurada."
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _http_client
+
+async def close_http_client():
+    """
+    Fecha o cliente HTTP compartilhado e libera as conexões do pool.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def _read_stream(response, on_delta, provider, started):
+    """
+    Lê o stream SSE do chat/completions (`stream: true`), repassando cada
+    trecho de texto a `on_delta`. Retorna a tupla (texto completo, usage);
+    usage vem no último evento quando o provedor o informa. Se o servidor
+    ignorar o `stream` e responder JSON, o texto vai num único trecho.
+    """
+    if not response.headers.get("content-type", "").startswith("text/event-stream"):
+        data = json.loads(await response.aread())
+        content = data["choices"][0]["message"]["content"]
+        llm_first_token.observe(time.monotonic() - started, provider=provider)
+        await on_delta(content)
+        return content, data.get("usage") or {}
+    parts = []
+    usage = {}
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        # Groq informa o uso em x_groq.usage; Mistral/OpenAI em usage
+        usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                if not parts:
+                    llm_first_token.observe(time.monotonic() - started, provider=provider)
+                parts.append(delta)
+                await on_delta(delta)
+    return "".join(parts), usage
+
+async def _chat_completion(provider, url, api_key, model, transcription, prompt, on_delta=None):
+    """
+    Faz a chamada chat/completions (formato OpenAI) usando o pool compartilhado.
+    A chamada passa pelo limitador do provedor/modelo (ver llm_scheduler.py);
+    respostas 429 pausam o limitador pelo retry-after informado e são
+    repetidas até LLM_MAX_RETRIES vezes.
+    Com `on_delta` (corrotina), a resposta é pedida em streaming e cada
+    trecho é repassado assim que chega.
+    Com LLM_TOKEN_BUDGET, transcrições longas são compactadas e a resposta
+    é limitada por max_tokens conforme o orçamento do modelo (ver token_budget.py).
+    Retorna o texto da resposta ou uma mensagem iniciando com "Erro".
+    """
+    client = await init_http_client()
+    limiter = get_limiter(provider.lower(), model)
+    budget = get_budget(provider.lower(), model) if LLM_TOKEN_BUDGET else None
+    if budget is not None:
+        try:
+            transcription, max_tokens, input_tokens = budget.plan(prompt, transcription)
+        except ValueError as e:
+            provider_errors.inc(provider=provider.lower(), reason="context_overflow")
+            return f"Erro {provider}: {e}"
+        estimated = input_tokens + max_tokens
+    else:
+        estimated = estimate_tokens(prompt, transcription) + LLM_EXPECTED_RESPONSE_TOKENS
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": transcription}
+        ]
+    }
+    if budget is not None:
+        data["max_tokens"] = max_tokens
+    if on_delta is not None:
+        data["stream"] = True
+    response = None
     try:
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": GROQ_API_MODEL,
-            "messages": [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": transcription}
-            ]
-        }
-        response = requests.post(url, headers=headers, json=data, timeout=60)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await limiter.acquire(estimated)
+            started = time.monotonic()
+            if on_delta is None:
+                response = await client.post(url, headers=headers, json=data)
+            else:
+                response = await client.send(client.build_request("POST", url, headers=headers, json=data), stream=True)
+            if response.status_code != 429 or attempt == LLM_MAX_RETRIES:
+                break
+            await response.aclose()
+            limiter.pause(parse_retry_after(response.headers))
         if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"].strip()
+            if on_delta is None:
+                result = response.json()
+                usage = result.get("usage") or {}
+                content = result["choices"][0]["message"]["content"]
+            else:
+                content, usage = await _read_stream(response, on_delta, provider.lower(), started)
+            provider_latency[provider.lower()].record(time.monotonic() - started)
+            if budget is not None:
+                budget.record(usage.get("completion_tokens"), time.monotonic() - started)
+            limiter.record_usage(estimated, usage.get("total_tokens"))
+            for kind in ("prompt", "completion"):
+                if usage.get(f"{kind}_tokens"):
+                    llm_tokens.inc(usage[f"{kind}_tokens"], provider=provider.lower(), model=model, kind=kind)
+            return content.strip()
         else:
+            provider_errors.inc(provider=provider.lower(), reason=f"http_{response.status_code}")
+            if on_delta is not None:
+                await response.aread()
             try:
                 err = response.json()
                 msg = err.get("error", {}).get("message", "")
                 if msg:
-                    return f"Erro Groq: {msg}"
+                    return f"Erro {provider}: {msg}"
             except Exception:
                 pass
-            return f"Erro na chamada Groq: {response.status_code} {response.text}"
+            return f"Erro na chamada {provider}: {response.status_code} {response.text}"
     except Exception as e:
-        return f"Erro na chamada Groq: {str(e)}"
+        provider_errors.inc(provider=provider.lower(), reason=e.__class__.__name__)
+        return f"Erro na chamada {provider}: {str(e)}"
+    finally:
+        if on_delta is not None and response is not None:
+            await response.aclose()
+
+async def call_llm_groq(transcription, prompt, bypass_cache=False, on_delta=None):
+    """
+    Usa a API Groq para gerar resposta baseada na transcrição.
+    Respostas são servidas do cache (ver llm_cache.py) salvo se `bypass_cache`.
+    Com `on_delta`, a resposta é transmitida em streaming (ver _chat_completion).
+    """
+    GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
+    GROQ_API_MODEL = os.getenv("GROQ_API_MODEL", "llama3-70b-8192")  # Defina o modelo padrão aqui
+    if not GROQ_API_KEY:
+        return "GROQ_API_KEY não configurada."
+    if on_delta is not None:
+        return await llm_cache.get_or_stream(
+            "groq", GROQ_API_MODEL, prompt, transcription,
+            lambda: _chat_completion("Groq", GROQ_API_URL, GROQ_API_KEY, GROQ_API_MODEL, transcription, prompt, on_delta),
+            on_delta, bypass=bypass_cache,
+        )
+    return await llm_cache.get_or_call(
+        "groq", GROQ_API_MODEL, prompt, transcription,
+        lambda: _chat_completion("Groq", GROQ_API_URL, GROQ_API_KEY, GROQ_API_MODEL, transcription, prompt),
+        bypass=bypass_cache,
+    )
 
-def call_llm_mistral(transcription, prompt):
+async def call_llm_mistral(transcription, prompt, bypass_cache=False, on_delta=None):
     """
     Usa a API Mistral para gerar resposta baseada na transcrição.
+    Respostas são servidas do cache (ver llm_cache.py) salvo se `bypass_cache`.
+    Com `on_delta`, a resposta é transmitida em streaming (ver _chat_completion).
     """
     MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "")
     MISTRAL_API_MODEL = os.getenv("MISTRAL_API_MODEL", "mistral-medium")  # Defina o modelo padrão aqui
     if not MISTRAL_API_KEY:
         return "MISTRAL_API_KEY não configurada."
-    try:
-        url = "https://api.mistral.ai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": MISTRAL_API_MODEL,
-            "messages": [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": transcription}
-            ]
-        }
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"].strip()
-        else:
-            try:
-                err = response.json()
-                msg = err.get("error", {}).get("message", "")
-                if msg:
-                    return f"Erro Mistral: {msg}"
-            except Exception:
-                pass
-            return f"Erro na chamada Mistral: {response.status_code} {response.text}"
-    except Exception as e:
-        return f"Erro na chamada Mistral: {str(e)}"
+    if on_delta is not None:
+        return await llm_cache.get_or_stream(
+            "mistral", MISTRAL_API_MODEL, prompt, transcription,
+            lambda: _chat_completion("Mistral", MISTRAL_API_URL, MISTRAL_API_KEY, MISTRAL_API_MODEL, transcription, prompt, on_delta),
+            on_delta, bypass=bypass_cache,
+        )
+    return await llm_cache.get_or_call(
+        "mistral", MISTRAL_API_MODEL, prompt, transcription,
+        lambda: _chat_completion("Mistral", MISTRAL_API_URL, MISTRAL_API_KEY, MISTRAL_API_MODEL, transcription, prompt),
+        bypass=bypass_cache,
+    )
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+# Diretório opcional para persistir o cache em disco (vazio = só memória)
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+# Máximo de entradas em disco; acima disso as mais antigas são removidas
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "10000"))
+# Fração do limite mantida após uma limpeza (evita limpar a cada gravação)
+DISK_PRUNE_TARGET = 0.9
+
+# Indica se a última chamada da tarefa atual foi atendida pelo cache (ou
+# por uma chamada idêntica em andamento), sem requisição própria ao provedor
+_served_from_cache = ContextVar("llm_served_from_cache", default=False)
+
+def served_from_cache():
+    return _served_from_cache.get()
+
+def is_success(response):
+    """
+    Indica se a resposta de um provedor é válida, e não uma mensagem de erro
+    ("Erro ...") ou aviso de configuração ("... não configurada.") de llm.py.
+    Só respostas válidas entram no cache.
+    """
+    return bool(response) and not response.startswith("Erro") and not response.endswith("não configurada.")
+
+class LLMResponseCache:
+    """
+    Cache LRU com TTL das respostas das LLMs, com persistência opcional em
+    disco e coalescência de chamadas idênticas simultâneas: enquanto uma
+    chamada está em andamento, as demais com a mesma chave aguardam o mesmo
+    resultado em vez de chamar o provedor de novo.
+    """
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS, directory=LLM_CACHE_DIR,
+                 disk_max_entries=LLM_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_max_entries = disk_max_entries
+        self._disk_count = None  # contado na primeira gravação (ver _prune_disk)
+        # Serializa gravações e remoções em disco (feitas em threads) e o contador
+        self._disk_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()  # chave -> (criado_em, resposta)
+        self._inflight = {}  # chave -> asyncio.Task
+        self._waiters = {}  # asyncio.Task -> chamadores aguardando
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "disk_evictions": 0}
+
+    @staticmethod
+    def make_key(provider, model, prompt, transcription):
+        content = hashlib.sha256(f"{prompt}\x00{transcription}".encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{provider}\x00{model}\x00{content}".encode("utf-8")).hexdigest()
+
+    async def get_or_call(self, provider, model, prompt, transcription, call, bypass=False):
+        """
+        Retorna a resposta em cache para (provedor, modelo, prompt, transcrição)
+        ou executa `call()` (corrotina) uma única vez e guarda o resultado.
+        Com `bypass=True` ignora o cache e a coalescência, mas atualiza a entrada.
+        """
+        key = self.make_key(provider, model, prompt, transcription)
+        if not bypass:
+            cached = await self._get(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                _served_from_cache.set(True)
+                return cached
+            task = self._inflight.get(key)
+            if task is not None:
+                self.stats["coalesced"] += 1
+                _served_from_cache.set(True)
+                return await self._wait(task)
+
+        self.stats["misses"] += 1
+        _served_from_cache.set(False)
+        task = asyncio.ensure_future(self._call_and_store(key, call))
+        if not bypass:
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        return await self._wait(task)
+
+    async def _wait(self, task):
+        """
+        Aguarda a chamada compartilhada. O cancelamento de um chamador não
+        a interrompe enquanto houver outros aguardando (shield); quando o
+        último desiste (ex.: perdedor das políticas first/hedge), a chamada
+        ao provedor é cancelada de fato, sem seguir sendo cobrada.
+        """
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    async def get_or_stream(self, provider, model, prompt, transcription, call, on_delta, bypass=False):
+        """
+        Variante de get_or_call para respostas em streaming: `call()` repassa
+        os trechos a `on_delta` por conta própria; num acerto de cache a
+        resposta inteira é entregue num único `on_delta`. Sem coalescência,
+        já que cada chamador precisa receber os próprios trechos.
+        """
+        key = self.make_key(provider, model, prompt, transcription)
+        if not bypass:
+            cached = await self._get(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                _served_from_cache.set(True)
+                await on_delta(cached)
+                return cached
+        self.stats["misses"] += 1
+        _served_from_cache.set(False)
+        return await self._call_and_store(key, call)
+
+    async def _call_and_store(self, key, call):
+        response = await call()
+        if is_success(response):
+            await self._set(key, response)
+        return response
+
+    async def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self.directory:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        created_at, response = entry
+        if time.time() - created_at > self.ttl:
+            self._entries.pop(key, None)
+            if self.directory:
+                await asyncio.to_thread(self._remove_disk, self._disk_path(key))
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    async def _set(self, key, response):
+        entry = (time.time(), response)
+        self._remember(key, entry)
+        if self.directory:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["created_at"], data["response"]
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.exception("Erro ao ler cache de LLM em disco")
+            return None
+
+    def _write_disk(self, key, entry):
+        created_at, response = entry
+        path = self._disk_path(key)
+        tmp_path = path + ".tmp"
+        with self._disk_lock:
+            try:
+                is_new = not os.path.exists(path)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"created_at": created_at, "response": response}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except Exception:
+                logging.exception("Erro ao gravar cache de LLM em disco")
+                return
+            if self._disk_count is None:
+                self._prune_disk()
+            elif is_new:
+                self._disk_count += 1
+                if self._disk_count > self.disk_max_entries:
+                    self._prune_disk()
+
+    def _remove_disk(self, path):
+        with self._disk_lock:
+            try:
+                os.remove(path)
+                if self._disk_count:
+                    self._disk_count -= 1
+            except FileNotFoundError:
+                pass
+
+    def _prune_disk(self):
+        """
+        Remove do disco as entradas expiradas (pela data de modificação, que
+        é a da gravação) e, se ainda passar de disk_max_entries, as mais
+        antigas até DISK_PRUNE_TARGET do limite. Chamado com _disk_lock.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+        expire_before = time.time() - self.ttl
+        keep = int(self.disk_max_entries * DISK_PRUNE_TARGET) if len(entries) > self.disk_max_entries else len(entries)
+        removed = 0
+        for index, (mtime, path) in enumerate(entries):
+            if mtime >= expire_before and len(entries) - index <= keep:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self.stats["disk_evictions"] += removed
+        self._disk_count = len(entries) - removed
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+
+from llm import call_llm_groq, call_llm_mistral, provider_latency
+from llm_cache import is_success, served_from_cache
+from metrics import stage
+
+# Políticas de chamada aos provedores:
+#   all   - chama todos em paralelo; falha se qualquer um falhar
+#   any   - chama todos em paralelo; basta um sucesso (resposta degradada)
+#   first - chama todos em paralelo; fica com o primeiro sucesso e cancela os demais
+#   hedge - chama o primeiro da ordem; se não responder dentro do p95 observado
+#           (ou falhar), dispara o próximo; fica com o primeiro sucesso
+POLICIES = ("all", "any", "first", "hedge")
+
+# Política por endpoint
+LLM_POLICIES = {
+    "avaliacao": os.getenv("LLM_POLICY_AVALIACAO", "any"),
+    "lote": os.getenv("LLM_POLICY_LOTE", "any"),
+}
+for _endpoint, _policy in LLM_POLICIES.items():
+    if _policy not in POLICIES:
+        raise ValueError(f"LLM_POLICY_{_endpoint.upper()} inválida: {_policy}. Opções: {', '.join(POLICIES)}")
+
+# Ordem de preferência dos provedores (first/hedge)
+LLM_PROVIDER_ORDER = [p.strip() for p in os.getenv("LLM_PROVIDER_ORDER", "groq,mistral").split(",") if p.strip()]
+# Espera antes do hedge enquanto não há amostras suficientes para o p95
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+class LLMProvider:
+    """
+    Provedor registrado: nome e corrotina call(transcrição, prompt) que
+    retorna o texto ou uma mensagem de erro (ver llm.py). Para streaming,
+    call também aceita on_delta=corrotina(trecho).
+    """
+    def __init__(self, name, call):
+        self.name = name
+        self.call = call
+        self.stats = {"calls": 0, "errors": 0, "cancelled": 0, "hedged": 0}
+
+    @property
+    def latency(self):
+        return provider_latency[self.name]
+
+    def hedge_delay(self):
+        if len(self.latency.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return self.latency.percentile(95)
+
+    def to_dict(self):
+        return {**self.stats, "latency": self.latency.to_dict(), "hedge_delay": round(self.hedge_delay(), 3)}
+
+_providers = {}
+
+def register_provider(name, call):
+    _providers[name] = LLMProvider(name, call)
+    return _providers[name]
+
+register_provider("groq", call_llm_groq)
+register_provider("mistral", call_llm_mistral)
+
+def get_policy(endpoint):
+    return LLM_POLICIES[endpoint]
+
+def provider_names():
+    """
+    Provedores registrados na ordem de preferência (LLM_PROVIDER_ORDER
+    primeiro, depois os demais na ordem de registro).
+    """
+    ordered = [name for name in LLM_PROVIDER_ORDER if name in _providers]
+    return ordered + [name for name in _providers if name not in ordered]
+
+def provider_stats():
+    return {name: _providers[name].to_dict() for name in provider_names()}
+
+async def call_providers(transcription, prompt, policy, on_result=None, latencies=None, on_delta=None):
+    """
+    Chama os provedores segundo a política (ver POLICIES).
+    `on_result` (opcional) é uma corrotina chamada como on_result(nome, resposta)
+    assim que cada provedor responde.
+    `latencies` (opcional) é um dict preenchido com nome -> duração (s) da
+    chamada de cada provedor que respondeu (com sucesso ou erro), ou None
+    quando a resposta veio do cache (sem chamada ao provedor).
+    `on_delta` (opcional) é uma corrotina chamada como on_delta(nome, trecho)
+    com as respostas em streaming; trechos de um provedor cancelado (ver
+    políticas first/hedge) podem já ter sido entregues.
+    Retorna um dict nome -> resposta (None para provedores não chamados ou
+    cancelados). Cabe a quem chama verificar se a política foi atendida
+    (ver policy_satisfied).
+    """
+    providers = [_providers[name] for name in provider_names()]
+    results = {provider.name: None for provider in providers}
+
+    async def _run(provider):
+        provider.stats["calls"] += 1
+        started = time.perf_counter()
+        with stage(f"llm_{provider.name}"):
+            if on_delta is None:
+                response = await provider.call(transcription, prompt)
+            else:
+                response = await provider.call(transcription, prompt, on_delta=functools.partial(on_delta, provider.name))
+        if latencies is not None:
+            latencies[provider.name] = None if served_from_cache() else time.perf_counter() - started
+        if not is_success(response):
+            provider.stats["errors"] += 1
+        if on_result:
+            await on_result(provider.name, response)
+        return provider, response
+
+    if policy in ("all", "any"):
+        for provider, response in await asyncio.gather(*(_run(p) for p in providers)):
+            results[provider.name] = response
+        return results
+
+    waiting = list(providers)
+    running = {}
+
+    def _launch():
+        provider = waiting.pop(0)
+        running[asyncio.create_task(_run(provider))] = provider
+        return provider
+
+    last = _launch()
+    while policy == "first" and waiting:
+        _launch()
+    try:
+        while running:
+            timeout = last.hedge_delay() if policy == "hedge" and waiting else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Sem resposta dentro do p95: dispara o próximo provedor em paralelo
+                logging.info(f"Hedge: {last.name} sem resposta em {timeout:.2f}s")
+                last.stats["hedged"] += 1
+                last = _launch()
+                continue
+            for task in done:
+                provider, response = task.result()
+                del running[task]
+                results[provider.name] = response
+                if is_success(response):
+                    return results
+            if waiting:
+                # Falhou antes do p95: não espera para chamar o próximo
+                last = _launch()
+        return results
+    finally:
+        for task, provider in running.items():
+            task.cancel()
+            provider.stats["cancelled"] += 1
+
+def policy_satisfied(policy, results):
+    """
+    Retorna (ok, erros) para os resultados de call_providers, onde `erros`
+    é um dict nome -> mensagem dos provedores que falharam.
+    """
+    errors = {name: r for name, r in results.items() if r is not None and not is_success(r)}
+    succeeded = [name for name, r in results.items() if is_success(r)]
+    if policy == "all":
+        return not errors and len(succeeded) == len(results), errors
+    return bool(succeeded), errors
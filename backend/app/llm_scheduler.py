@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from token_budget import count_tokens
+
+# Prioridades (menor = atendido primeiro)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Quotas por provedor (0 = sem limite). Podem ser ajustadas por modelo com
+# <PROVEDOR>_RPM_<MODELO> / <PROVEDOR>_TPM_<MODELO> (modelo em maiúsculas, só letras e números).
+LLM_EXPECTED_RESPONSE_TOKENS = int(os.getenv("LLM_EXPECTED_RESPONSE_TOKENS", "800"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_AFTER_DEFAULT = float(os.getenv("LLM_RETRY_AFTER_DEFAULT", "5"))
+
+_priority = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def llm_priority(priority):
+    """
+    Define a prioridade das chamadas às LLMs feitas dentro do bloco
+    (inclusive em tarefas criadas nele).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    return _priority.get()
+
+def estimate_tokens(*texts):
+    """
+    Estimativa local de tokens (ver token_budget.count_tokens).
+    """
+    return sum(count_tokens(t) for t in texts) + 1
+
+_DURATION_PART = re.compile(r"([\d.]+)(ms|h|m|s)")
+
+def parse_retry_after(headers):
+    """
+    Lê o tempo de espera dos cabeçalhos de limite do provedor: Retry-After
+    (segundos) ou x-ratelimit-reset-* no formato do Groq (ex.: "2m59.56s").
+    """
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    delays = []
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if not value:
+            continue
+        seconds = 0.0
+        for amount, unit in _DURATION_PART.findall(value):
+            seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        delays.append(seconds)
+    return max(delays) if delays else LLM_RETRY_AFTER_DEFAULT
+
+class TokenBucket:
+    """
+    Balde de fichas com capacidade `per_minute` reabastecido continuamente.
+    `per_minute` 0 desativa o limite.
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60.0)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount):
+        if self.capacity:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class ProviderLimiter:
+    """
+    Limita as chamadas de um provedor/modelo por requisições e tokens por
+    minuto. Chamadas aguardam numa fila por prioridade (e ordem de chegada);
+    só a primeira da fila é liberada quando há fichas nos dois baldes e não
+    há pausa de retry-after em vigor.
+    """
+    def __init__(self, name, rpm, tpm):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Condition()
+        self.stats = {"admitted": 0, "throttled": 0, "retry_after": 0}
+
+    def _wait_time(self, cost):
+        pause = max(0.0, self.paused_until - time.monotonic())
+        return max(pause, self.requests.wait_time(1), self.tokens.wait_time(cost))
+
+    async def acquire(self, cost, priority=None):
+        entry = (current_priority() if priority is None else priority, next(self._seq))
+        async with self._changed:
+            heapq.heappush(self._queue, entry)
+            try:
+                throttled = False
+                while True:
+                    if self._queue[0] == entry:
+                        delay = self._wait_time(cost)
+                        if delay <= 0:
+                            break
+                        throttled = True
+                    else:
+                        delay = None
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self.requests.consume(1)
+                self.tokens.consume(cost)
+                self.stats["admitted"] += 1
+                if throttled:
+                    self.stats["throttled"] += 1
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._changed.notify_all()
+
+    def record_usage(self, estimated, actual):
+        """
+        Corrige o balde de tokens com o consumo real informado pelo provedor.
+        """
+        if actual is None:
+            return
+        if actual > estimated:
+            self.tokens.consume(actual - estimated)
+        else:
+            self.tokens.refund(estimated - actual)
+
+    def pause(self, seconds):
+        """
+        Respeita o retry-after do provedor: ninguém é liberado até lá.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.stats["retry_after"] += 1
+
+    def to_dict(self):
+        return {
+            "rpm": self.requests.capacity,
+            "tpm": self.tokens.capacity,
+            "queued": len(self._queue),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            **self.stats,
+        }
+
+_limiters = {}
+
+def _quota(provider, kind, model):
+    model_key = re.sub(r"[^A-Z0-9]", "", model.upper())
+    value = os.getenv(f"{provider.upper()}_{kind}_{model_key}") or os.getenv(f"{provider.upper()}_{kind}", "0")
+    return int(value)
+
+def get_limiter(provider, model):
+    key = f"{provider}:{model}"
+    if key not in _limiters:
+        _limiters[key] = ProviderLimiter(key, _quota(provider, "RPM", model), _quota(provider, "TPM", model))
+    return _limiters[key]
+
+def limiter_stats():
+    return {key: limiter.to_dict() for key, limiter in _limiters.items()}
@@ -1,30 +1,87 @@
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, Header, Depends, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-import shutil
-import os
+import time
+import asyncio
 import logging
-from uuid import uuid4
+import os
+import json
+from typing import List, Optional
+from contextlib import asynccontextmanager
 
 # Importações dos módulos separados
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import (
-    ALLOWED_EXTENSIONS,
-    UPLOAD_DIR,
-    create_or_update_audio_record,
-    AudioRecord,  # Importa modelo
-    SessionLocal, # Importa sessão para consulta
+    DB_AUTO_MIGRATE,
+    init_db,
+    close_db,
+    get_session,
+    list_audio_records_page,
+    get_audio_record,
+    count_audio_records,
+    search_audio_records,
+    get_context_rollups,
+    ROLLUP_GROUPS,
+)
+from transcribe import (
+    transcribe_audio_cached,
+    normalize_audio,
+    transcription_cache_stats,
+    init_whisper_client,
+    close_whisper_client,
+    whisper_health,
 )
-from transcribe import transcribe_audio
-from llm import call_llm_groq, call_llm_mistral
+from llm import call_llm_groq, call_llm_mistral, init_http_client, close_http_client
+from pipeline import save_upload, save_zip_uploads, remove_saved, resolve_audio, run_avaliacao, run_avaliacao_batch
+from jobs import job_manager
+from live import run_live_session
+from streaming import sse_response
+from export import EXPORT_FORMATS, export_audio_records
+from idempotency import idempotency_store, make_key as idempotency_key_for
+from storage import STORAGE_DRY_RUN, storage_manager
+from uploads import ingest_stream, create_resumable_upload, get_upload, append_chunk
+from prompts import render_prompt, PROMPT_TEMPLATES, DEFAULT_PROMPT_TEMPLATE
+from llm_cache import llm_cache
+from llm_scheduler import limiter_stats
+from token_budget import budget_stats
+from llm_providers import LLM_POLICIES, provider_stats
+import metrics
+from metrics import stage
 
 load_dotenv()
 
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Esquema do banco (fora da importação; ver database.init_db)
+    if DB_AUTO_MIGRATE:
+        await init_db()
+    # Pool HTTP compartilhado (keep-alive) para as chamadas às LLMs
+    await init_http_client()
+    # Cliente do Whisper com sonda de prontidão em segundo plano
+    await init_whisper_client()
+    # Workers de segundo plano para as avaliações assíncronas (/jobs/)
+    await job_manager.start()
+    # Ciclo de vida dos arquivos em UPLOAD_DIR (retenção, órfãos, compactação)
+    await storage_manager.start()
+    try:
+        yield
+    finally:
+        await storage_manager.stop()
+        await job_manager.stop()
+        await close_whisper_client()
+        await close_http_client()
+        await close_db()
+
 app = FastAPI(
     title="SmartNLP Audio API",
     description="Recebe áudio, transcreve, envia para LLM e retorna resposta.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -35,9 +92,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Mede a duração das requisições e acumula os tempos das etapas do pipeline.
+    Se a requisição trouxer o cabeçalho X-Trace, a resposta inclui
+    Server-Timing com a duração de cada etapa.
+    """
+    trace = metrics.start_trace()
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.http_request_duration.observe(
+        time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+    )
+    if request.headers.get("x-trace"):
+        trace.append(("total", time.perf_counter() - started))
+        response.headers["Server-Timing"] = metrics.server_timing(trace)
+    return response
+
+def _cache_metrics():
+    return [
+        ("smartnlp_transcription_cache_total", "counter", "Consultas ao cache de transcrições.",
+         [({"result": result}, value) for result, value in transcription_cache_stats.items()]),
+        ("smartnlp_llm_cache_total", "counter", "Consultas ao cache de respostas das LLMs.",
+         [({"result": result}, value) for result, value in llm_cache.stats.items()]),
+    ]
+
+metrics.register_collector(_cache_metrics)
+
+@app.get("/metrics", summary="Métricas no formato texto do Prometheus")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health", summary="Healthcheck")
 def healthcheck():
-    return {"status": "ok"}
+    return {"status": "ok", "whisper": whisper_health()}
+
+@app.get("/storage/lifecycle", summary="Relatório da última execução do ciclo de vida do armazenamento")
+def storage_lifecycle_report():
+    if storage_manager.last_report is None:
+        raise HTTPException(status_code=404, detail="O ciclo de vida ainda não foi executado.")
+    return storage_manager.last_report
+
+@app.post("/storage/lifecycle", summary="Executa o ciclo de vida do armazenamento (dry-run por padrão)")
+async def storage_lifecycle_run(dry_run: bool = Query(True, description="Só gera o relatório, sem alterar arquivos")):
+    """
+    Remove órfãos e uploads abandonados, aplica retenção por idade/quota e
+    compacta/move os áudios para o layout em shards. Retorna o relatório.
+    Aplicar as ações (dry_run=false) exige STORAGE_DRY_RUN=false.
+    """
+    if not dry_run and STORAGE_DRY_RUN:
+        raise HTTPException(status_code=403, detail="Ciclo de vida em modo dry-run (STORAGE_DRY_RUN).")
+    return await storage_manager.run(dry_run=dry_run)
+
+@app.get("/cache/stats", summary="Contadores de acerto/falha dos caches")
+def cache_stats():
+    return {"transcription": transcription_cache_stats, "llm": llm_cache.stats, "idempotency": idempotency_store.stats}
+
+@app.get("/llm/limits", summary="Estado dos limitadores de taxa das LLMs por provedor/modelo")
+def llm_limits():
+    return limiter_stats()
+
+@app.get("/llm/budget", summary="Orçamento de tokens das LLMs por provedor/modelo e tokens economizados")
+def llm_budget():
+    return budget_stats()
+
+@app.get("/llm/providers", summary="Provedores de LLM registrados, políticas e latências observadas")
+def llm_providers():
+    return {"policies": LLM_POLICIES, "providers": provider_stats()}
+
+@app.get("/prompt_templates/", summary="Lista os templates de prompt versionados")
+def list_prompt_templates():
+    return {
+        "default": DEFAULT_PROMPT_TEMPLATE,
+        "templates": {t.id: {"fields": list(t.fields)} for t in PROMPT_TEMPLATES.values()},
+    }
 
 @app.post("/avaliacao/", summary="Upload de áudio e avaliação das LLMs Groq e Mistral")
 async def avaliacao(
@@ -48,134 +178,361 @@ async def avaliacao(
     etapa_descricao: str = Form(...),
     pratica_descricao: str = Form(...),
     parametros_descricao: str = Form(...),  #nome dos gabartos que estão em tela
-    file: UploadFile = File(...) #arquivos endereço que já está sendo gravado.
+    file: Optional[UploadFile] = File(None), #arquivos endereço que já está sendo gravado.
+    upload_id: Optional[str] = Form(None), #upload já concluído em /uploads/ (alternativa ao file)
+    stream: bool = Form(False), #transmite etapas e tokens das LLMs como Server-Sent Events
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255) #identifica as repetições da mesma requisição
 ):
     """
     Recebe um arquivo de áudio, a descrição da prática e a situação de aprendizagem, transcreve o audio, envia para a LLMs Groq e Mistral e retorna resposta, salvando em banco de dados.
+    Com `stream`, a resposta é SSE: eventos "stage" (etapas do pipeline), "delta" ({"provider", "text"}) e "result" com o mesmo corpo da resposta JSON (ou "error"). O registro é salvo ao fim do stream mesmo que o cliente desconecte.
+    Repetições da mesma requisição (mesmo cabeçalho Idempotency-Key ou, sem ele, mesmo id, áudio e contexto) aguardam a avaliação em andamento ou recebem o resultado guardado (ver idempotency.py), com o cabeçalho Idempotent-Replayed.
+    """
+    contexto = {
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    }
+    key = idempotency_key_for("avaliacao", idempotency_key) if idempotency_key else None
+    # Repetição de uma avaliação já concluída: devolve o resultado guardado
+    # sem salvar o áudio. Em andamento ou sem resultado, segue normalmente
+    # com o próprio áudio (ver IdempotencyStore.run).
+    replay = idempotency_store.result(key, fingerprint=id) if key else None
+    if replay is None:
+        with stage("upload"):
+            audio_path, audio_sha256 = await asyncio.to_thread(resolve_audio, file, upload_id, id)
+        if key is None:
+            key = idempotency_key_for("avaliacao", id, audio_sha256, contexto)
+            replay = idempotency_store.result(key, fingerprint=id)
+            if replay is not None and file is not None:
+                await asyncio.to_thread(_remove_file, audio_path)
+
+    async def _evaluate(**kwargs):
+        result, replayed = await idempotency_store.run(
+            key, lambda: run_avaliacao(id, audio_path, audio_sha256, contexto, **kwargs), fingerprint=id,
+        )
+        if replayed and file is not None:
+            # Atendida pela execução em andamento: o áudio desta não foi usado
+            await asyncio.to_thread(_remove_file, audio_path)
+        return result, replayed
+
+    if stream:
+        async def run(emit):
+            if replay is not None:
+                await emit("result", replay)
+                return
+            async def progress(stage, data):
+                await emit("stage", {"stage": stage, **data})
+            async def on_delta(provider, text):
+                await emit("delta", {"provider": provider, "text": text})
+            result, _ = await _evaluate(progress=progress, on_delta=on_delta)
+            await emit("result", result)
+        return sse_response(run)
+    if replay is not None:
+        result, replayed = replay, True
+    else:
+        result, replayed = await _evaluate()
+    return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+@app.post("/jobs/avaliacao/", status_code=202, summary="Enfileira uma avaliação e retorna o id do job")
+async def avaliacao_job(
+    id: int = Form(...),
+    area_especialista: str = Form(...),
+    turma: str = Form(...),
+    sa_descricao: str = Form(...),
+    etapa_descricao: str = Form(...),
+    pratica_descricao: str = Form(...),
+    parametros_descricao: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None)
+):
+    """
+    Salva o áudio e enfileira o pipeline de avaliação em um worker de segundo plano.
+    Retorna 202 com o id do job; acompanhe por GET /jobs/{job_id} ou pelo stream SSE /jobs/{job_id}/events.
+    """
+    with stage("upload"):
+        audio_path, audio_sha256 = await asyncio.to_thread(resolve_audio, file, upload_id, id)
+    contexto = {
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    }
+    return _submit_avaliacao_job(id, audio_path, audio_sha256, contexto, prefix="")
+
+def _submit_avaliacao_job(id, audio_path, audio_sha256, contexto, prefix):
+    job = job_manager.submit("avaliacao", lambda progress: run_avaliacao(id, audio_path, audio_sha256, contexto, progress))
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"{prefix}/jobs/{job.id}",
+            "events_url": f"{prefix}/jobs/{job.id}/events",
+        }
+    )
+
+@app.websocket("/ws/avaliacao/")
+async def avaliacao_live(websocket: WebSocket):
+    """
+    Avaliação com transcrição durante a gravação: recebe os blocos do
+    MediaRecorder, envia a transcrição parcial e, ao parar, o resultado da
+    avaliação (protocolo em live.LiveSession).
     """
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
+    await run_live_session(websocket)
 
-    unique_name = f"{id}_{uuid4().hex}{ext}"
-    audio_path = os.path.join(UPLOAD_DIR, unique_name)
+@app.websocket("/api/ws/avaliacao/")
+async def avaliacao_live_api(websocket: WebSocket):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    await run_live_session(websocket)
+
+@app.post("/avaliacao/lote/", summary="Avaliação em lote de vários áudios (ou um .zip) com o mesmo contexto")
+async def avaliacao_lote(
+    first_id: int = Form(..., description="Id do primeiro registro; os demais recebem ids sequenciais"),
+    area_especialista: str = Form(...),
+    turma: str = Form(...),
+    sa_descricao: str = Form(...),
+    etapa_descricao: str = Form(...),
+    pratica_descricao: str = Form(...),
+    parametros_descricao: str = Form(...),
+    files: List[UploadFile] = File(..., description="Arquivos de áudio e/ou arquivos .zip com áudios")
+):
+    """
+    Recebe vários áudios de uma mesma aula, transcreve e avalia com concorrência limitada (BATCH_CONCURRENCY)
+    e devolve um NDJSON com uma linha por áudio assim que cada um termina, mais uma linha final de resumo.
+    Todos os registros são gravados numa única transação ao final; se o cliente desconectar antes, os já avaliados são gravados na hora.
+    """
+    # Cópia, hash e extração fora do event loop
+    with stage("upload"):
+        saved = await asyncio.to_thread(_save_batch_files, files)
+
+    items = [(first_id + index, name, path, sha) for index, (name, path, sha) in enumerate(saved)]
+    contexto = {
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    }
+
+    async def ndjson():
+        async for item in run_avaliacao_batch(items, contexto, BATCH_CONCURRENCY):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+def _save_batch_files(files):
+    """
+    Salva os arquivos do lote (extraindo os .zip) e retorna [(nome, caminho, hash)].
+    O limite é verificado antes de salvar cada arquivo (e cada zip, antes de
+    extrair); se o lote for recusado, o que já foi salvo é removido.
+    """
+    saved = []
     try:
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        logging.exception("Erro ao salvar arquivo de áudio")
-        raise HTTPException(status_code=500, detail="Erro ao salvar arquivo de áudio.")
+        for file in files:
+            if os.path.splitext(file.filename)[1].lower() == ".zip":
+                saved.extend(save_zip_uploads(file, "lote", max_files=BATCH_MAX_FILES - len(saved)))
+            else:
+                if len(saved) >= BATCH_MAX_FILES:
+                    raise HTTPException(status_code=400, detail=f"Lote acima do limite de {BATCH_MAX_FILES} arquivos.")
+                audio_path, audio_sha256 = save_upload(file, "lote")
+                saved.append((file.filename, audio_path, audio_sha256))
+        if not saved:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo de áudio suportado no lote.")
+    except Exception:
+        remove_saved(saved)
+        raise
+    return saved
+
+@app.post("/api/avaliacao/lote/", summary="Avaliação em lote (com prefixo /api/)")
+async def avaliacao_lote_api(
+    first_id: int = Form(...),
+    area_especialista: str = Form(...),
+    turma: str = Form(...),
+    sa_descricao: str = Form(...),
+    etapa_descricao: str = Form(...),
+    pratica_descricao: str = Form(...),
+    parametros_descricao: str = Form(...),
+    files: List[UploadFile] = File(...)
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await avaliacao_lote(first_id, area_especialista, turma, sa_descricao, etapa_descricao, pratica_descricao, parametros_descricao, files)
 
-    transcription = transcribe_audio(audio_path)
-    if transcription.startswith("Erro"):
-        logging.error(transcription)
-        raise HTTPException(status_code=500, detail=transcription)
+@app.get("/jobs/{job_id}", summary="Status e resultado de um job de avaliação")
+def job_status(job_id: str):
+    """
+    Retorna o estado atual do job (queued, running, done, error), a etapa e o resultado quando concluído.
+    """
+    return job_manager.get(job_id).to_dict()
 
-    txt_path = audio_path + ".txt"
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(transcription)
-
-    prompt_v1 = ("Você é um especialista em " 
-              + area_especialista + 
-              " e vai avaliar a transcrição do audio do aluno que explica o que está fazendo. Deve responder com uma avaliação e sugestões de melhorias, cuidados e pontos de atenção. Considere que o aluno está em um ambiente de aprendizagem e não tem experiência. Também considere que o aluno pode ter dificuldades de comunicação e pode não usar a terminologia correta. Seja gentil e encorajador, mas também honesto e direto. Não use jargões técnicos ou termos complexos. Responda em português. Aluno está realizando essa prática: " 
-              + pratica_descricao + 
-              ". Desta Situação de Aprendizagem: " 
-              + sa_descricao)
-    
-    prompt_v2 = (
-        "Você é um Tutor de Inteligência Artificial especializado em práticas de laboratório de " + area_especialista + " para estudantes de educação profissional e superior. "
-        "Sua tarefa é analisar a transcrição de áudio de um aluno que descreve o que está fazendo em uma atividade prática. "
-        "Com base na transcrição, forneça um feedback pedagógico construtivo para ajudar o aluno a melhorar seu entendimento e execução da prática. "
-        "Inclua uma avaliação geral, sugestões de melhoria, pontos de atenção importantes (especialmente relacionados à segurança) e reconheça os acertos. "
-        "Lembre-se que o aluno está em um ambiente de aprendizado, na turma " + turma + " de contato com o laboratório."
-        "Considere que ele está adquirindo experiência e pode ter dificuldades de comunicação, usando terminologia incorreta ou incompleta."
-        "Seja gentil, paciente e encorajador, mas também honesto e direto em suas observações. "
-        "Use uma linguagem clara e simples, evitando jargões técnicos complexos, como se estivesse conversando diretamente com o aluno no laboratório."
-        "Sua resposta deve ser em português."
-        "O aluno está realizando a seguinte prática: "+ pratica_descricao +", que faz parte da Situação de Aprendizagem: "+ sa_descricao +"."
-        "Foque em avaliar se a descrição do aluno reflete um bom entendimento dos passos, dos parâmetros importantes como  " + parametros_descricao + " , dos cuidados de segurança  e da finalidade da etapa que está realizando."
-        "Não avalie a qualidade da atividade em si, apenas a descrição verbal do aluno sobre suas ações e intenções."
-    )
-    prompt = (
-        "Você é um Tutor IA de laboratório de " + area_especialista + " para estudantes (profissional/superior). "
-        "Analise a transcrição de áudio de um aluno explicando sua prática. "
-        "Forneça feedback pedagógico construtivo (avaliação, sugestões, pontos de atenção - **segurança**!, acertos). "
-        "Considere que é um aluno em aprendizado na turma(" + turma + "), adquirindo experiência, com possíveis dificuldades de comunicação/terminologia. "
-        "Seja gentil, paciente, encorajador, mas direto. Use linguagem simples, sem jargões, como em conversa no lab. "
-        "Resposta em português. "
-        "Prática em Execução: '" + pratica_descricao + "', da Etapa: '" + etapa_descricao + "', da Situação de Aprendizagem: '" + sa_descricao + "'. "
-        "Avalie o entendimento da descrição sobre passos, parâmetros importantes (" + parametros_descricao + "), **cuidados de segurança**, e objetivo da etapa. "
-        "Não avalie a qualidade física da prática, apenas a explicação verbal."
+@app.get("/jobs/{job_id}/events", summary="Stream SSE com o progresso de um job de avaliação")
+async def job_events(job_id: str):
+    """
+    Envia por Server-Sent Events cada etapa do job (transcribing, groq, mistral, saved) e um evento final "end".
+    """
+    job_manager.get(job_id)
+    return StreamingResponse(
+        job_manager.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    llm_response_mistral = call_llm_mistral(transcription, prompt)
-    llm_response_groq = call_llm_groq(transcription, prompt)
+@app.post("/api/jobs/avaliacao/", status_code=202, summary="Enfileira uma avaliação (com prefixo /api/)")
+async def avaliacao_job_api(
+    id: int = Form(...),
+    area_especialista: str = Form(...),
+    turma: str = Form(...),
+    sa_descricao: str = Form(...),
+    etapa_descricao: str = Form(...),
+    pratica_descricao: str = Form(...),
+    parametros_descricao: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None)
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    with stage("upload"):
+        audio_path, audio_sha256 = await asyncio.to_thread(resolve_audio, file, upload_id, id)
+    contexto = {
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    }
+    return _submit_avaliacao_job(id, audio_path, audio_sha256, contexto, prefix="/api")
+
+@app.get("/api/jobs/{job_id}", summary="Status e resultado de um job de avaliação (com prefixo /api/)")
+def job_status_api(job_id: str):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return job_status(job_id)
 
-    if llm_response_mistral.startswith("Erro"):
-        logging.error(llm_response_mistral)
-        raise HTTPException(status_code=500, detail=llm_response_mistral)
+@app.get("/api/jobs/{job_id}/events", summary="Stream SSE de um job de avaliação (com prefixo /api/)")
+async def job_events_api(job_id: str):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await job_events(job_id)
 
-    if llm_response_groq.startswith("Erro"):
-        logging.error(llm_response_groq)
-        raise HTTPException(status_code=500, detail=llm_response_groq)
+@app.post("/uploads/", summary="Upload em passagem única do corpo da requisição (áudio bruto)")
+async def upload_stream(request: Request, filename: str = Query(..., description="Nome original do arquivo (define a extensão)")):
+    """
+    Lê o corpo uma única vez: aplica o limite UPLOAD_MAX_BYTES, calcula o SHA-256 e normaliza pelo ffmpeg enquanto grava.
+    Use o `upload_id` retornado em /avaliacao/, /jobs/avaliacao/ ou /transcribe/ no lugar do arquivo.
+    """
+    return await ingest_stream(request.stream(), filename)
 
-    try:
-        create_or_update_audio_record(
-            id=id,
-            audio_path=audio_path,            
-            prompt=prompt,
-            transcription=transcription,
-            llm_groq=llm_response_groq,
-            llm_mistral=llm_response_mistral
-        )
-    except Exception as e:
-        logging.exception("Erro ao salvar no banco de dados")
-        raise HTTPException(status_code=500, detail="Erro ao salvar no banco de dados.")
+@app.post("/uploads/resumable/", status_code=201, summary="Inicia um upload retomável em blocos")
+def upload_resumable_create(filename: str = Form(...), size: int = Form(..., description="Tamanho total em bytes")):
+    """
+    Cria um upload retomável. Envie os blocos com PATCH /uploads/{upload_id} e o cabeçalho Upload-Offset.
+    """
+    return create_resumable_upload(filename, size)
 
-    return JSONResponse(
-        content={
-            "id": id,
-            "audio_path": audio_path,
-            "prompt": prompt,
-            "transcription": transcription,
-            "llm_response_groq": llm_response_groq,
-            "llm_response_mistral": llm_response_mistral
-        }
-    )
+@app.get("/uploads/{upload_id}", summary="Estado e deslocamento atual de um upload")
+def upload_status(upload_id: str):
+    """
+    Retorna o estado do upload; `offset` indica de onde o cliente deve retomar.
+    """
+    meta = get_upload(upload_id)
+    return JSONResponse(content=meta, headers={"Upload-Offset": str(meta["offset"])})
+
+@app.patch("/uploads/{upload_id}", summary="Envia um bloco de um upload retomável")
+async def upload_append(request: Request, upload_id: str, upload_offset: int = Header(..., alias="Upload-Offset")):
+    """
+    Acrescenta o corpo da requisição a partir de Upload-Offset. Ao completar o tamanho declarado, o upload é finalizado.
+    """
+    meta = await append_chunk(upload_id, upload_offset, request.stream())
+    return JSONResponse(content=meta, headers={"Upload-Offset": str(meta["offset"])})
+
+@app.post("/api/uploads/", summary="Upload em passagem única (com prefixo /api/)")
+async def upload_stream_api(request: Request, filename: str = Query(...)):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await upload_stream(request, filename)
+
+@app.post("/api/uploads/resumable/", status_code=201, summary="Inicia um upload retomável (com prefixo /api/)")
+def upload_resumable_create_api(filename: str = Form(...), size: int = Form(...)):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return upload_resumable_create(filename, size)
+
+@app.get("/api/uploads/{upload_id}", summary="Estado de um upload (com prefixo /api/)")
+def upload_status_api(upload_id: str):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return upload_status(upload_id)
+
+@app.patch("/api/uploads/{upload_id}", summary="Envia um bloco de um upload retomável (com prefixo /api/)")
+async def upload_append_api(request: Request, upload_id: str, upload_offset: int = Header(..., alias="Upload-Offset")):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await upload_append(request, upload_id, upload_offset)
 
 @app.post("/transcribe/", summary="Transcreve apenas o áudio")
-async def transcribe_audio_endpoint(file: UploadFile = File(...)):
+async def transcribe_audio_endpoint(file: Optional[UploadFile] = File(None), upload_id: Optional[str] = Form(None)):
     """
     Recebe um arquivo de áudio, salva no servidor e retorna a transcrição.
     """
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
-    unique_name = f"transcribe_{uuid4().hex}{ext}"
-    audio_path = os.path.join(UPLOAD_DIR, unique_name)
-    try:
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        logging.exception("Erro ao salvar arquivo de áudio")
-        raise HTTPException(status_code=500, detail="Erro ao salvar arquivo de áudio.")
+    with stage("upload"):
+        audio_path, audio_sha256 = await asyncio.to_thread(resolve_audio, file, upload_id, "transcribe")
+    with stage("normalize"):
+        audio_path, audio_stats = await asyncio.to_thread(normalize_audio, audio_path)
 
-    transcription = transcribe_audio(audio_path)
+    with stage("transcribe"):
+        transcription = await transcribe_audio_cached(audio_path, audio_sha256)
     if transcription.startswith("Erro"):
         logging.error(transcription)
         raise HTTPException(status_code=500, detail=transcription)
 
-    txt_path = audio_path + ".txt"
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(transcription)
-
     return JSONResponse(
         content={
             "audio_path": audio_path,
+            "audio": audio_stats,
             "transcription": transcription
         }
     )
 
+def _llm_stream(call, llm, transcription, prompt, bypass_cache):
+    """
+    Resposta SSE das rotas /llm-*/ com `stream`: eventos "delta" ({"text"})
+    à medida que os tokens chegam e um "end" com o mesmo corpo da resposta
+    JSON ao final (ou "error").
+    """
+    async def run(emit):
+        async def on_delta(text):
+            await emit("delta", {"text": text})
+        llm_response = await call(transcription, prompt, bypass_cache=bypass_cache, on_delta=on_delta)
+        if llm_response.startswith("Erro"):
+            logging.error(llm_response)
+            raise HTTPException(status_code=500, detail=llm_response)
+        await emit("end", {"prompt": prompt, "llm_response": llm_response, "llm": llm})
+    return sse_response(run)
+
 @app.post("/llm-groq/", summary="Recebe Descrição da SA, Descrição da Pratica e Transcriçaõ do Audio do Aluno em texto e retorna resposta da LLM Groq")
 async def llm_endpoint(
     area_especialista: str = Form(...),
@@ -184,22 +541,24 @@ async def llm_endpoint(
     etapa_descricao: str = Form(...),
     pratica_descricao: str = Form(...),
     parametros_descricao: str = Form(...),
-    transcription: str = Form(...)):
+    transcription: str = Form(...),
+    bypass_cache: bool = Form(False),
+    stream: bool = Form(False)):
     """
     Recebe uma transcrição de audio de um aluno de usinagem e retorna a resposta da LLM Groq, considerando a prática e a situação de aprendizagem informadas.
+    Com `stream`, a resposta é transmitida como Server-Sent Events (ver _llm_stream).
     """
-    prompt = (
-        "Você é um Tutor IA de laboratório de " + area_especialista + " para estudantes (profissional/superior). "
-        "Analise a transcrição de áudio de um aluno explicando sua prática. "
-        "Forneça feedback pedagógico construtivo (avaliação, sugestões, pontos de atenção - **segurança**!, acertos). "
-        "Considere que é um aluno em aprendizado na turma(" + turma + "), adquirindo experiência, com possíveis dificuldades de comunicação/terminologia. "
-        "Seja gentil, paciente, encorajador, mas direto. Use linguagem simples, sem jargões, como em conversa no lab. "
-        "Resposta em português. "
-        "Prática em Execução: '" + pratica_descricao + "', da Etapa: '" + etapa_descricao + "', da Situação de Aprendizagem: '" + sa_descricao + "'. "
-        "Avalie o entendimento da descrição sobre passos, parâmetros importantes (" + parametros_descricao + "), **cuidados de segurança**, e objetivo da etapa. "
-        "Não avalie a qualidade física da prática, apenas a explicação verbal."
-    )
-    llm_response = call_llm_groq(transcription, prompt)
+    prompt = render_prompt({
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    })
+    if stream:
+        return _llm_stream(call_llm_groq, "groq", transcription, prompt, bypass_cache)
+    llm_response = await call_llm_groq(transcription, prompt, bypass_cache=bypass_cache)
     if llm_response.startswith("Erro"):
         logging.error(llm_response)
         raise HTTPException(status_code=500, detail=llm_response)
@@ -219,22 +578,24 @@ async def llm_mistral_endpoint(
     etapa_descricao: str = Form(...),
     pratica_descricao: str = Form(...),
     parametros_descricao: str = Form(...),
-    transcription: str = Form(...)):
+    transcription: str = Form(...),
+    bypass_cache: bool = Form(False),
+    stream: bool = Form(False)):
     """
     Recebe uma transcrição de audio de um aluno de usinagem e retorna a resposta da LLM Mistral, considerando a prática e a situação de aprendizagem informadas.
+    Com `stream`, a resposta é transmitida como Server-Sent Events (ver _llm_stream).
     """
-    prompt = (
-        "Você é um Tutor IA de laboratório de " + area_especialista + " para estudantes (profissional/superior). "
-        "Analise a transcrição de áudio de um aluno explicando sua prática. "
-        "Forneça feedback pedagógico construtivo (avaliação, sugestões, pontos de atenção - **segurança**!, acertos). "
-        "Considere que é um aluno em aprendizado na turma(" + turma + "), adquirindo experiência, com possíveis dificuldades de comunicação/terminologia. "
-        "Seja gentil, paciente, encorajador, mas direto. Use linguagem simples, sem jargões, como em conversa no lab. "
-        "Resposta em português. "
-        "Prática em Execução: '" + pratica_descricao + "', da Etapa: '" + etapa_descricao + "', da Situação de Aprendizagem: '" + sa_descricao + "'. "
-        "Avalie o entendimento da descrição sobre passos, parâmetros importantes (" + parametros_descricao + "), **cuidados de segurança**, e objetivo da etapa. "
-        "Não avalie a qualidade física da prática, apenas a explicação verbal."
-    )
-    llm_response = call_llm_mistral(transcription, prompt)
+    prompt = render_prompt({
+        "area_especialista": area_especialista,
+        "turma": turma,
+        "sa_descricao": sa_descricao,
+        "etapa_descricao": etapa_descricao,
+        "pratica_descricao": pratica_descricao,
+        "parametros_descricao": parametros_descricao,
+    })
+    if stream:
+        return _llm_stream(call_llm_mistral, "mistral", transcription, prompt, bypass_cache)
+    llm_response = await call_llm_mistral(transcription, prompt, bypass_cache=bypass_cache)
     if llm_response.startswith("Erro"):
         logging.error(llm_response)
         raise HTTPException(status_code=500, detail=llm_response)
@@ -247,45 +608,161 @@ async def llm_mistral_endpoint(
     )
 
 @app.get("/audio_records/", summary="Lista registros de áudio com paginação")
-def list_audio_records(skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
+async def list_audio_records(
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[int] = Query(None, description="Id do último item da página anterior (paginação por chave)"),
+    skip: int = Query(0, ge=0, description="Deslocamento (modo legado, ignorado se houver cursor)"),
+    view: str = Query("summary", pattern="^(summary|full)$", description="summary: só prévias dos textos; full: registro completo"),
+    include_total: bool = Query(False, description="Inclui o total de registros (valor em cache)")
+):
     """
     Retorna registros da tabela audio_records, ordenados do mais recente para o mais antigo.
+    Use `next_cursor` da resposta como `cursor` para obter a próxima página.
     """
-    db = SessionLocal()
-    print(f"Conectando ao banco de dados para consulta: {db.bind.url}")
-    if not db.bind.url:
-        raise HTTPException(status_code=500, detail="Banco de dados não configurado corretamente.")
     try:
-        total = db.query(AudioRecord).count()
-        records = (
-            db.query(AudioRecord)
-            .order_by(AudioRecord.id.desc())
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
-        items = [
-            {
-                "id": r.id,
-                "audio_path": r.audio_path,
-                "prompt": r.prompt,
-                "transcription": r.transcription,
-                "llm_groq": r.llm_groq,
-                "llm_mistral": r.llm_mistral,
-            }
-            for r in records
-        ]
-        return {"total": total, "items": items}
-    finally:
-        db.close()
+        items, next_cursor = await list_audio_records_page(session, limit, cursor=cursor, skip=skip, summary=(view == "summary"))
+        result = {"items": items, "next_cursor": next_cursor}
+        if include_total:
+            result["total"] = await count_audio_records(session)
+        return result
+    except Exception:
+        logging.exception("Erro ao consultar registros de áudio")
+        raise HTTPException(status_code=500, detail="Erro ao consultar registros de áudio.")
+
+@app.get("/audio_records/search", summary="Busca de texto nas transcrições e avaliações")
+async def search_records(
+    session: AsyncSession = Depends(get_session),
+    q: str = Query(..., min_length=1, max_length=200, description="Termos da busca"),
+    limit: int = Query(10, ge=1, le=100),
+    skip: int = Query(0, ge=0, le=1000),
+    id_min: Optional[int] = Query(None, description="Menor id considerado"),
+    id_max: Optional[int] = Query(None, description="Maior id considerado"),
+):
+    """
+    Busca por relevância na transcrição e nas respostas das LLMs (índice de
+    texto completo). Cada item traz o id, a relevância e trechos com os
+    termos destacados em <mark>; use /audio_records/{id} para o registro completo.
+    """
+    try:
+        items = await search_audio_records(session, q, limit=limit, offset=skip, id_min=id_min, id_max=id_max)
+    except Exception:
+        logging.exception("Erro na busca de registros de áudio")
+        raise HTTPException(status_code=500, detail="Erro na busca de registros de áudio.")
+    return {"query": q, "items": items}
+
+@app.get("/audio_records/export", summary="Exporta os registros de áudio em NDJSON ou CSV (streaming)")
+def export_records(
+    fmt: str = Query("ndjson", alias="format", pattern=f"^({'|'.join(EXPORT_FORMATS)})$", description="ndjson ou csv"),
+    id_min: Optional[int] = Query(None, description="Menor id exportado"),
+    id_max: Optional[int] = Query(None, description="Maior id exportado"),
+    turma: Optional[str] = Query(None, description="Exporta só uma turma"),
+    area_especialista: Optional[str] = Query(None, description="Exporta só uma área"),
+    gzip: bool = Query(False, description="Comprime a resposta (Content-Encoding: gzip)"),
+):
+    """
+    Exporta todos os registros (ou o intervalo/filtro informado) em ordem de
+    id numa única resposta em streaming, lida por cursor no servidor: a
+    memória do worker não cresce com o número de registros.
+    """
+    media_type, extension = EXPORT_FORMATS[fmt]
+    headers = {
+        "Content-Disposition": f'attachment; filename="audio_records.{extension}"',
+        "X-Accel-Buffering": "no",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    body = export_audio_records(
+        fmt, compress=gzip, id_min=id_min, id_max=id_max, turma=turma, area_especialista=area_especialista,
+    )
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@app.get("/audio_records/{id}", summary="Retorna um registro de áudio completo")
+async def read_audio_record(id: int, session: AsyncSession = Depends(get_session)):
+    """
+    Retorna o registro completo (prompt, transcrição e respostas das LLMs).
+    """
+    record = await get_audio_record(session, id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Registro não encontrado.")
+    return record
+
+@app.get("/analytics/context", summary="Avaliações, transcrição e LLMs por turma/área")
+async def analytics_context(
+    session: AsyncSession = Depends(get_session),
+    group_by: str = Query("turma", pattern=f"^({'|'.join(ROLLUP_GROUPS)})$", description="turma, area_especialista ou turma_area"),
+    turma: Optional[str] = Query(None, description="Filtra uma turma (\"\" = registros sem turma)"),
+    area_especialista: Optional[str] = Query(None, description="Filtra uma área (\"\" = registros sem área)"),
+):
+    """
+    Volume de avaliações, tamanho médio da transcrição e, por provedor,
+    chamadas, taxa de erro e latência média. Lido dos agregados mantidos a
+    cada gravação, sem varrer audio_records.
+    """
+    items = await get_context_rollups(session, group_by, turma=turma, area_especialista=area_especialista)
+    return {"group_by": group_by, "items": items}
 
 # Rota alternativa para compatibilidade com proxy /api/
 @app.get("/api/audio_records/", summary="Lista registros de áudio com paginação (com prefixo /api/)")
-def list_audio_records_api(skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
+async def list_audio_records_api(
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[int] = Query(None),
+    skip: int = Query(0, ge=0),
+    view: str = Query("summary", pattern="^(summary|full)$"),
+    include_total: bool = Query(False)
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await list_audio_records(session, limit, cursor, skip, view, include_total)
+
+@app.get("/api/analytics/context", summary="Avaliações, transcrição e LLMs por turma/área (com prefixo /api/)")
+async def analytics_context_api(
+    session: AsyncSession = Depends(get_session),
+    group_by: str = Query("turma", pattern=f"^({'|'.join(ROLLUP_GROUPS)})$"),
+    turma: Optional[str] = Query(None),
+    area_especialista: Optional[str] = Query(None),
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await analytics_context(session, group_by, turma, area_especialista)
+
+@app.get("/api/audio_records/search", summary="Busca de texto nas transcrições e avaliações (com prefixo /api/)")
+async def search_records_api(
+    session: AsyncSession = Depends(get_session),
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=100),
+    skip: int = Query(0, ge=0, le=1000),
+    id_min: Optional[int] = Query(None),
+    id_max: Optional[int] = Query(None),
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return await search_records(session, q, limit, skip, id_min, id_max)
+
+@app.get("/api/audio_records/export", summary="Exporta os registros de áudio (com prefixo /api/)")
+def export_records_api(
+    fmt: str = Query("ndjson", alias="format", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    id_min: Optional[int] = Query(None),
+    id_max: Optional[int] = Query(None),
+    turma: Optional[str] = Query(None),
+    area_especialista: Optional[str] = Query(None),
+    gzip: bool = Query(False),
+):
+    """
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
+    """
+    return export_records(fmt, id_min, id_max, turma, area_especialista, gzip)
+
+@app.get("/api/audio_records/{id}", summary="Retorna um registro de áudio completo (com prefixo /api/)")
+async def read_audio_record_api(id: int, session: AsyncSession = Depends(get_session)):
     """
     Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
     """
-    return list_audio_records(skip, limit)
+    return await read_audio_record(id, session)
 
 @app.post("/api/avaliacao/", summary="Upload de áudio e avaliação (com prefixo /api/)")
 async def avaliacao_api(
@@ -296,97 +773,12 @@ async def avaliacao_api(
     etapa_descricao: str = Form(...),
     pratica_descricao: str = Form(...),
     parametros_descricao: str = Form(...),   
-    file: UploadFile = File(...)
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
     """
-    Recebe um arquivo de áudio, a descrição da prática e a situação de aprendizagem, transcreve o audio, envia para a LLMs Groq e Mistral e retorna resposta, salvando em banco de dados.
+    Rota alternativa para compatibilidade com proxy nginx que mantém o prefixo /api/.
     """
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
-
-    unique_name = f"{id}_{uuid4().hex}{ext}"
-    audio_path = os.path.join(UPLOAD_DIR, unique_name)
-    try:
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        logging.exception("Erro ao salvar arquivo de áudio")
-        raise HTTPException(status_code=500, detail="Erro ao salvar arquivo de áudio.")
-
-    transcription = transcribe_audio(audio_path)
-    if transcription.startswith("Erro"):
-        logging.error(transcription)
-        raise HTTPException(status_code=500, detail=transcription)
-
-    txt_path = audio_path + ".txt"
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(transcription)
-
-    prompt_v1 = ("Você é um especialista em " 
-              + area_especialista + 
-              " e vai avaliar a transcrição do audio do aluno que explica o que está fazendo. Deve responder com uma avaliação e sugestões de melhorias, cuidados e pontos de atenção. Considere que o aluno está em um ambiente de aprendizagem e não tem experiência. Também considere que o aluno pode ter dificuldades de comunicação e pode não usar a terminologia correta. Seja gentil e encorajador, mas também honesto e direto. Não use jargões técnicos ou termos complexos. Responda em português. Aluno está realizando essa prática: " 
-              + pratica_descricao + 
-              ". Desta Situação de Aprendizagem: " 
-              + sa_descricao)
-    
-    prompt_v2 = (
-        "Você é um Tutor de Inteligência Artificial especializado em práticas de laboratório de " + area_especialista + " para estudantes de educação profissional e superior. "
-        "Sua tarefa é analisar a transcrição de áudio de um aluno que descreve o que está fazendo em uma atividade prática. "
-        "Com base na transcrição, forneça um feedback pedagógico construtivo para ajudar o aluno a melhorar seu entendimento e execução da prática. "
-        "Inclua uma avaliação geral, sugestões de melhoria, pontos de atenção importantes (especialmente relacionados à segurança) e reconheça os acertos. "
-        "Lembre-se que o aluno está em um ambiente de aprendizado, no turma " + turma + " de contato com o laboratório."
-        "Considere que ele está adquirindo experiência e pode ter dificuldades de comunicação, usando terminologia incorreta ou incompleta."
-        "Seja gentil, paciente e encorajador, mas também honesto e direto em suas observações. "
-        "Use uma linguagem clara e simples, evitando jargões técnicos complexos, como se estivesse conversando diretamente com o aluno no laboratório."
-        "Sua resposta deve ser em português."
-        "O aluno está realizando a seguinte prática: "+ pratica_descricao +", que faz parte da Situação de Aprendizagem: "+ sa_descricao +"."
-        "Foque em avaliar se a descrição do aluno reflete um bom entendimento dos passos, dos parâmetros importantes como  " + parametros_descricao + " , dos cuidados de segurança  e da finalidade da etapa que está realizando."
-        "Não avalie a qualidade da atividade em si, apenas a descrição verbal do aluno sobre suas ações e intenções."
-    )
-    prompt = (
-        "Você é um Tutor IA de laboratório de " + area_especialista + " para estudantes (profissional/superior). "
-        "Analise a transcrição de áudio de um aluno explicando sua prática. "
-        "Forneça feedback pedagógico construtivo (avaliação, sugestões, pontos de atenção - **segurança**!, acertos). "
-        "Considere que é um aluno em aprendizado na turma(" + turma + "), adquirindo experiência, com possíveis dificuldades de comunicação/terminologia. "
-        "Seja gentil, paciente, encorajador, mas direto. Use linguagem simples, sem jargões, como em conversa no lab. "
-        "Resposta em português. "
-        "Prática em Execução: '" + pratica_descricao + "', da Etapa: '" + etapa_descricao + "', da Situação de Aprendizagem: '" + sa_descricao + "'. "
-        "Avalie o entendimento da descrição sobre passos, parâmetros importantes (" + parametros_descricao + "), **cuidados de segurança**, e objetivo da etapa. "
-        "Não avalie a qualidade física da prática, apenas a explicação verbal."
-    )
-
-    llm_response_mistral = call_llm_mistral(transcription, prompt)
-    llm_response_groq = call_llm_groq(transcription, prompt)
-
-    if llm_response_mistral.startswith("Erro"):
-        logging.error(llm_response_mistral)
-        raise HTTPException(status_code=500, detail=llm_response_mistral)
-
-    if llm_response_groq.startswith("Erro"):
-        logging.error(llm_response_groq)
-        raise HTTPException(status_code=500, detail=llm_response_groq)
-
-    try:
-        create_or_update_audio_record(
-            id=id,
-            audio_path=audio_path,            
-            prompt=prompt,
-            transcription=transcription,
-            llm_groq=llm_response_groq,
-            llm_mistral=llm_response_mistral
-        )
-    except Exception as e:
-        logging.exception("Erro ao salvar no banco de dados")
-        raise HTTPException(status_code=500, detail="Erro ao salvar no banco de dados.")
-
-    return JSONResponse(
-        content={
-            "id": id,
-            "audio_path": audio_path,
-            "prompt": prompt,
-            "transcription": transcription,
-            "llm_response_groq": llm_response_groq,
-            "llm_response_mistral": llm_response_mistral
-        }
-    )
\ No newline at end of file
+    return await avaliacao(id, area_especialista, turma, sa_descricao, etapa_descricao, pratica_descricao, parametros_descricao, file, upload_id, stream, idempotency_key)
@@ -0,0 +1,168 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Métricas em memória (por processo) expostas no formato texto do Prometheus
+# em /metrics. Sem dependências externas: contadores e histogramas simples
+# com rótulos, mais coletores chamados na hora da leitura (ex.: pool do banco).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+AUDIO_DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+AUDIO_BYTES_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))  # 64 KB .. 256 MB
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}"
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total) in sorted(self._values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+def register_collector(collect):
+    """
+    Registra uma função chamada a cada leitura de /metrics que retorna uma
+    lista de (nome, tipo, ajuda, [(rótulos dict, valor)]).
+    """
+    _collectors.append(collect)
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# Métricas do pipeline de avaliação
+stage_duration = Histogram(
+    "smartnlp_stage_duration_seconds", "Duração de cada etapa do pipeline.", ["stage"])
+http_request_duration = Histogram(
+    "smartnlp_http_request_duration_seconds", "Duração das requisições HTTP (até o início da resposta).",
+    ["method", "route", "status"])
+provider_errors = Counter(
+    "smartnlp_provider_errors_total", "Erros nas chamadas aos serviços externos (Whisper, LLMs).",
+    ["provider", "reason"])
+llm_tokens = Counter(
+    "smartnlp_llm_tokens_total", "Tokens consumidos informados pelos provedores de LLM.",
+    ["provider", "model", "kind"])
+llm_tokens_saved = Counter(
+    "smartnlp_llm_tokens_saved_total", "Tokens de transcrição economizados pela compactação antes das LLMs.",
+    ["provider", "model"])
+llm_first_token = Histogram(
+    "smartnlp_llm_first_token_seconds", "Tempo até o primeiro trecho das respostas em streaming das LLMs.",
+    ["provider"])
+audio_duration = Histogram(
+    "smartnlp_audio_duration_seconds", "Duração dos áudios recebidos.", buckets=AUDIO_DURATION_BUCKETS)
+audio_bytes = Histogram(
+    "smartnlp_audio_bytes", "Tamanho dos áudios recebidos, antes e depois da normalização.", ["kind"],
+    buckets=AUDIO_BYTES_BUCKETS)
+
+# Tempos das etapas da requisição atual (para o cabeçalho Server-Timing)
+_trace = ContextVar("metrics_trace", default=None)
+
+def start_trace():
+    """
+    Passa a acumular as etapas executadas no contexto atual (e nas tarefas
+    criadas a partir dele). Retorna a lista de (etapa, segundos).
+    """
+    trace = []
+    _trace.set(trace)
+    return trace
+
+@contextmanager
+def stage(name):
+    """
+    Mede a duração do bloco como a etapa `name` (histograma e, se houver,
+    trace da requisição).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+def server_timing(trace):
+    """
+    Formata o trace como cabeçalho Server-Timing (durações em ms).
+    """
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in trace)
+
+def observe_audio(stats):
+    """
+    Registra duração e tamanhos de um áudio a partir das estatísticas de
+    normalização (ver transcribe.normalize_audio).
+    """
+    if not stats:
+        return
+    if stats.get("duration_seconds") is not None:
+        audio_duration.observe(stats["duration_seconds"])
+    if stats.get("original_bytes") is not None:
+        audio_bytes.observe(stats["original_bytes"], kind="original")
+    if stats.get("normalized_bytes") is not None:
+        audio_bytes.observe(stats["normalized_bytes"], kind="normalized")
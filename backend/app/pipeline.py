@@ -0,0 +1,286 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import zipfile
+from uuid import uuid4
+from fastapi import HTTPException
+
+from database import ALLOWED_EXTENSIONS, SessionLocal, upload_path, create_or_update_audio_record, bulk_upsert_audio_records
+from transcribe import transcribe_audio_cached, normalize_audio
+from metrics import stage
+from llm_providers import call_providers, get_policy, is_success, policy_satisfied
+from llm_scheduler import PRIORITY_BATCH, llm_priority
+from prompts import DEFAULT_PROMPT_TEMPLATE, render_prompt, prompt_params
+from uploads import UPLOAD_MAX_BYTES, resolve_upload
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_upload(file, prefix):
+    """
+    Valida a extensão e salva o UploadFile em UPLOAD_DIR (ver upload_path),
+    calculando o SHA-256 do conteúdo durante a cópia.
+    Retorna a tupla (caminho do arquivo salvo, hash hexadecimal).
+    """
+    return save_stream(file.file, file.filename, prefix)
+
+def resolve_audio(file, upload_id, prefix):
+    """
+    Obtém o áudio de uma requisição: um upload já concluído (`upload_id`,
+    ver uploads.py) ou o arquivo enviado no formulário.
+    Retorna a tupla (caminho, hash).
+    """
+    if upload_id:
+        return resolve_upload(upload_id)
+    if file is None:
+        raise HTTPException(status_code=400, detail="Envie o arquivo de áudio ou um upload_id.")
+    return save_upload(file, prefix)
+
+def save_stream(stream, filename, prefix):
+    """
+    Igual a save_upload, mas para qualquer objeto com read() (ex.: membro de um zip).
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
+
+    unique_name = f"{prefix}_{uuid4().hex}{ext}"
+    audio_path = upload_path(unique_name)
+    sha256 = hashlib.sha256()
+    received = 0
+    try:
+        with open(audio_path, "wb") as buffer:
+            while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    break
+                sha256.update(chunk)
+                buffer.write(chunk)
+    except Exception:
+        logging.exception("Erro ao salvar arquivo de áudio")
+        raise HTTPException(status_code=500, detail="Erro ao salvar arquivo de áudio.")
+    if received > UPLOAD_MAX_BYTES:
+        os.remove(audio_path)
+        raise HTTPException(status_code=413, detail=f"Arquivo acima do limite de {UPLOAD_MAX_BYTES} bytes.")
+    return audio_path, sha256.hexdigest()
+
+def save_zip_uploads(file, prefix, max_files=None):
+    """
+    Extrai os áudios de um .zip enviado, ignorando pastas e arquivos com
+    extensão não suportada. Retorna a lista [(nome, caminho, hash)] na
+    ordem alfabética dos nomes. Com mais de `max_files` áudios, recusa o
+    zip antes de extrair; num erro no meio, remove o que já foi extraído.
+    """
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Arquivo zip inválido.")
+    saved = []
+    with archive:
+        members = sorted(
+            (m for m in archive.infolist()
+             if not m.is_dir() and os.path.splitext(m.filename)[1].lower() in ALLOWED_EXTENSIONS),
+            key=lambda m: m.filename,
+        )
+        if max_files is not None and len(members) > max_files:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: áudios acima do limite de arquivos do lote.")
+        try:
+            for member in members:
+                # Usa só o nome base: evita caminhos relativos (zip slip)
+                name = os.path.basename(member.filename)
+                with archive.open(member) as stream:
+                    audio_path, audio_sha256 = save_stream(stream, name, prefix)
+                saved.append((name, audio_path, audio_sha256))
+        except Exception:
+            remove_saved(saved)
+            raise
+    return saved
+
+def remove_saved(saved):
+    """
+    Remove os arquivos [(nome, caminho, hash)] já salvos de uma requisição recusada.
+    """
+    for _, path, _ in saved:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+async def _notify(progress, stage, **data):
+    if progress is not None:
+        await progress(stage, data)
+
+async def run_avaliacao(id, audio_path, audio_sha256, contexto, progress=None, save=True, policy=None, transcription=None, on_delta=None):
+    """
+    Executa o pipeline de avaliação sobre um áudio já salvo:
+    normalização (16 kHz mono), transcrição (Whisper, com cache por `audio_sha256`), LLMs e gravação no banco.
+    As LLMs são chamadas segundo `policy` (ver llm_providers.py; padrão: a
+    política do endpoint /avaliacao/). Com políticas que aceitam resposta
+    degradada, provedores que falharam ficam com resposta None e o erro vai
+    em `llm_errors`.
+    `contexto` traz os campos do formulário usados no prompt.
+    `progress` (opcional) é uma corrotina chamada como progress(etapa, dados)
+    a cada etapa concluída: normalized, transcribing, transcribed, groq, mistral, saved.
+    Com `save=False` o registro não é gravado (usado no lote, que grava
+    tudo de uma vez com bulk_upsert_audio_records).
+    Com `transcription` (já feita durante a gravação, ver live.py) a etapa
+    do Whisper é pulada.
+    Com `on_delta` as LLMs respondem em streaming e cada trecho é repassado
+    como on_delta(provedor, trecho); o registro é gravado com os textos
+    completos ao fim dos streams.
+    Erros são levantados como HTTPException, como nos endpoints.
+    """
+    with stage("normalize"):
+        audio_path, audio_stats = await asyncio.to_thread(normalize_audio, audio_path)
+    await _notify(progress, "normalized", audio=audio_stats)
+
+    if transcription is None:
+        await _notify(progress, "transcribing")
+        with stage("transcribe"):
+            transcription = await transcribe_audio_cached(audio_path, audio_sha256)
+        if transcription.startswith("Erro"):
+            logging.error(transcription)
+            raise HTTPException(status_code=500, detail=transcription)
+    await _notify(progress, "transcribed", transcription=transcription)
+
+    prompt_template = DEFAULT_PROMPT_TEMPLATE
+    prompt = render_prompt(contexto, prompt_template)
+    params = prompt_params(prompt_template, contexto)
+
+    async def _on_result(provider, response):
+        await _notify(progress, provider, ok=is_success(response))
+
+    policy = policy or get_policy("avaliacao")
+    latencies = {}
+    results = await call_providers(transcription, prompt, policy, on_result=_on_result, latencies=latencies, on_delta=on_delta)
+    ok, llm_errors = policy_satisfied(policy, results)
+    for error in llm_errors.values():
+        logging.error(error)
+    if not ok:
+        raise HTTPException(status_code=500, detail=next(iter(llm_errors.values()), "Nenhum provedor de LLM respondeu."))
+    # Provedores que falharam ou não foram usados ficam sem resposta (None)
+    llm_response_groq = results.get("groq") if is_success(results.get("groq")) else None
+    llm_response_mistral = results.get("mistral") if is_success(results.get("mistral")) else None
+    # None para respostas do cache: não entram na latência dos agregados
+    llm_latency_ms = {name: round(seconds * 1000) if seconds is not None else None for name, seconds in latencies.items()}
+
+    if save:
+        try:
+            with stage("db"):
+                async with SessionLocal() as session:
+                    await create_or_update_audio_record(
+                        session,
+                        id=id,
+                        audio_path=audio_path,
+                        prompt_template=prompt_template,
+                        prompt_params=json.dumps(params, ensure_ascii=False),
+                        transcription=transcription,
+                        llm_groq=llm_response_groq,
+                        llm_mistral=llm_response_mistral,
+                        turma=contexto.get("turma"),
+                        area_especialista=contexto.get("area_especialista"),
+                        llm_groq_ms=llm_latency_ms.get("groq"),
+                        llm_mistral_ms=llm_latency_ms.get("mistral"),
+                    )
+        except Exception:
+            logging.exception("Erro ao salvar no banco de dados")
+            raise HTTPException(status_code=500, detail="Erro ao salvar no banco de dados.")
+        await _notify(progress, "saved")
+
+    return {
+        "id": id,
+        "audio_path": audio_path,
+        "audio": audio_stats,
+        "prompt": prompt,
+        "prompt_template": prompt_template,
+        "prompt_params": params,
+        "transcription": transcription,
+        "llm_response_groq": llm_response_groq,
+        "llm_response_mistral": llm_response_mistral,
+        "llm_policy": policy,
+        "llm_errors": llm_errors,
+        "llm_latency_ms": llm_latency_ms,
+        "degraded": bool(llm_errors) or None in results.values(),
+    }
+
+async def run_avaliacao_batch(items, contexto, concurrency):
+    """
+    Avalia vários áudios com o mesmo contexto, no máximo `concurrency` ao
+    mesmo tempo. `items` é uma lista de (id, nome, caminho, hash).
+    Gera um dict por item à medida que cada um termina e, ao final, grava
+    todos os registros bem-sucedidos numa única transação e gera o resumo.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(id, name, audio_path, audio_sha256):
+        # Chamadas do lote cedem a vez às avaliações interativas nos limitadores das LLMs
+        async with semaphore:
+            try:
+                with llm_priority(PRIORITY_BATCH):
+                    result = await run_avaliacao(id, audio_path, audio_sha256, contexto, save=False, policy=get_policy("lote"))
+                return {"id": id, "file": name, "status": "ok", **result}
+            except HTTPException as e:
+                return {"id": id, "file": name, "status": "error", "detail": e.detail}
+            except Exception as e:
+                logging.exception("Erro na avaliação em lote (id=%s)", id)
+                return {"id": id, "file": name, "status": "error", "detail": str(e)}
+
+    tasks = [asyncio.create_task(_one(*item)) for item in items]
+    records = []
+    yielded = set()
+    finished = False
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yielded.add(item["id"])
+            if item["status"] == "ok":
+                records.append(_batch_record(item, contexto))
+            yield item
+        finished = True
+    finally:
+        for task in tasks:
+            task.cancel()
+        if not finished:
+            # Cliente desconectou: grava o que já foi avaliado (e pago),
+            # inclusive os concluídos que ainda não tinham sido enviados
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    item = task.result()
+                    if item["id"] not in yielded and item["status"] == "ok":
+                        records.append(_batch_record(item, contexto))
+            if records:
+                # Tarefa à parte: o cancelamento da resposta não interrompe a gravação
+                await asyncio.shield(asyncio.ensure_future(_save_batch(records)))
+
+    summary = {"status": "done", "total": len(items), "succeeded": len(records), "failed": len(items) - len(records)}
+    try:
+        await _save_batch(records)
+        summary["saved"] = len(records)
+    except Exception:
+        summary.update(status="error", saved=0, detail="Erro ao salvar no banco de dados.")
+    yield summary
+
+def _batch_record(item, contexto):
+    return {
+        "id": item["id"],
+        "audio_path": item["audio_path"],
+        "prompt_template": item["prompt_template"],
+        "prompt_params": json.dumps(item["prompt_params"], ensure_ascii=False),
+        "transcription": item["transcription"],
+        "llm_groq": item["llm_response_groq"],
+        "llm_mistral": item["llm_response_mistral"],
+        "turma": contexto.get("turma"),
+        "area_especialista": contexto.get("area_especialista"),
+        "llm_groq_ms": item["llm_latency_ms"].get("groq"),
+        "llm_mistral_ms": item["llm_latency_ms"].get("mistral"),
+    }
+
+async def _save_batch(records):
+    try:
+        with stage("db_bulk"):
+            async with SessionLocal() as session:
+                await bulk_upsert_audio_records(session, records)
+    except Exception:
+        logging.exception("Erro ao salvar lote no banco de dados")
+        raise
@@ -0,0 +1,129 @@
+import os
+import re
+import json
+from string import Formatter
+
+class PromptTemplate:
+    """
+    Template de prompt versionado. O texto é analisado uma única vez (na
+    importação) em partes literais e campos, e render() só concatena.
+    """
+    def __init__(self, template_id, text):
+        self.id = template_id
+        self.text = text
+        self._parts = [
+            (literal, field)
+            for literal, field, _, _ in Formatter().parse(text)
+        ]
+        self.fields = tuple(dict.fromkeys(field for _, field in self._parts if field))
+        self._pattern = None
+
+    def render(self, params):
+        missing = [f for f in self.fields if f not in params]
+        if missing:
+            raise KeyError(f"Parâmetros ausentes no prompt {self.id}: {', '.join(missing)}")
+        return "".join(
+            literal + (str(params[field]) if field else "")
+            for literal, field in self._parts
+        )
+
+    def match(self, text):
+        """
+        Inverso de render(): extrai os parâmetros de um prompt renderizado
+        com este template, ou None se o texto não corresponde a ele.
+        """
+        if self._pattern is None:
+            seen = set()
+            regex = ""
+            for literal, field in self._parts:
+                regex += re.escape(literal)
+                if field:
+                    regex += f"(?P={field})" if field in seen else f"(?P<{field}>.*?)"
+                    seen.add(field)
+            self._pattern = re.compile(regex, re.DOTALL)
+        found = self._pattern.fullmatch(text)
+        return found.groupdict() if found else None
+
+_TEMPLATES = [
+    PromptTemplate(
+        "tutor-v1",
+        "Você é um especialista em {area_especialista} e vai avaliar a transcrição do audio do aluno que explica o que está fazendo. "
+        "Deve responder com uma avaliação e sugestões de melhorias, cuidados e pontos de atenção. "
+        "Considere que o aluno está em um ambiente de aprendizagem e não tem experiência. "
+        "Também considere que o aluno pode ter dificuldades de comunicação e pode não usar a terminologia correta. "
+        "Seja gentil e encorajador, mas também honesto e direto. Não use jargões técnicos ou termos complexos. "
+        "Responda em português. Aluno está realizando essa prática: {pratica_descricao}. "
+        "Desta Situação de Aprendizagem: {sa_descricao}"
+    ),
+    PromptTemplate(
+        "tutor-v2",
+        "Você é um Tutor de Inteligência Artificial especializado em práticas de laboratório de {area_especialista} para estudantes de educação profissional e superior. "
+        "Sua tarefa é analisar a transcrição de áudio de um aluno que descreve o que está fazendo em uma atividade prática. "
+        "Com base na transcrição, forneça um feedback pedagógico construtivo para ajudar o aluno a melhorar seu entendimento e execução da prática. "
+        "Inclua uma avaliação geral, sugestões de melhoria, pontos de atenção importantes (especialmente relacionados à segurança) e reconheça os acertos. "
+        "Lembre-se que o aluno está em um ambiente de aprendizado, na turma {turma} de contato com o laboratório."
+        "Considere que ele está adquirindo experiência e pode ter dificuldades de comunicação, usando terminologia incorreta ou incompleta."
+        "Seja gentil, paciente e encorajador, mas também honesto e direto em suas observações. "
+        "Use uma linguagem clara e simples, evitando jargões técnicos complexos, como se estivesse conversando diretamente com o aluno no laboratório."
+        "Sua resposta deve ser em português."
+        "O aluno está realizando a seguinte prática: {pratica_descricao}, que faz parte da Situação de Aprendizagem: {sa_descricao}."
+        "Foque em avaliar se a descrição do aluno reflete um bom entendimento dos passos, dos parâmetros importantes como  {parametros_descricao} , dos cuidados de segurança  e da finalidade da etapa que está realizando."
+        "Não avalie a qualidade da atividade em si, apenas a descrição verbal do aluno sobre suas ações e intenções."
+    ),
+    PromptTemplate(
+        "tutor-v3",
+        "Você é um Tutor IA de laboratório de {area_especialista} para estudantes (profissional/superior). "
+        "Analise a transcrição de áudio de um aluno explicando sua prática. "
+        "Forneça feedback pedagógico construtivo (avaliação, sugestões, pontos de atenção - **segurança**!, acertos). "
+        "Considere que é um aluno em aprendizado na turma({turma}), adquirindo experiência, com possíveis dificuldades de comunicação/terminologia. "
+        "Seja gentil, paciente, encorajador, mas direto. Use linguagem simples, sem jargões, como em conversa no lab. "
+        "Resposta em português. "
+        "Prática em Execução: '{pratica_descricao}', da Etapa: '{etapa_descricao}', da Situação de Aprendizagem: '{sa_descricao}'. "
+        "Avalie o entendimento da descrição sobre passos, parâmetros importantes ({parametros_descricao}), **cuidados de segurança**, e objetivo da etapa. "
+        "Não avalie a qualidade física da prática, apenas a explicação verbal."
+    ),
+]
+
+PROMPT_TEMPLATES = {t.id: t for t in _TEMPLATES}
+# Versão usada nas novas avaliações
+DEFAULT_PROMPT_TEMPLATE = os.getenv("PROMPT_TEMPLATE", "tutor-v3")
+if DEFAULT_PROMPT_TEMPLATE not in PROMPT_TEMPLATES:
+    raise ValueError(f"PROMPT_TEMPLATE inválido: {DEFAULT_PROMPT_TEMPLATE}. Opções: {', '.join(PROMPT_TEMPLATES)}")
+
+def get_template(template_id=None):
+    return PROMPT_TEMPLATES[template_id or DEFAULT_PROMPT_TEMPLATE]
+
+def prompt_params(template_id, contexto):
+    """
+    Filtra do contexto só os campos usados pelo template (o que é gravado no banco).
+    """
+    template = get_template(template_id)
+    return {field: contexto[field] for field in template.fields}
+
+def render_prompt(contexto, template_id=None):
+    """
+    Renderiza o prompt com o template informado (ou o padrão).
+    """
+    return get_template(template_id).render(contexto)
+
+def extract_prompt_params(prompt):
+    """
+    Recupera os parâmetros de um prompt já renderizado (registros antigos,
+    que só guardam o texto), tentando cada template.
+    Retorna a tupla (id do template, parâmetros) ou (None, None).
+    """
+    for template in _TEMPLATES:
+        params = template.match(prompt)
+        if params is not None:
+            return template.id, params
+    return None, None
+
+def render_stored_prompt(template_id, params_json):
+    """
+    Renderiza sob demanda o prompt de um registro a partir do id do
+    template e dos parâmetros gravados (JSON).
+    """
+    template = PROMPT_TEMPLATES.get(template_id)
+    if template is None:
+        return None
+    return template.render(json.loads(params_json or "{}"))
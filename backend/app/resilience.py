@@ -0,0 +1,84 @@
+import time
+import random
+from collections import deque
+
+def backoff_delay(attempt, base=1.0, cap=20.0):
+    """
+    Backoff exponencial com jitter total: um valor aleatório entre 0 e
+    min(cap, base * 2^attempt) segundos.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    Circuit breaker simples: após `failure_threshold` falhas seguidas o
+    circuito abre e as chamadas falham na hora durante `reset_timeout`
+    segundos. Depois disso uma chamada de teste é liberada (meio aberto);
+    se der certo o circuito fecha, se falhar abre de novo.
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "half_open":
+            # Libera uma única chamada de teste; as demais seguem falhando rápido
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+
+    def record_failure(self, error=None):
+        self.failures += 1
+        self.last_error = str(error) if error is not None else None
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+class LatencyTracker:
+    """
+    Guarda as últimas `window` latências (segundos) de chamadas bem-sucedidas
+    e calcula percentis sobre essa janela.
+    """
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def to_dict(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self.samples),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+        }
@@ -0,0 +1,240 @@
+import os
+import time
+import fcntl
+import asyncio
+import logging
+from sqlalchemy import select, update
+
+from database import UPLOAD_DIR, ALLOWED_EXTENSIONS, SessionLocal, AudioRecord, upload_path
+from transcribe import normalize_audio
+from uploads import INCOMING_DIR
+
+# Intervalo entre execuções do ciclo de vida (0 desativa a tarefa de fundo)
+STORAGE_LIFECYCLE_INTERVAL_SECONDS = int(os.getenv("STORAGE_LIFECYCLE_INTERVAL_SECONDS", "3600"))
+# Por padrão só gera o relatório; defina false para aplicar as ações
+STORAGE_DRY_RUN = os.getenv("STORAGE_DRY_RUN", "true").lower() == "true"
+# Arquivos mais novos que isso nunca são considerados órfãos (requisições
+# em andamento, uploads ainda não usados)
+STORAGE_ORPHAN_GRACE_SECONDS = int(os.getenv("STORAGE_ORPHAN_GRACE_SECONDS", "86400"))
+# Retenção dos áudios referenciados (0 = sem limite); os registros e textos
+# continuam no banco, só o arquivo de áudio é apagado
+STORAGE_RETENTION_DAYS = float(os.getenv("STORAGE_RETENTION_DAYS", "0"))
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", "0"))
+# Máximo de áudios recodificados por execução
+STORAGE_COMPACT_BATCH = int(os.getenv("STORAGE_COMPACT_BATCH", "100"))
+# Quantos caminhos de exemplo por ação entram no relatório
+STORAGE_REPORT_SAMPLE = 20
+
+LOCK_FILE = os.path.join(UPLOAD_DIR, ".lifecycle.lock")
+
+def _scan(root, exclude=()):
+    """
+    Lista (caminho absoluto, tamanho, mtime) dos arquivos sob `root`,
+    ignorando os diretórios em `exclude` e arquivos ocultos.
+    """
+    files = []
+    exclude = {os.path.abspath(d) for d in exclude}
+    for directory, subdirs, names in os.walk(root):
+        subdirs[:] = [d for d in subdirs if os.path.abspath(os.path.join(directory, d)) not in exclude]
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.abspath(os.path.join(directory, name))
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+    return files
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _remove_empty_dirs(root, keep=()):
+    keep = {os.path.abspath(root)} | {os.path.abspath(d) for d in keep}
+    for directory, _, _ in sorted(os.walk(root), key=lambda entry: -len(entry[0])):
+        if os.path.abspath(directory) not in keep:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+class StorageManager:
+    """
+    Ciclo de vida dos arquivos em UPLOAD_DIR, executado periodicamente em
+    segundo plano:
+    - uploads retomáveis abandonados (incoming/) são removidos;
+    - arquivos sem registro em audio_records (órfãos de requisições com
+      erro, /transcribe/, sidecars .txt etc.) são removidos;
+    - áudios referenciados mais antigos que STORAGE_RETENTION_DAYS e, se o
+      total passar de STORAGE_QUOTA_BYTES, os mais antigos são removidos e
+      o caminho nos registros fica vazio;
+    - áudios referenciados ainda no formato original são recodificados
+      (ver transcribe.normalize_audio) e movidos para o shard (ver
+      database.upload_path), atualizando o caminho no banco.
+    Em dry-run nada é alterado e o relatório lista o que seria feito.
+    """
+    def __init__(self):
+        self.last_report = None
+        self._task = None
+        self._running = asyncio.Lock()
+
+    async def start(self):
+        if STORAGE_LIFECYCLE_INTERVAL_SECONDS > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(STORAGE_LIFECYCLE_INTERVAL_SECONDS)
+            try:
+                await self.run(dry_run=STORAGE_DRY_RUN)
+            except Exception:
+                logging.exception("Erro no ciclo de vida do armazenamento")
+
+    async def run(self, dry_run=True):
+        """
+        Executa uma passada do ciclo de vida e retorna o relatório. Só uma
+        execução por vez, inclusive entre workers (trava em arquivo).
+        """
+        async with self._running:
+            lock = open(LOCK_FILE, "w")
+            try:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return {"status": "skipped", "detail": "Outra execução em andamento."}
+                report = await self._run(dry_run)
+            finally:
+                lock.close()
+        self.last_report = report
+        logging.info(
+            "Ciclo de vida do armazenamento%s: %s",
+            " (dry-run)" if dry_run else "",
+            {name: action["count"] for name, action in report["actions"].items()},
+        )
+        return report
+
+    async def _run(self, dry_run):
+        started = time.time()
+        # bytes: espaço liberado (em dry-run, tamanho atual dos arquivos afetados)
+        actions = {name: {"count": 0, "bytes": 0, "sample": []} for name in (
+            "stale_uploads", "orphans", "sidecars", "retention_age", "retention_quota", "compacted", "resharded")}
+        errors = []
+
+        def _record(name, path, size=0):
+            action = actions[name]
+            action["count"] += 1
+            action["bytes"] += size
+            if len(action["sample"]) < STORAGE_REPORT_SAMPLE:
+                action["sample"].append(path)
+
+        async def _delete(name, path, size):
+            _record(name, path, size)
+            if not dry_run:
+                await asyncio.to_thread(_remove, path)
+
+        # Caminho absoluto -> ids dos registros que o referenciam e caminhos
+        # como gravados (a atualização só vale se o registro não mudou)
+        referenced = {}
+        async with SessionLocal() as session:
+            result = await session.stream(select(AudioRecord.id, AudioRecord.audio_path))
+            async for id, audio_path in result:
+                if audio_path:
+                    ids, stored = referenced.setdefault(os.path.abspath(audio_path), ([], set()))
+                    ids.append(id)
+                    stored.add(audio_path)
+        # Caminho absoluto -> novo caminho no banco ("" para áudio apagado)
+        repointed = {}
+
+        stale_before = started - STORAGE_ORPHAN_GRACE_SECONDS
+        for path, size, mtime in await asyncio.to_thread(_scan, INCOMING_DIR):
+            if mtime < stale_before:
+                await _delete("stale_uploads", path, size)
+
+        kept = []
+        for path, size, mtime in await asyncio.to_thread(_scan, UPLOAD_DIR, [INCOMING_DIR]):
+            if path in referenced:
+                kept.append((path, size, mtime))
+            elif mtime >= stale_before:
+                continue
+            elif os.path.splitext(path)[1].lower() in ALLOWED_EXTENSIONS:
+                await _delete("orphans", path, size)
+            else:
+                await _delete("sidecars", path, size)
+
+        if STORAGE_RETENTION_DAYS > 0:
+            expire_before = started - STORAGE_RETENTION_DAYS * 86400
+            expired = [f for f in kept if f[2] < expire_before]
+            for path, size, _ in expired:
+                await _delete("retention_age", path, size)
+                repointed[path] = ""
+            kept = [f for f in kept if f[2] >= expire_before]
+
+        if STORAGE_QUOTA_BYTES > 0:
+            total = sum(size for _, size, _ in kept)
+            kept.sort(key=lambda f: f[2])
+            while kept and total > STORAGE_QUOTA_BYTES:
+                path, size, _ = kept.pop(0)
+                await _delete("retention_quota", path, size)
+                repointed[path] = ""
+                total -= size
+
+        compact_budget = STORAGE_COMPACT_BATCH
+        for path, size, _ in kept:
+            current = path
+            try:
+                if ".norm." not in os.path.basename(current) and compact_budget > 0:
+                    compact_budget -= 1
+                    if dry_run:
+                        _record("compacted", current, size)
+                    else:
+                        current, stats = await asyncio.to_thread(normalize_audio, current)
+                        if stats:
+                            _record("compacted", path, size - stats["normalized_bytes"])
+                target = os.path.abspath(upload_path(os.path.basename(current), create=not dry_run))
+                if target != current:
+                    _record("resharded", current, 0)
+                    if not dry_run:
+                        await asyncio.to_thread(os.replace, current, target)
+                        current = target
+            except Exception as e:
+                logging.exception("Erro ao compactar/mover %s", path)
+                errors.append(f"{path}: {e}")
+            if current != path:
+                # Mesma forma dos demais registros (relativa a UPLOAD_DIR, se ele for relativo)
+                repointed[path] = upload_path(os.path.basename(current), create=False)
+
+        if repointed and not dry_run:
+            async with SessionLocal() as session:
+                for old, new in repointed.items():
+                    ids, stored = referenced[old]
+                    await session.execute(
+                        update(AudioRecord)
+                        .where(AudioRecord.id.in_(ids), AudioRecord.audio_path.in_(stored))
+                        .values(audio_path=new)
+                    )
+                await session.commit()
+            await asyncio.to_thread(_remove_empty_dirs, UPLOAD_DIR, [INCOMING_DIR])
+
+        return {
+            "status": "ok",
+            "dry_run": dry_run,
+            "started_at": started,
+            "duration_seconds": round(time.time() - started, 3),
+            "referenced_files": len(referenced),
+            "kept_files": len(kept),
+            "kept_bytes": sum(size for _, size, _ in kept),
+            "actions": actions,
+            "errors": errors,
+        }
+
+storage_manager = StorageManager()
@@ -0,0 +1,53 @@
+import json
+import asyncio
+import logging
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from jobs import SSE_KEEPALIVE_SECONDS
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _events(run):
+    queue = asyncio.Queue()
+
+    async def emit(event, data):
+        await queue.put(sse_event(event, data))
+
+    async def _run():
+        try:
+            await run(emit)
+        except HTTPException as e:
+            await emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception:
+            logging.exception("Erro na resposta em streaming")
+            await emit("error", {"status_code": 500, "detail": "Erro interno."})
+        finally:
+            await queue.put(None)
+
+    # Se o cliente desconectar, a tarefa continua até o fim (o registro
+    # ainda é gravado); só os eventos deixam de ser enviados
+    task = asyncio.create_task(_run())
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            # Comentário SSE para manter a conexão viva através do nginx
+            yield ": keepalive\n\n"
+            continue
+        if item is None:
+            break
+        yield item
+    await task
+
+def sse_response(run):
+    """
+    Executa a corrotina run(emit) e transmite como Server-Sent Events cada
+    emit(evento, dados). Exceções viram um evento "error".
+    """
+    return StreamingResponse(
+        _events(run),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
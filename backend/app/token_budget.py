@@ -0,0 +1,216 @@
+import os
+import re
+
+from metrics import llm_tokens_saved
+
+# Desliga a camada (sem compactação nem max_tokens)
+LLM_TOKEN_BUDGET = os.getenv("LLM_TOKEN_BUDGET", "true").lower() == "true"
+# Limites de max_tokens da resposta
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1024"))
+LLM_MIN_TOKENS = int(os.getenv("LLM_MIN_TOKENS", "256"))
+# Transcrições até este tamanho (tokens) seguem intactas: hesitações e
+# repetições também dizem algo sobre a comunicação do aluno
+LLM_TRANSCRIPTION_COMPACT_ABOVE = int(os.getenv("LLM_TRANSCRIPTION_COMPACT_ABOVE", "800"))
+# Tamanho máximo da transcrição enviada; acima disso é cortada por trechos
+LLM_TRANSCRIPTION_MAX_TOKENS = int(os.getenv("LLM_TRANSCRIPTION_MAX_TOKENS", "2000"))
+# Orçamento por chamada: tempo de geração (s) e custo (USD, 0 = sem limite)
+LLM_LATENCY_BUDGET_SECONDS = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", "20"))
+LLM_COST_BUDGET_USD = float(os.getenv("LLM_COST_BUDGET_USD", "0"))
+LLM_TRANSCRIPTION_FILLERS = os.getenv(
+    "LLM_TRANSCRIPTION_FILLERS", "hum,hmm,hm,hã,ãh,ahn,ah,eh,éh,uh,uhm,tipo assim,né")
+
+# Valores por provedor, ajustáveis por modelo com <PROVEDOR>_<NOME>_<MODELO>
+# (modelo em maiúsculas, só letras e números), como as quotas do limitador
+PROVIDER_DEFAULTS = {
+    "groq": {"CONTEXT_TOKENS": 8192, "OUTPUT_TOKENS_PER_SECOND": 250},
+    "mistral": {"CONTEXT_TOKENS": 32000, "OUTPUT_TOKENS_PER_SECOND": 60},
+}
+# Folga para a formatação das mensagens do chat
+CONTEXT_MARGIN_TOKENS = 64
+# Mais longo n-grama repetido em sequência que é removido ("a pipeta a pipeta")
+REPEAT_NGRAM = 4
+# Trechos sem pontuação são divididos a cada tantas palavras para o corte
+SEGMENT_WORDS = 40
+# Fração do orçamento mantida do início da transcrição (o restante vem do fim)
+TRUNCATE_HEAD = 0.6
+TRUNCATE_MARKER = "[...]"
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE = re.compile(r"(?<=[.!?…])\s+")
+_FILLER = re.compile(
+    r"(?<!\w)(?:" + "|".join(sorted(
+        (re.escape(f.strip()) for f in LLM_TRANSCRIPTION_FILLERS.split(",") if f.strip()), key=len, reverse=True,
+    )) + r")(?!\w)",
+    re.IGNORECASE,
+) if LLM_TRANSCRIPTION_FILLERS.strip() else None
+# Vírgulas e espaços que sobram onde a hesitação foi removida ("a pipeta, né."),
+# ou a pontuação de uma frase que era só hesitação ("Hum. Eu fiz. Né.")
+_FILLER_LEFTOVER = re.compile(r"^[\s,.!?…]+|(?<=[.!?…])\s+[,.!?…](?:\s*[,.!?…])*|\s*,(?=\s*(?:[,.!?…]|$))|\s+(?=[,.!?…])")
+
+def count_tokens(text):
+    """
+    Aproximação local de um tokenizador BPE: cada palavra conta um token a
+    cada ~4 caracteres e cada sinal de pontuação, um token.
+    """
+    return sum((len(t) + 3) // 4 for t in _TOKEN.findall(text or ""))
+
+def _setting(provider, name, model, default):
+    model_key = re.sub(r"[^A-Z0-9]", "", model.upper())
+    value = os.getenv(f"{provider.upper()}_{name}_{model_key}") or os.getenv(f"{provider.upper()}_{name}")
+    return float(value) if value else default
+
+def _norm(word):
+    return re.sub(r"\W", "", word).lower()
+
+def _drop_repeats(words):
+    out = []
+    i = 0
+    while i < len(words):
+        for n in range(REPEAT_NGRAM, 0, -1):
+            if len(out) >= n and i + n <= len(words) and \
+                    [_norm(w) for w in words[i:i + n]] == [_norm(w) for w in out[-n:]] and any(_norm(w) for w in out[-n:]):
+                i += n
+                break
+        else:
+            out.append(words[i])
+            i += 1
+    return out
+
+def _segments(text):
+    segments = []
+    for sentence in _SENTENCE.split(text):
+        words = sentence.split()
+        segments.extend(" ".join(words[i:i + SEGMENT_WORDS]) for i in range(0, len(words), SEGMENT_WORDS))
+    return segments
+
+def compact_transcription(text, max_tokens):
+    """
+    Compacta uma transcrição longa: remove hesitações (LLM_TRANSCRIPTION_FILLERS),
+    palavras/expressões repetidas em sequência e frases repetidas (comuns
+    quando o Whisper entra em laço); se ainda passar de `max_tokens`, mantém
+    os trechos do início e do fim e marca o corte com [...].
+    Retorna (texto, truncado).
+    """
+    if _FILLER is not None:
+        text = _FILLER_LEFTOVER.sub("", _FILLER.sub("", text))
+    seen = set()
+    segments = []
+    for segment in _segments(text):
+        segment = " ".join(_drop_repeats(segment.split()))
+        key = _norm(segment)
+        if key and key in seen:
+            continue
+        seen.add(key)
+        segments.append(segment)
+    if count_tokens(" ".join(segments)) <= max_tokens:
+        return " ".join(segments), False
+
+    sizes = [count_tokens(s) for s in segments]
+    budget = max_tokens - count_tokens(TRUNCATE_MARKER)
+    head, used = [], 0
+    for segment, size in zip(segments, sizes):
+        if used + size > budget * TRUNCATE_HEAD:
+            break
+        head.append(segment)
+        used += size
+    tail = []
+    for segment, size in zip(reversed(segments[len(head):]), reversed(sizes[len(head):])):
+        if used + size > budget:
+            break
+        tail.insert(0, segment)
+        used += size
+    return " ".join(head + [TRUNCATE_MARKER] + tail), True
+
+class ModelBudget:
+    """
+    Orçamento de tokens de um provedor/modelo: tamanho da transcrição
+    enviada e max_tokens da resposta, calculados a partir da janela de
+    contexto, da vazão de saída esperada (tokens/s) dentro do
+    LLM_LATENCY_BUDGET_SECONDS e do custo por milhão de tokens dentro do
+    LLM_COST_BUDGET_USD. Acumula os tokens economizados.
+    """
+    def __init__(self, provider, model):
+        defaults = PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["groq"])
+        self.provider = provider
+        self.model = model
+        self.context_tokens = int(_setting(provider, "CONTEXT_TOKENS", model, defaults["CONTEXT_TOKENS"]))
+        self.tokens_per_second = _setting(provider, "OUTPUT_TOKENS_PER_SECOND", model, defaults["OUTPUT_TOKENS_PER_SECOND"])
+        self.latency_budget = _setting(provider, "LATENCY_BUDGET_SECONDS", model, LLM_LATENCY_BUDGET_SECONDS)
+        self.price_input = _setting(provider, "PRICE_INPUT_PER_MTOK", model, 0.0)
+        self.price_output = _setting(provider, "PRICE_OUTPUT_PER_MTOK", model, 0.0)
+        self.stats = {"calls": 0, "compacted": 0, "truncated": 0, "transcription_tokens_saved": 0,
+                      "max_tokens_total": 0, "completion_tokens": 0, "generation_seconds": 0.0}
+
+    def plan(self, prompt, transcription):
+        """
+        Retorna (transcrição a enviar, max_tokens, tokens de entrada estimados).
+        Levanta ValueError se o prompt não deixa espaço na janela de contexto
+        para a transcrição e LLM_MIN_TOKENS de resposta.
+        """
+        prompt_tokens = count_tokens(prompt)
+        original = count_tokens(transcription)
+        limit = min(LLM_TRANSCRIPTION_MAX_TOKENS, self.context_tokens - prompt_tokens - LLM_MIN_TOKENS - CONTEXT_MARGIN_TOKENS)
+        if limit <= 0:
+            raise ValueError(
+                f"prompt de {prompt_tokens} tokens não cabe na janela de {self.context_tokens} tokens do modelo {self.model}")
+        tokens = original
+        if original > min(LLM_TRANSCRIPTION_COMPACT_ABOVE, limit):
+            transcription, truncated = compact_transcription(transcription, limit)
+            tokens = count_tokens(transcription)
+            self.stats["compacted"] += 1
+            self.stats["truncated"] += int(truncated)
+            if original > tokens:
+                self.stats["transcription_tokens_saved"] += original - tokens
+                llm_tokens_saved.inc(original - tokens, provider=self.provider, model=self.model)
+
+        input_tokens = prompt_tokens + tokens
+        caps = [LLM_MAX_TOKENS, self.latency_budget * self.tokens_per_second]
+        if LLM_COST_BUDGET_USD > 0 and self.price_output > 0:
+            caps.append((LLM_COST_BUDGET_USD - input_tokens * self.price_input / 1e6) / (self.price_output / 1e6))
+        room = self.context_tokens - input_tokens - CONTEXT_MARGIN_TOKENS
+        max_tokens = max(1, int(min(max(min(caps), LLM_MIN_TOKENS), room)))
+        self.stats["calls"] += 1
+        self.stats["max_tokens_total"] += max_tokens
+        return transcription, max_tokens, input_tokens
+
+    def record(self, completion_tokens, seconds):
+        """
+        Registra uma resposta para informar a vazão observada (não altera o
+        orçamento, que segue OUTPUT_TOKENS_PER_SECOND).
+        """
+        if completion_tokens:
+            self.stats["completion_tokens"] += completion_tokens
+            self.stats["generation_seconds"] += seconds
+
+    def to_dict(self):
+        stats = self.stats
+        observed = stats["completion_tokens"] / stats["generation_seconds"] if stats["generation_seconds"] else None
+        return {
+            "context_tokens": self.context_tokens,
+            "output_tokens_per_second": self.tokens_per_second,
+            "observed_tokens_per_second": round(observed, 1) if observed else None,
+            "latency_budget_seconds": self.latency_budget,
+            "price_input_per_mtok": self.price_input,
+            "price_output_per_mtok": self.price_output,
+            "avg_max_tokens": round(stats["max_tokens_total"] / stats["calls"]) if stats["calls"] else None,
+            **{k: v for k, v in stats.items() if k not in ("max_tokens_total", "generation_seconds")},
+        }
+
+_budgets = {}
+
+def get_budget(provider, model):
+    key = f"{provider}:{model}"
+    if key not in _budgets:
+        _budgets[key] = ModelBudget(provider, model)
+    return _budgets[key]
+
+def budget_stats():
+    return {
+        "enabled": LLM_TOKEN_BUDGET,
+        "max_tokens": LLM_MAX_TOKENS,
+        "min_tokens": LLM_MIN_TOKENS,
+        "transcription_compact_above": LLM_TRANSCRIPTION_COMPACT_ABOVE,
+        "transcription_max_tokens": LLM_TRANSCRIPTION_MAX_TOKENS,
+        "cost_budget_usd": LLM_COST_BUDGET_USD,
+        "models": {key: budget.to_dict() for key, budget in _budgets.items()},
+    }
@@ -1,81 +1,401 @@
 import os
-import requests
+import re
+import time
+import shutil
+import asyncio
 import logging
+import tempfile
+import threading
 import subprocess
+from urllib.parse import urlsplit
+import httpx
+
+from database import SessionLocal, get_cached_transcription, save_cached_transcription
+from resilience import CircuitBreaker, backoff_delay
+from metrics import provider_errors, stage, observe_audio
 
 WHISPER_API_URL = os.getenv("WHISPER_API_URL", "http://whisper:9000/asr")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "pt")
+# Um ou mais endpoints Whisper (separados por vírgula) para o modo em segmentos
+WHISPER_API_URLS = [u.strip() for u in os.getenv("WHISPER_API_URLS", WHISPER_API_URL).split(",") if u.strip()]
+# Áudios acima deste tamanho (segundos) são divididos e transcritos em paralelo
+WHISPER_CHUNK_THRESHOLD_SECONDS = float(os.getenv("WHISPER_CHUNK_THRESHOLD_SECONDS", "180"))
+WHISPER_MAX_SEGMENT_SECONDS = float(os.getenv("WHISPER_MAX_SEGMENT_SECONDS", "60"))
+WHISPER_PARALLELISM = int(os.getenv("WHISPER_PARALLELISM", "2"))
+WHISPER_SILENCE_NOISE = os.getenv("WHISPER_SILENCE_NOISE", "-30dB")
+WHISPER_SILENCE_MIN_SECONDS = float(os.getenv("WHISPER_SILENCE_MIN_SECONDS", "0.5"))
+
+# Cliente assíncrono: timeout, tentativas, circuit breaker e sonda de prontidão
+WHISPER_TIMEOUT = float(os.getenv("WHISPER_TIMEOUT", "180"))
+WHISPER_MAX_RETRIES = int(os.getenv("WHISPER_MAX_RETRIES", "5"))
+WHISPER_BREAKER_THRESHOLD = int(os.getenv("WHISPER_BREAKER_THRESHOLD", "3"))
+WHISPER_BREAKER_RESET_SECONDS = float(os.getenv("WHISPER_BREAKER_RESET_SECONDS", "30"))
+WHISPER_PROBE_INTERVAL_SECONDS = float(os.getenv("WHISPER_PROBE_INTERVAL_SECONDS", "15"))
+
+# Normalização antes do Whisper: 16 kHz mono em codec compacto (Opus/Ogg)
+AUDIO_NORMALIZE = os.getenv("AUDIO_NORMALIZE", "true").lower() == "true"
+AUDIO_NORMALIZE_CODEC = os.getenv("AUDIO_NORMALIZE_CODEC", "libopus")
+AUDIO_NORMALIZE_BITRATE = os.getenv("AUDIO_NORMALIZE_BITRATE", "24k")
+AUDIO_NORMALIZE_EXT = ".ogg"
+# Tempo máximo de uma normalização; um ffmpeg travado (arquivo corrompido)
+# é encerrado e o áudio segue sem normalização
+AUDIO_NORMALIZE_TIMEOUT_SECONDS = float(os.getenv("AUDIO_NORMALIZE_TIMEOUT_SECONDS", "300"))
+PIPE_CHUNK_SIZE = 64 * 1024
+
+# Contadores do cache de transcrições (por processo)
+transcription_cache_stats = {"hits": 0, "misses": 0}
 
-def transcribe_audio(filepath):
+async def transcribe_audio_cached(filepath, audio_sha256):
     """
-    Usa o Whisper como serviço HTTP para transcrever o áudio.
-    Faz várias tentativas caso o serviço ainda esteja subindo.
-    Melhora o tratamento de resposta inválida e log detalhado.
-    Também trata respostas vazias do Whisper e loga o corpo da resposta.
-    Ajusta a requisição para usar os parâmetros corretos da API Whisper.
+    Consulta o cache de transcrições pelo hash SHA-256 do áudio (e pelo
+    modelo/idioma atuais) antes de chamar o Whisper. Só grava no cache
+    transcrições bem-sucedidas.
     """
-    import time
-    max_retries = 5
-    for attempt in range(max_retries):
+    try:
+        async with SessionLocal() as session:
+            cached = await get_cached_transcription(session, audio_sha256, WHISPER_MODEL, WHISPER_LANGUAGE)
+    except Exception:
+        logging.exception("Erro ao consultar cache de transcrições")
+        cached = None
+    if cached is not None:
+        transcription_cache_stats["hits"] += 1
+        return cached
+
+    transcription_cache_stats["misses"] += 1
+    transcription = await transcribe_audio(filepath)
+    if not transcription.startswith("Erro"):
         try:
-            with open(filepath, "rb") as f:
-                files = {"audio_file": (os.path.basename(filepath), f, "application/octet-stream")}
-                params = {
-                    "encode": "true",
-                    "task": "transcribe",
-                    "language": "pt",
-                    "output": "json"
-                }
-                response = requests.post(
-                    WHISPER_API_URL,
-                    params=params,
-                    files=files,
-                    timeout=180
-                )
-            if response.status_code == 200:
-                content_type = response.headers.get("content-type", "")
-                raw_text = response.text.strip()
-                if raw_text == "":
-                    logging.error(f"Whisper API respondeu 200 mas corpo vazio. Headers: {response.headers}")
-                    raise Exception("Resposta vazia da Whisper API (texto vazio).")
-                try:
-                    result = response.json()
-                    text = result.get("text", "")
-                    if not text.strip():
-                        logging.error(f"Transcrição vazia retornada pela Whisper API. JSON: {result}")
-                        raise Exception("Transcrição vazia retornada pela Whisper API.")
-                    return text.strip()
-                except Exception:
-                    if raw_text:
-                        logging.warning(f"Whisper API retornou texto puro: {raw_text[:200]}")
-                        return raw_text
-                    else:
-                        raise Exception(f"Resposta vazia ou inválida da Whisper API: {response.text}")
-            else:
-                logging.error(f"Whisper API error: {response.status_code} {response.text}")
-                raise Exception(f"Whisper API error: {response.status_code} {response.text}")
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(3)
-            else:
-                logging.error(f"Erro na transcrição após {max_retries} tentativas: {str(e)}")
-                return f"Erro na transcrição: {str(e)}"
-    
-    # Verifica se o arquivo precisa de conversão
-    _, ext = os.path.splitext(filepath)
-    if ext.lower() in ['.m4a', '.aac']:
-        # Converte para WAV usando ffmpeg
+            async with SessionLocal() as session:
+                await save_cached_transcription(session, audio_sha256, WHISPER_MODEL, WHISPER_LANGUAGE, transcription)
+        except Exception:
+            logging.exception("Erro ao gravar cache de transcrições")
+    return transcription
+
+def normalize_audio(filepath):
+    """
+    Transcodifica o áudio para 16 kHz mono em Opus (Ogg), lendo a saída do
+    ffmpeg por pipe direto para o arquivo final, sem arquivos temporários.
+    O original é substituído pelo arquivo normalizado.
+    Retorna a tupla (caminho final, estatísticas); se a normalização estiver
+    desativada, falhar ou passar de AUDIO_NORMALIZE_TIMEOUT_SECONDS, retorna
+    o caminho original e estatísticas None.
+    """
+    base, _ = os.path.splitext(filepath)
+    if not AUDIO_NORMALIZE or base.endswith(".norm"):
+        # Desativado ou já normalizado (ex.: ingestão em passagem única)
+        return filepath, None
+    normalized_path = base + ".norm" + AUDIO_NORMALIZE_EXT
+    original_bytes = os.path.getsize(filepath)
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', filepath,
+        '-vn', '-ac', '1', '-ar', '16000',
+        '-c:a', AUDIO_NORMALIZE_CODEC, '-b:a', AUDIO_NORMALIZE_BITRATE,
+        '-f', 'ogg', 'pipe:1'
+    ]
+    # stderr vai para um arquivo temporário: com os dois em pipe, um ffmpeg
+    # que enche o stderr antes de fechar o stdout travaria a leitura
+    with tempfile.TemporaryFile() as errors:
         try:
-            converted_path = filepath.replace(ext, '.wav')
-            subprocess.run([
-                'ffmpeg', '-i', filepath, 
-                '-acodec', 'pcm_s16le', 
-                '-ar', '16000', 
-                converted_path, '-y'
-            ], check=True, capture_output=True)
-            filepath = converted_path
-            logging.info(f"Arquivo convertido para: {converted_path}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Erro na conversão do áudio: {e}")
-            return f"Erro na conversão do áudio: {e}"
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
         except FileNotFoundError:
-            logging.error("FFmpeg não encontrado. Tentando sem conversão...")
+            logging.warning("FFmpeg não encontrado. Enviando áudio sem normalização.")
+            return filepath, None
+        timed_out = threading.Event()
+
+        def _kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(AUDIO_NORMALIZE_TIMEOUT_SECONDS, _kill)
+        timer.start()
+        try:
+            with open(normalized_path, "wb") as out:
+                while chunk := process.stdout.read(PIPE_CHUNK_SIZE):
+                    out.write(chunk)
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+        errors.seek(0)
+        stderr = errors.read().decode("utf-8", "replace")
+    if returncode != 0 or os.path.getsize(normalized_path) == 0:
+        if timed_out.is_set():
+            logging.error(f"Normalização do áudio {filepath} excedeu {AUDIO_NORMALIZE_TIMEOUT_SECONDS} s")
+        else:
+            logging.error(f"Erro na normalização do áudio {filepath}: {stderr.strip()}")
+        os.remove(normalized_path)
+        return filepath, None
+
+    normalized_bytes = os.path.getsize(normalized_path)
+    os.remove(filepath)
+    stats = {
+        "duration_seconds": get_audio_duration(normalized_path),
+        "original_bytes": original_bytes,
+        "normalized_bytes": normalized_bytes,
+        "reduction": round(1 - normalized_bytes / original_bytes, 4) if original_bytes else 0.0,
+    }
+    logging.info(
+        f"Áudio normalizado: {normalized_path} ({stats['duration_seconds']} s, "
+        f"{original_bytes} -> {normalized_bytes} bytes, redução de {stats['reduction']:.1%})"
+    )
+    observe_audio(stats)
+    return normalized_path, stats
+
+def get_audio_duration(filepath):
+    """
+    Retorna a duração do áudio em segundos (via ffprobe) ou None se não for possível medir.
+    """
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            filepath
+        ], check=True, capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+
+def _detect_silences(filepath):
+    """
+    Lista os intervalos de silêncio (início, fim) detectados pelo ffmpeg.
+    """
+    result = subprocess.run([
+        'ffmpeg', '-hide_banner', '-nostats', '-i', filepath,
+        '-af', f'silencedetect=noise={WHISPER_SILENCE_NOISE}:d={WHISPER_SILENCE_MIN_SECONDS}',
+        '-f', 'null', '-'
+    ], capture_output=True, text=True)
+    starts = [float(x) for x in re.findall(r"silence_start: (-?[\d.]+)", result.stderr)]
+    ends = [float(x) for x in re.findall(r"silence_end: (-?[\d.]+)", result.stderr)]
+    return list(zip(starts, ends))
+
+def _choose_cut_points(duration, silences, max_segment):
+    """
+    Escolhe os pontos de corte: o meio do último silêncio antes de atingir
+    `max_segment` segundos; sem silêncio disponível, corta no limite.
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts = []
+    segment_start = 0.0
+    while duration - segment_start > max_segment:
+        limit = segment_start + max_segment
+        candidates = [m for m in midpoints if segment_start + 1.0 < m <= limit]
+        cut = candidates[-1] if candidates else limit
+        cuts.append(cut)
+        segment_start = cut
+    return cuts
+
+def split_audio_on_silence(filepath, duration, output_dir):
+    """
+    Divide o áudio em segmentos de até WHISPER_MAX_SEGMENT_SECONDS, cortando
+    preferencialmente em silêncios. Retorna a lista ordenada de arquivos.
+    """
+    cuts = _choose_cut_points(duration, _detect_silences(filepath), WHISPER_MAX_SEGMENT_SECONDS)
+    pattern = os.path.join(output_dir, "seg_%04d.wav")
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', filepath]
+    if cuts:
+        command += ['-f', 'segment', '-segment_times', ",".join(f"{c:.3f}" for c in cuts)]
+    else:
+        pattern = os.path.join(output_dir, "seg_0000.wav")
+    command += ['-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le', pattern, '-y']
+    subprocess.run(command, check=True, capture_output=True)
+    return sorted(
+        os.path.join(output_dir, name)
+        for name in os.listdir(output_dir)
+        if name.startswith("seg_")
+    )
+
+async def transcribe_audio_chunked(filepath, duration):
+    """
+    Divide áudios longos em silêncios e envia os segmentos em paralelo
+    (até WHISPER_PARALLELISM ao mesmo tempo) para os endpoints de
+    WHISPER_API_URLS, juntando os textos na ordem original.
+    """
+    output_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(filepath) or None)
+    try:
+        try:
+            segments = await asyncio.to_thread(split_audio_on_silence, filepath, duration, output_dir)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            logging.warning(f"Falha ao dividir o áudio ({e}); usando requisição única.")
+            return await _transcribe_file(filepath, WHISPER_API_URL)
+        logging.info(f"Transcrevendo {filepath} em {len(segments)} segmentos")
+        semaphore = asyncio.Semaphore(max(1, WHISPER_PARALLELISM))
+
+        async def _segment(index, segment):
+            async with semaphore:
+                return await transcribe_segment(segment, index)
+
+        texts = await asyncio.gather(*(_segment(i, seg) for i, seg in enumerate(segments)))
+        for index, text in enumerate(texts):
+            if text.startswith("Erro"):
+                return f"Erro na transcrição do segmento {index + 1}/{len(texts)}: {text}"
+        return " ".join(t for t in texts if t).strip()
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+async def transcribe_segment(filepath, index=0):
+    """
+    Transcreve um segmento de um áudio maior, distribuindo os segmentos
+    entre os endpoints de WHISPER_API_URLS pelo índice.
+    """
+    return await _transcribe_file(filepath, WHISPER_API_URLS[index % len(WHISPER_API_URLS)])
+
+async def transcribe_audio(filepath):
+    """
+    Transcreve o áudio. Arquivos longos (acima de WHISPER_CHUNK_THRESHOLD_SECONDS)
+    são divididos em segmentos e transcritos em paralelo; os curtos seguem
+    em uma única requisição.
+    """
+    duration = await asyncio.to_thread(get_audio_duration, filepath)
+    if duration is not None and duration > WHISPER_CHUNK_THRESHOLD_SECONDS:
+        return await transcribe_audio_chunked(filepath, duration)
+    return await _transcribe_file(filepath, WHISPER_API_URL)
+
+# Cliente HTTP assíncrono do Whisper e estado de saúde por endpoint.
+# Criados/fechados pelo lifespan da aplicação (ver main.py).
+_whisper_client = None
+_probe_task = None
+whisper_breakers = {}
+whisper_status = {}
+
+def _breaker(url):
+    if url not in whisper_breakers:
+        whisper_breakers[url] = CircuitBreaker(
+            f"whisper:{url}",
+            failure_threshold=WHISPER_BREAKER_THRESHOLD,
+            reset_timeout=WHISPER_BREAKER_RESET_SECONDS,
+        )
+        whisper_status[url] = {"ready": None, "last_check": None, "last_error": None}
+    return whisper_breakers[url]
+
+def _get_whisper_client():
+    global _whisper_client
+    if _whisper_client is None:
+        _whisper_client = httpx.AsyncClient(timeout=httpx.Timeout(WHISPER_TIMEOUT, connect=10.0))
+    return _whisper_client
+
+async def init_whisper_client():
+    """
+    Cria o cliente do Whisper e inicia a sonda de prontidão em segundo plano.
+    """
+    global _probe_task
+    _get_whisper_client()
+    for url in dict.fromkeys([WHISPER_API_URL] + WHISPER_API_URLS):
+        _breaker(url)
+    if _probe_task is None:
+        _probe_task = asyncio.create_task(_probe_loop())
+
+async def close_whisper_client():
+    global _whisper_client, _probe_task
+    if _probe_task is not None:
+        _probe_task.cancel()
+        await asyncio.gather(_probe_task, return_exceptions=True)
+        _probe_task = None
+    if _whisper_client is not None:
+        await _whisper_client.aclose()
+        _whisper_client = None
+
+async def probe_whisper(url):
+    """
+    Verifica se o container do Whisper responde na raiz do serviço.
+    Qualquer resposta abaixo de 500 conta como pronto.
+    """
+    parts = urlsplit(url)
+    status = whisper_status[url]
+    breaker = _breaker(url)
+    try:
+        response = await _get_whisper_client().get(f"{parts.scheme}://{parts.netloc}/", timeout=5.0)
+        if response.status_code >= 500:
+            raise Exception(f"HTTP {response.status_code}")
+        status.update(ready=True, last_error=None)
+        breaker.record_success()
+    except Exception as e:
+        status.update(ready=False, last_error=str(e) or e.__class__.__name__)
+        breaker.record_failure(e)
+    status["last_check"] = time.time()
+
+async def _probe_loop():
+    while True:
+        await asyncio.gather(*(probe_whisper(url) for url in list(whisper_breakers)))
+        await asyncio.sleep(WHISPER_PROBE_INTERVAL_SECONDS)
+
+def whisper_health():
+    """
+    Resumo de disponibilidade do Whisper para o /health.
+    """
+    endpoints = {
+        url: {**whisper_status[url], "circuit": breaker.to_dict()}
+        for url, breaker in whisper_breakers.items()
+    }
+    available = any(e["ready"] is not False and e["circuit"]["state"] != "open" for e in endpoints.values())
+    return {"available": available, "endpoints": endpoints}
+
+def _parse_whisper_response(response):
+    """
+    Extrai o texto da resposta 200 do Whisper (JSON ou texto puro).
+    """
+    raw_text = response.text.strip()
+    if raw_text == "":
+        logging.error(f"Whisper API respondeu 200 mas corpo vazio. Headers: {response.headers}")
+        raise ValueError("Resposta vazia da Whisper API (texto vazio).")
+    try:
+        result = response.json()
+    except ValueError:
+        logging.warning(f"Whisper API retornou texto puro: {raw_text[:200]}")
+        return raw_text
+    text = result.get("text", "") if isinstance(result, dict) else ""
+    if not text.strip():
+        logging.error(f"Transcrição vazia retornada pela Whisper API. JSON: {result}")
+        raise ValueError("Transcrição vazia retornada pela Whisper API.")
+    return text.strip()
+
+async def _transcribe_file(filepath, url):
+    """
+    Envia o áudio ao Whisper (serviço HTTP) sem bloquear o event loop.
+    Falhas de conexão e erros 5xx são repetidos até WHISPER_MAX_RETRIES
+    vezes, com backoff exponencial e jitter; com o circuito aberto a chamada
+    falha na hora. Erros 4xx e respostas vazias não são repetidos.
+    """
+    breaker = _breaker(url)
+    params = {
+        "encode": "true",
+        "task": "transcribe",
+        "language": WHISPER_LANGUAGE,
+        "output": "json"
+    }
+    error = None
+    attempt = 0
+    # O arquivo é enviado aos blocos a partir do disco, sem carregá-lo inteiro
+    with open(filepath, "rb") as audio:
+        for attempt in range(WHISPER_MAX_RETRIES + 1):
+            if not breaker.allow():
+                error = f"serviço Whisper indisponível em {url} (circuito aberto)"
+                provider_errors.inc(provider="whisper", reason="circuit_open")
+                break
+            try:
+                audio.seek(0)
+                files = {"audio_file": (os.path.basename(filepath), audio, "application/octet-stream")}
+                with stage("whisper"):
+                    response = await _get_whisper_client().post(url, params=params, files=files)
+            except httpx.HTTPError as e:
+                error = str(e) or e.__class__.__name__
+                provider_errors.inc(provider="whisper", reason=e.__class__.__name__)
+                breaker.record_failure(error)
+            else:
+                if response.status_code == 200:
+                    breaker.record_success()
+                    try:
+                        return _parse_whisper_response(response)
+                    except ValueError as e:
+                        return f"Erro na transcrição: {e}"
+                logging.error(f"Whisper API error: {response.status_code} {response.text}")
+                error = f"Whisper API error: {response.status_code} {response.text}"
+                provider_errors.inc(provider="whisper", reason=f"http_{response.status_code}")
+                if response.status_code < 500:
+                    return f"Erro na transcrição: {error}"
+                breaker.record_failure(error)
+            if attempt < WHISPER_MAX_RETRIES:
+                await asyncio.sleep(backoff_delay(attempt))
+    logging.error(f"Erro na transcrição após {attempt + 1} tentativas: {error}")
+    return f"Erro na transcrição: {error}"
@@ -0,0 +1,270 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from uuid import uuid4
+from fastapi import HTTPException
+
+from database import ALLOWED_EXTENSIONS, UPLOAD_DIR, upload_path
+from metrics import observe_audio
+from transcribe import (
+    AUDIO_NORMALIZE,
+    AUDIO_NORMALIZE_CODEC,
+    AUDIO_NORMALIZE_BITRATE,
+    AUDIO_NORMALIZE_EXT,
+    PIPE_CHUNK_SIZE,
+    normalize_audio,
+    get_audio_duration,
+)
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+# Uploads retomáveis em andamento: arquivo .part + metadados .json
+INCOMING_DIR = os.path.join(UPLOAD_DIR, "incoming")
+os.makedirs(INCOMING_DIR, exist_ok=True)
+
+# Hash incremental dos uploads retomáveis em andamento (por processo):
+# upload_id -> (sha256, bytes já incluídos no hash). Se o estado não
+# corresponder ao deslocamento atual (processo reiniciado ou bloco recebido
+# por outro worker), o hash é recalculado ao finalizar.
+_hashers = {}
+# Upload retomável com um bloco sendo recebido neste processo: um segundo
+# PATCH simultâneo (ex.: repetição do cliente) recebe 409, como no tus
+_appending = {}
+
+# Contêineres que o ffmpeg não consegue ler de um pipe (índice no fim do
+# arquivo): são gravados em disco e normalizados a partir do arquivo.
+NON_STREAMABLE_EXTENSIONS = [".m4a"]
+
+def _check_extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Formato de áudio não suportado.")
+    return ext
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"Arquivo acima do limite de {UPLOAD_MAX_BYTES} bytes.")
+
+def _meta_path(upload_id):
+    if not upload_id.isalnum():
+        raise HTTPException(status_code=404, detail="Upload não encontrado.")
+    return os.path.join(INCOMING_DIR, f"{upload_id}.json")
+
+def _read_meta(upload_id):
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload não encontrado.")
+
+def _write_meta(meta):
+    path = _meta_path(meta["upload_id"])
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+async def ingest_stream(chunks, filename, prefix="upload"):
+    """
+    Ingestão em passagem única: lê o corpo da requisição uma vez e, para
+    cada bloco, aplica o limite de tamanho, atualiza o SHA-256 e envia ao
+    stdin do ffmpeg, cuja saída (16 kHz mono Opus) é gravada direto no
+    arquivo final. O original não é gravado. Sem ffmpeg (ou com
+    AUDIO_NORMALIZE desligado), os blocos vão direto para o disco.
+    Retorna os metadados do upload concluído.
+    """
+    ext = _check_extension(filename)
+    upload_id = uuid4().hex
+    sha256 = hashlib.sha256()
+    received = 0
+    process = None
+    if AUDIO_NORMALIZE and ext not in NON_STREAMABLE_EXTENSIONS:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+                '-vn', '-ac', '1', '-ar', '16000',
+                '-c:a', AUDIO_NORMALIZE_CODEC, '-b:a', AUDIO_NORMALIZE_BITRATE,
+                '-f', 'ogg', 'pipe:1',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            logging.warning("FFmpeg não encontrado. Gravando upload sem normalização.")
+    audio_path = upload_path(f"{prefix}_{upload_id}" + (".norm" + AUDIO_NORMALIZE_EXT if process else ext))
+
+    async def _drain_stdout(out):
+        while chunk := await process.stdout.read(PIPE_CHUNK_SIZE):
+            out.write(chunk)
+
+    try:
+        with open(audio_path, "wb") as out:
+            drain = asyncio.create_task(_drain_stdout(out)) if process else None
+            stderr = asyncio.create_task(process.stderr.read()) if process else None
+            try:
+                async for chunk in chunks:
+                    received += len(chunk)
+                    if received > UPLOAD_MAX_BYTES:
+                        raise _too_large()
+                    sha256.update(chunk)
+                    if process:
+                        try:
+                            process.stdin.write(chunk)
+                            await process.stdin.drain()
+                        except (BrokenPipeError, ConnectionResetError):
+                            # O ffmpeg encerrou antes do fim do corpo (entrada inválida)
+                            await process.wait()
+                            await drain
+                            logging.error(f"Erro na normalização do upload: {(await stderr).decode('utf-8', 'replace').strip()}")
+                            raise HTTPException(status_code=400, detail="Não foi possível decodificar o áudio enviado.")
+                    else:
+                        out.write(chunk)
+                if process:
+                    process.stdin.close()
+                    await drain
+                    if await process.wait() != 0:
+                        logging.error(f"Erro na normalização do upload: {(await stderr).decode('utf-8', 'replace').strip()}")
+                        raise HTTPException(status_code=400, detail="Não foi possível decodificar o áudio enviado.")
+            except BaseException:
+                if process and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if drain:
+                    drain.cancel()
+                raise
+    except BaseException:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        raise
+    if received == 0:
+        os.remove(audio_path)
+        raise HTTPException(status_code=400, detail="Upload vazio.")
+
+    audio_stats = None
+    if not process and AUDIO_NORMALIZE:
+        audio_path, audio_stats = await asyncio.to_thread(normalize_audio, audio_path)
+    elif process:
+        normalized_bytes = os.path.getsize(audio_path)
+        audio_stats = {
+            "duration_seconds": await asyncio.to_thread(get_audio_duration, audio_path),
+            "original_bytes": received,
+            "normalized_bytes": normalized_bytes,
+            "reduction": round(1 - normalized_bytes / received, 4),
+        }
+        observe_audio(audio_stats)
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "status": "complete",
+        "size": received,
+        "offset": received,
+        "audio_path": audio_path,
+        "sha256": sha256.hexdigest(),
+        "audio": audio_stats,
+    }
+    await asyncio.to_thread(_write_meta, meta)
+    return meta
+
+def create_resumable_upload(filename, size):
+    """
+    Inicia um upload retomável de `size` bytes. Os blocos são enviados com
+    append_chunk informando o deslocamento atual.
+    """
+    _check_extension(filename)
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Tamanho do upload inválido.")
+    if size > UPLOAD_MAX_BYTES:
+        raise _too_large()
+    upload_id = uuid4().hex
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "status": "uploading",
+        "size": size,
+        "offset": 0,
+        "part_path": os.path.join(INCOMING_DIR, f"{upload_id}.part"),
+    }
+    open(meta["part_path"], "wb").close()
+    _write_meta(meta)
+    _hashers[upload_id] = (hashlib.sha256(), 0)
+    return meta
+
+def get_upload(upload_id):
+    meta = _read_meta(upload_id)
+    if meta["status"] == "uploading":
+        # O tamanho do .part é a fonte de verdade do deslocamento
+        meta["offset"] = os.path.getsize(meta["part_path"])
+    return meta
+
+async def append_chunk(upload_id, offset, chunks):
+    """
+    Acrescenta um bloco ao upload a partir de `offset` (que deve ser igual
+    aos bytes já recebidos, como no protocolo tus). Ao atingir o tamanho
+    total, o upload é finalizado (hash e normalização). Um bloco enviado
+    enquanto outro do mesmo upload ainda é recebido é recusado com 409.
+    """
+    lock = _appending.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Outro bloco deste upload está sendo recebido.")
+    try:
+        async with lock:
+            return await _append_chunk(upload_id, offset, chunks)
+    finally:
+        if not lock.locked():
+            _appending.pop(upload_id, None)
+
+async def _append_chunk(upload_id, offset, chunks):
+    meta = await asyncio.to_thread(get_upload, upload_id)
+    if meta["status"] != "uploading":
+        raise HTTPException(status_code=409, detail="Upload já finalizado.")
+    if offset != meta["offset"]:
+        raise HTTPException(status_code=409, detail=f"Deslocamento incorreto; esperado {meta['offset']}.")
+    hasher, hashed = _hashers.pop(upload_id, (None, None))
+    if hashed != offset:
+        hasher = None
+    received = offset
+    part = await asyncio.to_thread(open, meta["part_path"], "ab")
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > meta["size"]:
+                await asyncio.to_thread(part.truncate, offset)
+                raise HTTPException(status_code=413, detail="Bloco ultrapassa o tamanho declarado do upload.")
+            if hasher is not None:
+                hasher.update(chunk)
+            await asyncio.to_thread(part.write, chunk)
+    finally:
+        await asyncio.to_thread(part.close)
+    meta["offset"] = received
+    if received < meta["size"]:
+        if hasher is not None:
+            _hashers[upload_id] = (hasher, received)
+        return meta
+    return await asyncio.to_thread(_finalize, meta, hasher)
+
+def _finalize(meta, hasher):
+    upload_id = meta["upload_id"]
+    part_path = meta.pop("part_path")
+    if hasher is None:
+        hasher = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            while chunk := f.read(PIPE_CHUNK_SIZE):
+                hasher.update(chunk)
+    ext = os.path.splitext(meta["filename"])[1].lower()
+    audio_path = upload_path(f"upload_{upload_id}{ext}")
+    os.replace(part_path, audio_path)
+    audio_path, audio_stats = normalize_audio(audio_path)
+    meta.update(status="complete", audio_path=audio_path, sha256=hasher.hexdigest(), audio=audio_stats)
+    _write_meta(meta)
+    return meta
+
+def resolve_upload(upload_id):
+    """
+    Retorna (caminho, sha256) de um upload concluído, para uso nos endpoints
+    de avaliação e transcrição no lugar do arquivo enviado no formulário.
+    """
+    meta = _read_meta(upload_id)
+    if meta["status"] != "complete":
+        raise HTTPException(status_code=409, detail="Upload ainda não concluído.")
+    if not os.path.exists(meta["audio_path"]):
+        raise HTTPException(status_code=410, detail="Arquivo do upload não está mais disponível.")
+    return meta["audio_path"], meta["sha256"]
@@ -0,0 +1,283 @@
+"""
+Benchmark da API: sobe os servidores simulados (stubs.py) e uma instância
+da API apontada para eles, dispara /avaliacao/, /transcribe/ e
+/audio_records/ em níveis de concorrência e grava vazão e latências
+(p50/p95/p99) em JSON para comparar entre execuções.
+
+    python run.py --concurrency 1,4,16 --requests 40 --output atual.json
+    python run.py --output novo.json --baseline atual.json
+
+Com --api-url o benchmark usa uma API já em execução (que deve estar
+configurada para os stubs) em vez de subir uma.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import wave
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+import subprocess
+from datetime import datetime, timezone
+
+import httpx
+
+import stubs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+SCENARIOS = ("avaliacao", "transcribe", "audio_records")
+
+CONTEXTO = {
+    "area_especialista": "Química",
+    "turma": "Técnico em Química - 2º módulo",
+    "sa_descricao": "Análise volumétrica",
+    "etapa_descricao": "Titulação ácido-base",
+    "pratica_descricao": "Padronização de solução de NaOH",
+    "parametros_descricao": "volume gasto, concentração, indicador",
+}
+
+def make_wav(seconds, sample_rate=16000):
+    """
+    WAV mono 16 bits: tom de 440 Hz seguido de silêncio (para o corte por
+    silêncio), com ruído aleatório no fim para que cada áudio tenha um
+    hash diferente e não acerte o cache de transcrição.
+    """
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        value = int(8000 * math.sin(2 * math.pi * 440 * t)) if t % 10 < 8 else 0
+        frames += value.to_bytes(2, "little", signed=True)
+    frames += os.urandom(64)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def _start(cmd, env=None, cwd=None):
+    return subprocess.Popen(cmd, env=env, cwd=cwd)
+
+async def _wait_ready(client, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Serviço não respondeu em {timeout}s: {url}")
+
+class Driver:
+    def __init__(self, client, api_url, audio_seconds):
+        self.client = client
+        self.api_url = api_url.rstrip("/")
+        self.ids = itertools.count(random.randint(1_000_000, 9_000_000))
+        # Áudio base gerado uma vez; cada requisição troca só o ruído final
+        self.audio = make_wav(audio_seconds)
+
+    def _audio(self):
+        return self.audio[:-64] + os.urandom(64)
+
+    async def avaliacao(self):
+        return await self.client.post(
+            f"{self.api_url}/avaliacao/",
+            data={"id": next(self.ids), **CONTEXTO},
+            files={"file": ("bench.wav", self._audio(), "audio/wav")},
+        )
+
+    async def transcribe(self):
+        return await self.client.post(
+            f"{self.api_url}/transcribe/",
+            files={"file": ("bench.wav", self._audio(), "audio/wav")},
+        )
+
+    async def audio_records(self):
+        return await self.client.get(f"{self.api_url}/audio_records/", params={"limit": 20})
+
+async def run_level(driver, scenario, concurrency, requests):
+    call = getattr(driver, scenario)
+    latencies, errors = [], {}
+    remaining = itertools.count()
+
+    async def _worker():
+        while next(remaining) < requests:
+            started = time.perf_counter()
+            try:
+                response = await call()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = e.__class__.__name__
+            elapsed = time.perf_counter() - started
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else None,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(max(latencies)) if latencies else None,
+        },
+    }
+
+def compare(results, baseline):
+    """
+    Imprime a variação de vazão e latências em relação a um resultado anterior.
+    """
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\n{'cenário':<15}{'conc':>5}{'rps':>18}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}", file=sys.stderr)
+    for r in results:
+        old = previous.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+
+        def _cell(new, before):
+            if new is None or not before:
+                return f"{new}"
+            return f"{new} ({(new - before) / before:+.0%})"
+
+        print(
+            f"{r['scenario']:<15}{r['concurrency']:>5}"
+            f"{_cell(r['throughput_rps'], old['throughput_rps']):>18}"
+            + "".join(f"{_cell(r['latency_ms'][q], old['latency_ms'][q]):>22}" for q in ("p50", "p95", "p99")),
+            file=sys.stderr,
+        )
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main(args):
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="smartnlp-bench-")
+    api_url = args.api_url
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            if not api_url:
+                stub_url = f"http://127.0.0.1:{args.stub_port}"
+                processes.append(_start([
+                    sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "--port", str(args.stub_port),
+                    "--asr-latency", str(args.asr_latency), "--asr-latency-per-mb", str(args.asr_latency_per_mb),
+                    "--llm-latency", str(args.llm_latency), "--jitter", str(args.jitter),
+                    "--error-rate", str(args.error_rate),
+                    "--transcription-words", str(args.transcription_words),
+                    "--response-words", str(args.response_words),
+                ]))
+                env = {
+                    **os.environ,
+                    "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                    "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+                    "WHISPER_API_URL": f"{stub_url}/asr",
+                    "GROQ_API_BASE_URL": f"{stub_url}/v1",
+                    "MISTRAL_API_BASE_URL": f"{stub_url}/v1",
+                    "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "bench"),
+                    "MISTRAL_API_KEY": os.getenv("MISTRAL_API_KEY", "bench"),
+                }
+                env.pop("WHISPER_API_URLS", None)
+                api_url = f"http://127.0.0.1:{args.api_port}"
+                processes.append(_start([
+                    sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.api_port),
+                    "--workers", str(args.workers), "--log-level", "warning",
+                ], env=env, cwd=APP_DIR))
+                await _wait_ready(client, f"{stub_url}/")
+            await _wait_ready(client, f"{api_url}/health")
+
+            driver = Driver(client, api_url, args.audio_seconds)
+            results = []
+            for scenario in args.scenarios:
+                for _ in range(args.warmup):
+                    await getattr(driver, scenario)()
+                for concurrency in args.concurrency:
+                    result = await run_level(driver, scenario, concurrency, args.requests)
+                    print(
+                        f"{scenario} c={concurrency}: {result['throughput_rps']} rps, "
+                        f"p50={result['latency_ms']['p50']} p95={result['latency_ms']['p95']} "
+                        f"p99={result['latency_ms']['p99']} ms, erros={result['errors']}",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "api_url": args.api_url or "local",
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def _scenarios(value):
+    names = [v.strip() for v in value.split(",") if v.strip()]
+    invalid = [n for n in names if n not in SCENARIOS]
+    if invalid:
+        raise argparse.ArgumentTypeError(f"cenários inválidos: {', '.join(invalid)}")
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=_scenarios, default=list(SCENARIOS), help="Cenários separados por vírgula")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16], help="Níveis de concorrência, ex.: 1,4,16")
+    parser.add_argument("--requests", type=int, default=40, help="Requisições por nível de concorrência")
+    parser.add_argument("--warmup", type=int, default=2, help="Requisições de aquecimento por cenário")
+    parser.add_argument("--audio-seconds", type=float, default=20, help="Duração do áudio enviado")
+    parser.add_argument("--timeout", type=float, default=300, help="Timeout por requisição (s)")
+    parser.add_argument("--api-url", help="Usa uma API já em execução em vez de subir uma")
+    parser.add_argument("--api-port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1, help="Workers do uvicorn da API")
+    parser.add_argument("--database-url", help="Banco da API (padrão: SQLite temporário)")
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument("--baseline", help="Resultado anterior (JSON) para comparação")
+    stubs.add_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
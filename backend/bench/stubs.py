@@ -0,0 +1,134 @@
+"""
+Servidores simulados do Whisper (/asr) e de LLMs no formato OpenAI
+(/v1/chat/completions), com latência, taxa de erro e tamanho de resposta
+configuráveis. Usados pelo benchmark (run.py) no lugar das APIs pagas.
+
+    python stubs.py --port 9100 --asr-latency 0.8 --llm-latency 1.5 --error-rate 0.02
+
+Aponte a API para eles com:
+    WHISPER_API_URL=http://localhost:9100/asr
+    GROQ_API_BASE_URL=http://localhost:9100/v1
+    MISTRAL_API_BASE_URL=http://localhost:9100/v1
+"""
+import json
+import random
+import asyncio
+import argparse
+import itertools
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "o aluno ajusta a pipeta coloca a amostra na placa verifica a temperatura "
+    "anota o resultado usa luvas e óculos de proteção antes de iniciar a titulação"
+).split()
+
+def _latency(mean, jitter):
+    return max(0.0, random.gauss(mean, mean * jitter)) if mean else 0.0
+
+def _text(words, seed):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def create_app(asr_latency=0.5, llm_latency=1.0, jitter=0.2, error_rate=0.0,
+               transcription_words=150, response_words=250, asr_latency_per_mb=0.0):
+    app = FastAPI(title="SmartNLP benchmark stubs")
+    counter = itertools.count(1)
+    stats = {"asr": 0, "chat": 0, "errors": 0}
+
+    def _fail():
+        if error_rate and random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"error": {"message": "stub: erro simulado"}})
+        return None
+
+    @app.get("/")
+    async def root():
+        return {"status": "ok", **stats}
+
+    @app.post("/asr")
+    async def asr(request: Request):
+        body = await request.body()
+        stats["asr"] += 1
+        await asyncio.sleep(_latency(asr_latency, jitter) + asr_latency_per_mb * len(body) / 1e6)
+        error = _fail()
+        if error:
+            return error
+        # Texto diferente a cada chamada para não acertar o cache de LLM da API
+        n = next(counter)
+        return {"text": f"{n} " + _text(transcription_words, n), "language": "pt"}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        stats["chat"] += 1
+        latency = _latency(llm_latency, jitter)
+        if payload.get("stream"):
+            # Primeiro token após 20% da latência; o restante distribuído
+            # entre as palavras
+            latency *= 0.2
+        await asyncio.sleep(latency)
+        error = _fail()
+        if error:
+            return error
+        prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages", []))
+        content = _text(response_words, next(counter))
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_chars // 4 + len(content) // 4,
+        }
+        if payload.get("stream"):
+            return StreamingResponse(_stream(payload.get("model"), content, usage, latency * 4), media_type="text/event-stream")
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def _stream(model, content, usage, duration):
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(duration / len(words))
+            delta = {"content": word if not index else " " + word}
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        chunk = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+    return app
+
+def add_arguments(parser):
+    parser.add_argument("--asr-latency", type=float, default=0.5, help="Latência média do /asr (s)")
+    parser.add_argument("--asr-latency-per-mb", type=float, default=0.0, help="Latência extra do /asr por MB de áudio (s)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Latência média do chat/completions (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Desvio padrão relativo das latências")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração das chamadas que respondem 503")
+    parser.add_argument("--transcription-words", type=int, default=150, help="Palavras por transcrição")
+    parser.add_argument("--response-words", type=int, default=250, help="Palavras por resposta de LLM")
+
+def app_from_args(args):
+    return create_app(
+        asr_latency=args.asr_latency,
+        llm_latency=args.llm_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        transcription_words=args.transcription_words,
+        response_words=args.response_words,
+        asr_latency_per_mb=args.asr_latency_per_mb,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(app_from_args(args), host=args.host, port=args.port, log_level="warning")
@@ -1,10 +1,39 @@
 CREATE TABLE IF NOT EXISTS audio_records (
     id INTEGER PRIMARY KEY,
     audio_path VARCHAR NOT NULL,
-    prompt TEXT NOT NULL,
+    prompt TEXT,
+    prompt_template VARCHAR,
+    prompt_params TEXT,
     transcription TEXT,
     llm_groq TEXT,
-    llm_mistral TEXT);
+    llm_mistral TEXT,
+    turma VARCHAR,
+    area_especialista VARCHAR,
+    llm_groq_ms INTEGER,
+    llm_mistral_ms INTEGER,
+    -- Busca de texto completo (GET /audio_records/search)
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('portuguese', coalesce(transcription, '')), 'A') ||
+        setweight(to_tsvector('portuguese', coalesce(llm_groq, '')), 'B') ||
+        setweight(to_tsvector('portuguese', coalesce(llm_mistral, '')), 'B')) STORED);
+
+CREATE INDEX IF NOT EXISTS ix_audio_records_search ON audio_records USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS ix_audio_records_turma ON audio_records (turma);
+CREATE INDEX IF NOT EXISTS ix_audio_records_area_especialista ON audio_records (area_especialista);
+
+-- Agregados por turma/área, atualizados a cada gravação (GET /analytics/context)
+CREATE TABLE IF NOT EXISTS audio_record_rollups (
+    turma VARCHAR NOT NULL,
+    area_especialista VARCHAR NOT NULL,
+    records INTEGER NOT NULL DEFAULT 0,
+    transcription_chars INTEGER NOT NULL DEFAULT 0,
+    groq_calls INTEGER NOT NULL DEFAULT 0,
+    groq_errors INTEGER NOT NULL DEFAULT 0,
+    groq_ms_total INTEGER NOT NULL DEFAULT 0,
+    mistral_calls INTEGER NOT NULL DEFAULT 0,
+    mistral_errors INTEGER NOT NULL DEFAULT 0,
+    mistral_ms_total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (turma, area_especialista));
 
 --ALTER TABLE audio_records
 --ADD COLUMN IF NOT EXISTS llm_groq TEXT,
@@ -12,3 +41,11 @@ CREATE TABLE IF NOT EXISTS audio_records (
 --ADD COLUMN IF NOT EXISTS transcription TEXT,
 --ADD COLUMN IF NOT EXISTS prompt TEXT;
 --ADD COLUMN IF NOT EXISTS audio_path VARCHAR NOT NULL;
+
+CREATE TABLE IF NOT EXISTS transcription_cache (
+    audio_sha256 VARCHAR(64) NOT NULL,
+    model VARCHAR NOT NULL,
+    language VARCHAR NOT NULL,
+    transcription TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (audio_sha256, model, language));
@@ -18,10 +18,12 @@ let lastMistralText = "";
 let currentLLM = "groq"; // Controla qual LLM está sendo lida (groq ou mistral)
 let utterance = null;
 
-// PAGINAÇÃO
+// PAGINAÇÃO (por cursor: pageCursors[i] é o cursor da página i + 1)
 let currentPage = 1;
 let pageSize = 10;
 let totalRecords = 0;
+let pageCursors = [null];
+let nextCursor = null;
 
 // Atualiza pageSize ao mudar o seletor
 const pageSizeSelect = document.getElementById('pageSizeSelect');
@@ -29,6 +31,7 @@ if (pageSizeSelect) {
   pageSizeSelect.addEventListener('change', function () {
     pageSize = parseInt(this.value, 10);
     currentPage = 1;
+    pageCursors = [null];
     fetchAndRenderRecords();
   });
 }
@@ -218,7 +221,7 @@ function createPaginationControls() {
   container.innerHTML = `
     <button id="prevPageBtn" ${currentPage === 1 ? "disabled" : ""} title="Página anterior">⟨</button>
     <span>Página ${currentPage} de ${totalPages} (${totalRecords} registros)</span>
-    <button id="nextPageBtn" ${(currentPage >= totalPages) ? "disabled" : ""} title="Próxima página">⟩</button>
+    <button id="nextPageBtn" ${nextCursor === null ? "disabled" : ""} title="Próxima página">⟩</button>
   `;
   document.getElementById('prevPageBtn').onclick = () => {
     if (currentPage > 1) {
@@ -227,17 +230,19 @@ function createPaginationControls() {
     }
   };
   document.getElementById('nextPageBtn').onclick = () => {
-    if (currentPage < totalPages) {
+    if (nextCursor !== null) {
+      pageCursors[currentPage] = nextCursor;
       currentPage++;
       fetchAndRenderRecords();
     }
   };
 }
 
-// Busca registros do backend
+// Busca registros do backend (projeção resumida, paginação por cursor)
 async function fetchAudioRecords(page = 1, size = 10) {
-  const skip = (page - 1) * size;
-  const url = `/api/audio_records/?skip=${skip}&limit=${size}`;
+  const cursor = pageCursors[page - 1];
+  let url = `/api/audio_records/?limit=${size}&view=summary&include_total=true`;
+  if (cursor !== null && cursor !== undefined) url += `&cursor=${cursor}`;
   console.log("Tentando fazer requisição para:", url);
   
   try {
@@ -259,20 +264,23 @@ async function fetchAndRenderRecords() {
   try {
     const data = await fetchAudioRecords(currentPage, pageSize);
     totalRecords = data.total;
+    nextCursor = data.next_cursor;
     resultsTable.innerHTML = "";
     if (!data.items || !Array.isArray(data.items) || data.items.length === 0) {
       resultsTable.innerHTML = `<tr><td colspan="6" style="color:orange; padding:10px;">Nenhum registro encontrado.<br/>total: ${totalRecords}<br/>items: ${JSON.stringify(data.items)}</td></tr>`;
     } else {
       for (const r of data.items) {
         const row = resultsTable.insertRow();
+        // Linha com prévias: o texto completo é buscado ao clicar
+        row.dataset.preview = "1";
         row.insertCell().outerHTML = `<td class="col-id">${r.id}</td>`;
         const statusCell = row.insertCell();
         statusCell.textContent = "OK";
         statusCell.className = "status-ok col-status";
-        row.insertCell().outerHTML = `<td class="col-prompt">${r.prompt || ""}</td>`;
-        row.insertCell().outerHTML = `<td class="col-trans">${r.transcription || ""}</td>`;
-        row.insertCell().outerHTML = `<td class="col-groq">${cleanTextForSpeech(r.llm_groq || "")}</td>`;
-        row.insertCell().outerHTML = `<td class="col-mistral">${cleanTextForSpeech(r.llm_mistral || "")}</td>`;
+        row.insertCell().outerHTML = `<td class="col-prompt"></td>`;
+        row.insertCell().outerHTML = `<td class="col-trans">${r.transcription_preview || ""}</td>`;
+        row.insertCell().outerHTML = `<td class="col-groq">${cleanTextForSpeech(r.llm_groq_preview || "")}</td>`;
+        row.insertCell().outerHTML = `<td class="col-mistral">${cleanTextForSpeech(r.llm_mistral_preview || "")}</td>`;
       }
     }
     createPaginationControls();
@@ -282,7 +290,7 @@ async function fetchAndRenderRecords() {
       <strong>Erro:</strong> ${e.message}<br/>
       <strong>Tipo:</strong> ${e.name}<br/>
       <strong>Stack:</strong> ${e.stack || 'N/A'}<br/>
-      <strong>URL tentativa:</strong> /api/audio_records/?skip=${(currentPage - 1) * pageSize}&limit=${pageSize}
+      <strong>URL tentativa:</strong> /api/audio_records/?limit=${pageSize}&cursor=${pageCursors[currentPage - 1]}
     `;
     resultsTable.innerHTML = `<tr><td colspan="6" style="color:red; padding: 10px; white-space: pre-line;">${errorDetails}</td></tr>`;
   } finally {
@@ -311,6 +319,151 @@ function insertOrUpdateTopRecord(data) {
   row.insertCell().outerHTML = `<td class="col-mistral">${cleanTextForSpeech(data.llm_response_mistral || "")}</td>`;
 }
 
+// Textos exibidos na coluna de status para cada etapa do job
+const JOB_STAGE_LABELS = {
+  queued: "Na fila...",
+  transcribing: "Transcrevendo...",
+  transcribed: "Avaliando (LLMs)...",
+  groq: "Groq concluída...",
+  mistral: "Mistral concluída...",
+  saved: "Salvando...",
+};
+
+// Envia a avaliação como job (202) e acompanha o progresso via SSE.
+// Evita o timeout do proxy em áudios longos; resolve com o resultado final.
+async function submitAvaliacaoJob(formData, statusCell) {
+  const res = await fetch("/api/jobs/avaliacao/", {
+    method: "POST",
+    body: formData
+  });
+  let job;
+  try {
+    job = await res.json();
+  } catch {
+    job = { detail: "Resposta inválida da API" };
+  }
+  if (!res.ok) throw new Error(job.detail || res.statusText);
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(job.events_url);
+    source.addEventListener("stage", e => {
+      const event = JSON.parse(e.data);
+      if (JOB_STAGE_LABELS[event.stage]) statusCell.textContent = JOB_STAGE_LABELS[event.stage];
+    });
+    source.addEventListener("end", e => {
+      source.close();
+      const final = JSON.parse(e.data);
+      if (final.status === "done") resolve(final.result);
+      else reject(new Error(final.error || "Falha na avaliação"));
+    });
+    source.onerror = async () => {
+      // Conexão SSE perdida: consulta o status do job diretamente
+      source.close();
+      try {
+        const statusRes = await fetch(job.status_url);
+        const final = await statusRes.json();
+        if (final.status === "done") resolve(final.result);
+        else if (final.status === "error") reject(new Error(final.error || "Falha na avaliação"));
+        else reject(new Error("Conexão perdida. Job " + job.job_id + " ainda em andamento."));
+      } catch (err) {
+        reject(err);
+      }
+    };
+  });
+}
+
+// Acrescenta a linha de uma avaliação em andamento; retorna as células
+function addPendingRow(id, statusText) {
+  const row = resultsTable.insertRow();
+  row.insertCell().textContent = id;
+  const cells = { status: row.insertCell() };
+  cells.status.textContent = statusText;
+  cells.status.className = "status-processing";
+  for (const name of ["prompt", "trans", "groq", "mistral"]) {
+    cells[name] = row.insertCell();
+    cells[name].textContent = "";
+  }
+  return cells;
+}
+
+// Preenche a linha com o resultado da avaliação e lê a resposta da Groq
+function showEvaluationResult(data, cells) {
+  cells.status.textContent = "OK";
+  cells.status.className = "status-ok";
+  cells.prompt.textContent = data.prompt || "";
+  cells.trans.textContent = data.transcription || "";
+  cells.groq.textContent = cleanTextForSpeech(data.llm_response_groq || "");
+  cells.mistral.textContent = cleanTextForSpeech(data.llm_response_mistral || "");
+  lastGroqText = cleanTextForSpeech(data.llm_response_groq || "");
+  lastMistralText = cleanTextForSpeech(data.llm_response_mistral || "");
+
+  // Habilita controles após resposta
+  document.getElementById('btnSwitchLLM').disabled = false;
+  document.getElementById('btnPlayPause').disabled = false;
+  document.getElementById('btnStop').disabled = false;
+  document.getElementById('speedControl').disabled = false;
+
+  // Dá play automaticamente no Groq
+  currentLLM = "groq";
+  document.getElementById('btnSwitchLLM').textContent = "🔊 Ouvir Groq";
+  document.getElementById('btnPlayPause').click();
+
+  // Atualiza tabela: insere/atualiza registro no topo
+  insertOrUpdateTopRecord(data);
+}
+
+// Avaliação ao vivo: os blocos do MediaRecorder vão por WebSocket durante
+// a gravação e a API transcreve os trechos já concluídos; ao parar, só
+// falta o último trecho e as LLMs. Retorna null se o WebSocket não existir.
+function startLiveSession() {
+  if (!window.WebSocket) return null;
+  const id = document.getElementById('id').value || "1";
+  const protocol = location.protocol === "https:" ? "wss:" : "ws:";
+  const socket = new WebSocket(`${protocol}//${location.host}/api/ws/avaliacao/`);
+  const live = { socket, cells: addPendingRow(id, "Gravando..."), done: false, failed: false };
+  socket.onopen = () => {
+    socket.send(JSON.stringify({
+      type: "start",
+      id: id,
+      area_especialista: document.getElementById('area_especialista').value || "",
+      turma: document.getElementById('semestre_aluno').value || "",
+      sa_descricao: document.getElementById('sa_descricao').value || "",
+      etapa_descricao: document.getElementById('etapa_descricao').value || "",
+      pratica_descricao: document.getElementById('pratica_descricao').value || "",
+      parametros_descricao: document.getElementById('parametros_descricao').value || "",
+      filename: "audio.webm"
+    }));
+  };
+  socket.onmessage = e => {
+    const message = JSON.parse(e.data);
+    if (message.type === "partial" && message.transcription !== undefined) {
+      live.cells.trans.textContent = message.transcription;
+    } else if (message.type === "stage" && JOB_STAGE_LABELS[message.stage]) {
+      live.cells.status.textContent = JOB_STAGE_LABELS[message.stage];
+    } else if (message.type === "delta" && live.cells[message.provider]) {
+      // Tokens das LLMs à medida que chegam; o texto final vem no result
+      live.cells[message.provider].textContent += message.text;
+    } else if (message.type === "result") {
+      live.done = true;
+      showEvaluationResult(message.result, live.cells);
+    } else if (message.type === "error") {
+      live.failed = true;
+      live.cells.status.textContent = "Erro: " + message.detail;
+      live.cells.status.className = "status-error";
+    }
+  };
+  socket.onclose = () => {
+    if (!live.done && !live.failed) {
+      live.failed = true;
+      live.cells.status.textContent = "Conexão perdida. Use Enviar para reenviar o áudio.";
+      live.cells.status.className = "status-error";
+    }
+    // Sem resultado: mantém o áudio gravado para envio pelo botão Enviar
+    if (!live.done && audioBlob) sendBtn.disabled = false;
+  };
+  return live;
+}
+
 form.onsubmit = async function (e) {
   e.preventDefault();
   // Permite envio se houver áudio gravado OU arquivo selecionado
@@ -329,19 +482,8 @@ form.onsubmit = async function (e) {
   const etapa_descricao = document.getElementById('etapa_descricao').value || "";
   const pratica = document.getElementById('pratica_descricao').value || "";
   const parametros_descricao = document.getElementById('parametros_descricao').value || "";
-  const row = resultsTable.insertRow();
-  row.insertCell().textContent = id;
-  const statusCell = row.insertCell();
-  statusCell.textContent = "Processando...";
-  statusCell.className = "status-processing";
-  const promptCell = row.insertCell();
-  promptCell.textContent = "";
-  const transCell = row.insertCell();
-  transCell.textContent = "";
-  const groqCell = row.insertCell();
-  groqCell.textContent = "";
-  const mistralCell = row.insertCell();
-  mistralCell.textContent = "";
+  const cells = addPendingRow(id, "Processando...");
+  const statusCell = cells.status;
 
   pendingCount++;
   spinner.style.display = "block";
@@ -378,47 +520,8 @@ form.onsubmit = async function (e) {
   document.getElementById('btnStop').disabled = true;
   document.getElementById('speedControl').disabled = true;
 
-  fetch("/api/avaliacao/", {
-    method: "POST",
-    body: formData
-  })
-    .then(async res => {
-      let data;
-      try {
-        data = await res.json();
-      } catch {
-        data = { detail: "Resposta inválida da API" };
-      }
-      if (!res.ok) {
-        statusCell.textContent = "Erro: " + (data.detail || res.statusText);
-        statusCell.className = "status-error";
-      } else {
-        statusCell.textContent = "OK";
-        statusCell.className = "status-ok";
-        promptCell.textContent = data.prompt || "";
-        transCell.textContent = data.transcription || "";
-        groqCell.textContent = cleanTextForSpeech(data.llm_response_groq || "");
-        mistralCell.textContent = cleanTextForSpeech(data.llm_response_mistral || "");
-        lastGroqText = cleanTextForSpeech(data.llm_response_groq || "");
-        lastMistralText = cleanTextForSpeech(data.llm_response_mistral || "");
-        document.getElementById('btnPlayPause').disabled = false;
-        document.getElementById('btnStop').disabled = false;
-
-        // Habilita controles após resposta
-        document.getElementById('btnSwitchLLM').disabled = false;
-        document.getElementById('btnPlayPause').disabled = false;
-        document.getElementById('btnStop').disabled = false;
-        document.getElementById('speedControl').disabled = false;
-
-        // Dá play automaticamente no Groq
-        currentLLM = "groq";
-        document.getElementById('btnSwitchLLM').textContent = "🔊 Ouvir Groq";
-        document.getElementById('btnPlayPause').click();
-
-        // Atualiza tabela: insere/atualiza registro no topo
-        insertOrUpdateTopRecord(data);
-      }
-    })
+  submitAvaliacaoJob(formData, statusCell)
+    .then(data => showEvaluationResult(data, cells))
     .catch(err => {
       statusCell.textContent = "Erro: " + err.message;
       statusCell.className = "status-error";
@@ -468,8 +571,6 @@ recordBtn.onclick = async function() {
   if (mediaRecorder && mediaRecorder.state === "recording") {
     mediaRecorder.stop();
     recordBtn.textContent = "Gravar Áudio";
-    recordStatus.textContent = "Gravação finalizada.";
-    sendBtn.disabled = false;
     audioFileInput.value = ""; // Limpa seleção de arquivo ao gravar
     return;
   }
@@ -478,19 +579,33 @@ recordBtn.onclick = async function() {
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
     mediaRecorder = new MediaRecorder(stream);
     audioChunks = [];
+    const live = startLiveSession();
     mediaRecorder.ondataavailable = e => {
-      if (e.data.size > 0) audioChunks.push(e.data);
+      if (e.data.size > 0) {
+        audioChunks.push(e.data);
+        if (live && live.socket.readyState === WebSocket.OPEN) live.socket.send(e.data);
+      }
     };
     mediaRecorder.onstop = () => {
       audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
       audioPlayback.src = URL.createObjectURL(audioBlob);
       audioPlayback.style.display = "block";
       audioPlayback.load();
-      sendBtn.disabled = false;
       audioFileInput.value = ""; // Limpa seleção de arquivo ao gravar novo áudio
-      recordStatus.textContent = "Gravação finalizada.";
+      if (live && live.socket.readyState === WebSocket.OPEN && !live.failed) {
+        // A avaliação já está em andamento pelo WebSocket
+        live.socket.send(JSON.stringify({ type: "stop" }));
+        live.cells.status.textContent = "Transcrevendo...";
+        sendBtn.disabled = true;
+        recordStatus.textContent = "Gravação enviada.";
+      } else {
+        if (live) live.socket.close();
+        sendBtn.disabled = false;
+        recordStatus.textContent = "Gravação finalizada.";
+      }
     };
-    mediaRecorder.start();
+    // Blocos a cada segundo para a transcrição durante a gravação
+    mediaRecorder.start(1000);
     recordBtn.textContent = "Parar Gravação";
     recordStatus.textContent = "Gravando...";
     sendBtn.disabled = true;
@@ -508,8 +623,27 @@ window.addEventListener('DOMContentLoaded', () => {
   fetchAndRenderRecords();
 });
 
+// Substitui as prévias de uma linha pelo registro completo
+async function loadFullRecord(row) {
+  if (!row || row.dataset.preview !== "1") return;
+  const id = row.cells[0].textContent.trim();
+  const res = await fetch(`/api/audio_records/${id}`);
+  if (!res.ok) return;
+  const r = await res.json();
+  row.cells[2].textContent = r.prompt || "";
+  row.cells[3].textContent = r.transcription || "";
+  row.cells[4].textContent = cleanTextForSpeech(r.llm_groq || "");
+  row.cells[5].textContent = cleanTextForSpeech(r.llm_mistral || "");
+  delete row.dataset.preview;
+}
+
 // Adiciona evento para puxar Groq/Mistral para o controle de áudio ao clicar na célula correspondente
-resultsTable.parentElement.addEventListener('click', function (event) {
+resultsTable.parentElement.addEventListener('click', async function (event) {
+  const row = event.target.closest('tr');
+  if (row && row.dataset.preview === "1" && event.target.closest('td.col-groq, td.col-mistral, td.col-trans')) {
+    await loadFullRecord(row);
+  }
+
   // Groq
   const groqCell = event.target.closest('td.col-groq');
   if (groqCell) {